@@ -13,19 +13,119 @@
 # limitations under the License.
 
 
+import asyncio
+import functools
 import logging
-from typing import Optional
+import threading
+import weakref
+from typing import Dict, MutableMapping, Optional
 
 import httpx
 
+from auth.client import async_client_registry, client_registry
 from auth.constants import CONSTANTS
-from auth.login import Login
+from auth.login import AsyncLogin, Login
 from utils.config import Config
+from utils.filelock import FileLock
 
 logger = logging.getLogger(__name__)
 
+_async_locks: MutableMapping[asyncio.AbstractEventLoop, Dict[str, asyncio.Lock]] = (
+    weakref.WeakKeyDictionary()
+)
+_async_locks_guard = threading.Lock()
 
-class AuthenticationManager:
+
+def _async_lock(path: str) -> asyncio.Lock:
+    """Returns the lock serialising the logins of the running event loop for `path`."""
+    loop = asyncio.get_running_loop()
+    with _async_locks_guard:
+        locks = _async_locks.setdefault(loop, {})
+        if path not in locks:
+            locks[path] = asyncio.Lock()
+        return locks[path]
+
+
+async def _acquire_file_lock(lock: FileLock):
+    """Takes a `FileLock` without tying up an executor thread while it is held elsewhere."""
+    while not lock.acquire(blocking=False):
+        await asyncio.sleep(CONSTANTS["LOCK_POLL_INTERVAL"])
+
+
+def _apply_token(cookies: httpx.Cookies, token: str):
+    """Puts the stored token into a cookie jar unless it already holds it."""
+    if not token or any(
+        cookie.name == "token" and cookie.value == token for cookie in cookies.jar
+    ):
+        return
+    cookies.delete("token")
+    cookies.set("token", token)
+
+
+def _apply_cookies(cookies: httpx.Cookies, stored: Dict[str, str]):
+    """Adds the cookies stored by a login, possibly of another process, to a cookie jar."""
+    present = {cookie.name for cookie in cookies.jar}
+    for name, value in stored.items():
+        if name != "token" and name not in present:
+            cookies.set(name, value)
+
+
+class BaseAuthenticationManager:
+    r"""
+    Base of the synchronous and asynchronous authentication managers.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A class holding the configuration of one account and the helpers both managers share for
+    reading and storing its token. It sends no requests; `AuthenticationManager` and
+    `AsyncAuthenticationManager` add the blocking and the awaitable sign-in methods.
+
+    ----
+
+    Attributes
+    ----------
+    config : Config
+        Object holding the configurations and settings.
+    """
+
+    def __init__(self, config: Optional[Config] = None):
+        """
+        Creates instances needed for the Authentication Manager.
+
+        Parameters
+        ----------
+        config : Config, optional
+            Configuration holding the account's credentials and token. Defaults to 'config.ini'.
+        """
+        self.config = config or Config()
+
+    def _login_completed_while_waiting(self, email: str, token_before: str) -> bool:
+        """Checks whether another thread or process stored a fresh token for `email`."""
+        self.config.reload()
+        token = self.config.get_token()["token"]
+        return bool(token) and token != token_before and self._has_valid_token(email)
+
+    def _save_authentication_data(self, email, password, cookies, expiry=None):
+        token = cookies.get("token")
+        logger.debug(f"Token found: {token} (expires: {expiry})")
+
+        with self.config.transaction():
+            self.config.set_login_details(email=email, password=password)
+            self.config.set_token(
+                token=token, expire_date=expiry.isoformat() if expiry else ""
+            )
+            # Lets every process using this configuration reuse the login's session
+            self.config.set_cookies(dict(cookies))
+
+        return True
+
+    def _has_valid_token(self, email: str) -> bool:
+        """Checks whether the stored token belongs to `email` and is not about to expire."""
+        if self.config.get_login_details()["email"] != email:
+            return False
+        return self.config.is_token_valid(CONSTANTS["TOKEN_REFRESH_MARGIN"])
+
+
+class AuthenticationManager(BaseAuthenticationManager):
     r"""
     Authentication manager for Hugging Face APIs.
     ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -45,8 +145,10 @@ class AuthenticationManager:
         Setups authentication using the given credentials and persists them into the configuration file.
     tear_down_authentication()
         Tears down the authentication by removing stored authentication info from the configuration file.
+    ensure_authentication(email: str, password: str) -> bool
+        Reuses the stored token while it is valid and only signs in again when it is not.
     authenticate() -> Optional[httpx.Client]
-        Performs authentication using saved credentials and yields an authenticated HTTP client instance.
+        Performs authentication using saved credentials and yields the pooled, authenticated HTTP client.
 
     Example
     -------
@@ -58,14 +160,13 @@ class AuthenticationManager:
     >>> session = auth_manager.authenticate()
     """
 
-    def __init__(self):
-        """Creates instances needed for the Authentication Manager."""
-        self.config = Config()
-
     def set_up_authentication(self, email: str, password: str) -> bool:
         """
         Set up authentication using the given credentials and persist them into the configuration file.
 
+        Logins for the same configuration file are single-flight across threads and processes:
+        a caller that had to wait for a concurrent login reuses its token instead of signing in again.
+
         Parameters
         ----------
         email : str
@@ -78,13 +179,23 @@ class AuthenticationManager:
         bool
             Indicates whether the setup was successful or not.
         """
+        token_before = self.config.get_token()["token"]
+        with FileLock(self.config.lock_path):
+            if self._login_completed_while_waiting(email, token_before):
+                logger.debug("Reusing the token of a concurrent login.")
+                return True
+            return self._sign_in(email, password)
+
+    def _sign_in(self, email: str, password: str) -> bool:
         login = Login(email, password)
 
         if login.sign_in_with_email():
             cookies = login.get_cookies()
 
             try:
-                return self._save_authentication_data(email, password, cookies)
+                return self._save_authentication_data(
+                    email, password, cookies, login.get_token_expiry()
+                )
             except Exception as e:
                 logger.error(
                     f"Encountered unexpected error during saving credential data: {str(e)}"
@@ -94,22 +205,44 @@ class AuthenticationManager:
             logger.error("Failed to complete authentication.")
             return False
 
-    def _save_authentication_data(self, email, password, cookies):
-        self.config.set_login_details(email=email, password=password)
+    def ensure_authentication(self, email: str, password: str) -> bool:
+        """
+        Reuses the stored token while it is valid and only signs in again when it is not.
 
-        token = cookies.get("token")
-        logger.debug(f"Token found: {token}")
-        self.config.set_token(token=token)
+        Parameters
+        ----------
+        email : str
+            User's email address
+        password : str
+            User's password
 
-        return True
+        Returns
+        -------
+        bool
+            Indicates whether a usable token is stored.
+        """
+        if self._has_valid_token(email):
+            logger.debug("Stored token is still valid, skipping login.")
+            return True
+        return self.set_up_authentication(email, password)
 
     def tear_down_authentication(self):
         """Removes stored authentication information from the configuration file."""
-        self.config.delete_section("TOKENS")
+        self.config.delete_section("TOKEN")
+
+    def _refresh_expired_token(self, email: str, password: str):
+        """Signs in again before handing out a session whose token has already expired."""
+        if not self.config.is_token_valid() and email:
+            logger.info("Stored token has expired, signing in again.")
+            self.set_up_authentication(email, password)
 
     def authenticate(self) -> Optional[httpx.Client]:
         """
-        Perform authentication using saved credentials and generates an authenticated HTTP client instance.
+        Perform authentication using saved credentials and returns the authenticated HTTP client.
+
+        The client is the pooled one that `set_up_authentication` signed in with, so its cookies
+        and keep-alive connections are reused. It is owned by `auth.client.client_registry` and
+        must not be closed by the caller.
 
         Returns
         -------
@@ -118,12 +251,172 @@ class AuthenticationManager:
         """
         try:
             user_data = self.config.load_auth_data()
+            email, password = str(user_data["email"]), str(user_data["password"])
+            self._refresh_expired_token(email, password)
 
-            return httpx.Client(
-                auth=httpx.BasicAuth(user_data["email"], user_data["password"]),
-                headers={"User-Agent": CONSTANTS["USER_AGENT"]},
-                cookies=self.config.get_token(),
+            client = client_registry.get(email, auth=httpx.BasicAuth(email, password))
+            _apply_cookies(client.cookies, self.config.get_cookies())
+            _apply_token(client.cookies, self.config.get_token()["token"])
+            return client
+        except FileNotFoundError:
+            logger.warning(
+                "Configuration file containing authentication data does not exist."
             )
+            return None
+        except KeyError as e:
+            logger.warning(f"Missing key '{e}' within loaded authentication data.")
+            return None
+        except Exception as e:
+            logger.error(f"Encountered unexpected exception: {str(e)}")
+            return None
+
+
+class AsyncAuthenticationManager(BaseAuthenticationManager):
+    r"""
+    Asynchronous authentication manager for Hugging Face APIs.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    The `httpx.AsyncClient` counterpart of `AuthenticationManager`. Credentials and tokens are
+    persisted through the same `Config` methods; the blocking file writes run in the default
+    executor so they do not stall the event loop.
+
+    ----
+
+    Attributes
+    ----------
+    config : Config
+        Object holding the configurations and settings.
+
+    Methods
+    -------
+    set_up_authentication(email: str, password: str) -> bool
+        Setups authentication using the given credentials and persists them into the configuration file.
+    ensure_authentication(email: str, password: str) -> bool
+        Reuses the stored token while it is valid and only signs in again when it is not.
+    tear_down_authentication()
+        Tears down the authentication by removing stored authentication info from the configuration file.
+    authenticate() -> Optional[httpx.AsyncClient]
+        Performs authentication using saved credentials and yields the pooled, authenticated async HTTP client.
+
+    Example
+    -------
+    >>> from auth.auth_manager import AsyncAuthenticationManager
+    >>>
+    >>> auth_manager = AsyncAuthenticationManager()
+    >>> await auth_manager.set_up_authentication(email, password)
+    True
+    >>> session = await auth_manager.authenticate()
+    """
+
+    async def set_up_authentication(self, email: str, password: str) -> bool:
+        """
+        Set up authentication using the given credentials and persist them into the configuration file.
+
+        Logins for the same configuration file are single-flight across coroutines, threads and
+        processes: a caller that had to wait for a concurrent login reuses its token instead of
+        signing in again. Waiting callers hold no executor thread, and a cancelled caller gives
+        the lock up.
+
+        Parameters
+        ----------
+        email : str
+            User's email address
+        password : str
+            User's password
+
+        Returns
+        -------
+        bool
+            Indicates whether the setup was successful or not.
+        """
+        token_before = self.config.get_token()["token"]
+        lock = FileLock(self.config.lock_path)
+        # One coroutine of the loop at a time polls for the file lock and logs in
+        async with _async_lock(lock.path):
+            await _acquire_file_lock(lock)
+            try:
+                if await self._run_in_executor(
+                    self._login_completed_while_waiting, email, token_before
+                ):
+                    logger.debug("Reusing the token of a concurrent login.")
+                    return True
+                return await self._sign_in_async(email, password)
+            finally:
+                lock.release()
+
+    async def _sign_in_async(self, email: str, password: str) -> bool:
+        login = AsyncLogin(email, password)
+
+        if await login.sign_in_with_email():
+            cookies = login.get_cookies()
+
+            try:
+                return await self._run_in_executor(
+                    self._save_authentication_data,
+                    email,
+                    password,
+                    cookies,
+                    login.get_token_expiry(),
+                )
+            except Exception as e:
+                logger.error(
+                    f"Encountered unexpected error during saving credential data: {str(e)}"
+                )
+                return False
+        else:
+            logger.error("Failed to complete authentication.")
+            return False
+
+    async def ensure_authentication(self, email: str, password: str) -> bool:
+        """
+        Reuses the stored token while it is valid and only signs in again when it is not.
+
+        Parameters
+        ----------
+        email : str
+            User's email address
+        password : str
+            User's password
+
+        Returns
+        -------
+        bool
+            Indicates whether a usable token is stored.
+        """
+        if self._has_valid_token(email):
+            logger.debug("Stored token is still valid, skipping login.")
+            return True
+        return await self.set_up_authentication(email, password)
+
+    async def tear_down_authentication(self):
+        """Removes stored authentication information from the configuration file."""
+        await self._run_in_executor(self.config.delete_section, "TOKEN")
+
+    async def authenticate(self) -> Optional[httpx.AsyncClient]:
+        """
+        Perform authentication using saved credentials and returns the authenticated async HTTP client.
+
+        The client is owned by `auth.client.async_client_registry` and must not be closed by the
+        caller; close the registry with `aclose_all()` before the event loop shuts down.
+
+        Returns
+        -------
+        httpx.AsyncClient | None
+            Instance of authenticated async HTTP Client or None if authentication fails.
+        """
+        try:
+            user_data = self.config.load_auth_data()
+            email, password = str(user_data["email"]), str(user_data["password"])
+            if not self.config.is_token_valid() and email:
+                logger.info("Stored token has expired, signing in again.")
+                await self.set_up_authentication(email, password)
+
+            client = async_client_registry.get(
+                email, auth=httpx.BasicAuth(email, password)
+            )
+            _apply_cookies(client.cookies, self.config.get_cookies())
+            _apply_token(client.cookies, self.config.get_token()["token"])
+            return client
         except FileNotFoundError:
             logger.warning(
                 "Configuration file containing authentication data does not exist."
@@ -135,3 +428,9 @@ class AuthenticationManager:
         except Exception as e:
             logger.error(f"Encountered unexpected exception: {str(e)}")
             return None
+
+    @staticmethod
+    async def _run_in_executor(func, *args):
+        """Runs a blocking `Config` operation in the default executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args))
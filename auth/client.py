@@ -0,0 +1,292 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import atexit
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+import httpx
+
+from auth.constants import CONSTANTS
+
+logger = logging.getLogger(__name__)
+
+
+class _BaseClientRegistry:
+    """Pool settings shared by the synchronous and asynchronous client registries."""
+
+    def __init__(
+        self,
+        limits: Optional[httpx.Limits] = None,
+        timeout: Optional[httpx.Timeout] = None,
+    ):
+        self.limits = limits or httpx.Limits(
+            max_connections=CONSTANTS["MAX_CONNECTIONS"],
+            max_keepalive_connections=CONSTANTS["MAX_KEEPALIVE_CONNECTIONS"],
+            keepalive_expiry=CONSTANTS["KEEPALIVE_EXPIRY"],
+        )
+        self.timeout = timeout or httpx.Timeout(CONSTANTS["TIMEOUT"])
+        self._lock = threading.Lock()
+
+    def _client_options(self, auth: Optional[httpx.Auth]) -> Dict[str, Any]:
+        """Returns the keyword arguments shared by every pooled client."""
+        return {
+            "auth": auth,
+            "headers": {"User-Agent": CONSTANTS["USER_AGENT"]},
+            "limits": self.limits,
+            "timeout": self.timeout,
+        }
+
+
+class ClientRegistry(_BaseClientRegistry):
+    r"""
+    Registry of pooled HTTP clients.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A class that hands out one long-lived `httpx.Client` per key (usually the account email),
+    so the login request and every later authenticated request share the same cookie jar
+    and the same pool of keep-alive connections.
+
+    ----
+
+    Attributes
+    ----------
+    limits : httpx.Limits
+        Connection pool limits applied to every client created by the registry.
+    timeout : httpx.Timeout
+        Timeout applied to every client created by the registry.
+    transport : httpx.BaseTransport | None
+        Transport applied to every client created by the registry (e.g. a proxy or a mock).
+
+    Methods
+    -------
+    get(key: str = "default", auth: httpx.Auth | None = None) -> httpx.Client:
+        Returns the client registered under `key`, creating it on first use.
+    close(key: str):
+        Closes and forgets the client registered under `key`.
+    close_all():
+        Closes every client held by the registry.
+
+    Example
+    -------
+    >>> from auth.client import client_registry
+    >>>
+    >>> client = client_registry.get("user@example.com")
+    >>> client is client_registry.get("user@example.com")
+    True
+    """
+
+    def __init__(
+        self,
+        limits: Optional[httpx.Limits] = None,
+        timeout: Optional[httpx.Timeout] = None,
+        transport: Optional[httpx.BaseTransport] = None,
+    ):
+        """
+        Constructs all the necessary attributes for the ClientRegistry object.
+
+        Parameters
+        ----------
+            limits : httpx.Limits, optional
+                Connection pool limits. Defaults to the values in `CONSTANTS`.
+            timeout : httpx.Timeout, optional
+                Request timeout. Defaults to the value in `CONSTANTS`.
+            transport : httpx.BaseTransport, optional
+                Transport used by the created clients. Defaults to httpx's pooled HTTP transport.
+        """
+        super().__init__(limits=limits, timeout=timeout)
+        self.transport = transport
+        self._clients: Dict[str, httpx.Client] = {}
+
+    def get(
+        self, key: str = "default", auth: Optional[httpx.Auth] = None
+    ) -> httpx.Client:
+        """
+        Returns the client registered under `key`, creating it on first use.
+
+        Parameters
+        ----------
+            key : str
+                Name of the client, e.g. the account email. Defaults to 'default'.
+            auth : httpx.Auth, optional
+                Authentication used when the client has to be created.
+
+        Returns
+        -------
+        httpx.Client
+            The pooled HTTP client.
+        """
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None or client.is_closed:
+                logger.debug(f"Creating pooled HTTP client '{key}'.")
+                client = httpx.Client(
+                    transport=self.transport, **self._client_options(auth)
+                )
+                self._clients[key] = client
+            return client
+
+    def close(self, key: str):
+        """
+        Closes and forgets the client registered under `key`.
+
+        Parameters
+        ----------
+            key : str
+                Name of the client to close.
+        """
+        with self._lock:
+            client = self._clients.pop(key, None)
+        if client is not None:
+            logger.debug(f"Closing pooled HTTP client '{key}'.")
+            client.close()
+
+    def close_all(self):
+        """Closes every client held by the registry."""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            client.close()
+
+    def __enter__(self) -> "ClientRegistry":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close_all()
+
+
+class AsyncClientRegistry(_BaseClientRegistry):
+    r"""
+    Registry of pooled asynchronous HTTP clients.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    The `httpx.AsyncClient` counterpart of `ClientRegistry`. Async clients are bound to the
+    event loop they are first used on, so the registry has to be closed from that loop with
+    `aclose_all()` before it shuts down.
+
+    ----
+
+    Attributes
+    ----------
+    limits : httpx.Limits
+        Connection pool limits applied to every client created by the registry.
+    timeout : httpx.Timeout
+        Timeout applied to every client created by the registry.
+    transport : httpx.AsyncBaseTransport | None
+        Transport applied to every client created by the registry (e.g. a proxy or a mock).
+
+    Methods
+    -------
+    get(key: str = "default", auth: httpx.Auth | None = None) -> httpx.AsyncClient:
+        Returns the client registered under `key`, creating it on first use.
+    aclose(key: str):
+        Closes and forgets the client registered under `key`.
+    aclose_all():
+        Closes every client held by the registry.
+
+    Example
+    -------
+    >>> from auth.client import async_client_registry
+    >>>
+    >>> client = async_client_registry.get("user@example.com")
+    >>> await async_client_registry.aclose_all()
+    """
+
+    def __init__(
+        self,
+        limits: Optional[httpx.Limits] = None,
+        timeout: Optional[httpx.Timeout] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        """
+        Constructs all the necessary attributes for the AsyncClientRegistry object.
+
+        Parameters
+        ----------
+            limits : httpx.Limits, optional
+                Connection pool limits. Defaults to the values in `CONSTANTS`.
+            timeout : httpx.Timeout, optional
+                Request timeout. Defaults to the value in `CONSTANTS`.
+            transport : httpx.AsyncBaseTransport, optional
+                Transport used by the created clients. Defaults to httpx's pooled HTTP transport.
+        """
+        super().__init__(limits=limits, timeout=timeout)
+        self.transport = transport
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def get(
+        self, key: str = "default", auth: Optional[httpx.Auth] = None
+    ) -> httpx.AsyncClient:
+        """
+        Returns the client registered under `key`, creating it on first use.
+
+        Parameters
+        ----------
+            key : str
+                Name of the client, e.g. the account email. Defaults to 'default'.
+            auth : httpx.Auth, optional
+                Authentication used when the client has to be created.
+
+        Returns
+        -------
+        httpx.AsyncClient
+            The pooled asynchronous HTTP client.
+        """
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None or client.is_closed:
+                logger.debug(f"Creating pooled async HTTP client '{key}'.")
+                client = httpx.AsyncClient(
+                    transport=self.transport, **self._client_options(auth)
+                )
+                self._clients[key] = client
+            return client
+
+    async def aclose(self, key: str):
+        """
+        Closes and forgets the client registered under `key`.
+
+        Parameters
+        ----------
+            key : str
+                Name of the client to close.
+        """
+        with self._lock:
+            client = self._clients.pop(key, None)
+        if client is not None:
+            logger.debug(f"Closing pooled async HTTP client '{key}'.")
+            await client.aclose()
+
+    async def aclose_all(self):
+        """Closes every client held by the registry."""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            await client.aclose()
+
+    async def __aenter__(self) -> "AsyncClientRegistry":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose_all()
+
+
+client_registry = ClientRegistry()
+atexit.register(client_registry.close_all)
+
+async_client_registry = AsyncClientRegistry()
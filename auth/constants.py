@@ -13,11 +13,23 @@
 # limitations under the License.
 
 import os
+from typing import Any, Dict
 
-CONSTANTS = {
+CONSTANTS: Dict[str, Any] = {
     "USER_AGENT": (
         "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko)"
     ),
     "DEFAULT_PATH_DIR": os.path.dirname(os.path.abspath(__file__)),
     "LOGIN_URL": "https://huggingface.co/login",
+    # Connection pool settings shared by every pooled HTTP client
+    "MAX_CONNECTIONS": 20,
+    "MAX_KEEPALIVE_CONNECTIONS": 10,
+    "KEEPALIVE_EXPIRY": 30.0,
+    "TIMEOUT": 30.0,
+    # Seconds before the token expires at which it is considered due for a refresh
+    "TOKEN_REFRESH_MARGIN": 300,
+    # Seconds a rate-limited account is skipped when the server sends no Retry-After
+    "ACCOUNT_COOLDOWN": 300.0,
+    # Seconds between async attempts to take a config lock held by another thread or process
+    "LOCK_POLL_INTERVAL": 0.05,
 }
@@ -0,0 +1,128 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import httpx
+
+from auth.constants import CONSTANTS
+
+
+class AccountUnavailableError(httpx.HTTPStatusError):
+    """
+    Raised when HuggingChat rate-limits an account (429) or sends it to the login page.
+
+    `retry_after` holds the server's Retry-After in seconds, if it sent one, and `account`
+    the email of the account the failed request was sent with, if it is known.
+    """
+
+    def __init__(
+        self,
+        message: str,
+        *,
+        request: httpx.Request,
+        response: httpx.Response,
+        retry_after: Optional[float] = None,
+        account: Optional[str] = None,
+    ):
+        super().__init__(message, request=request, response=response)
+        self.retry_after = retry_after
+        self.account = account
+
+
+class SessionExpiredError(AccountUnavailableError):
+    """
+    Raised when HuggingChat rejects an account's session (401) or sends it to the login page.
+
+    The account itself is usable: signing in again renews the session, so it is not cooled
+    down like a rate-limited one.
+    """
+
+
+class NoSessionAvailableError(RuntimeError):
+    """Raised when no account of a pool can be authenticated or every one is cooling down."""
+
+
+def parse_retry_after(value: str) -> Optional[float]:
+    """
+    Parses a Retry-After header into seconds.
+
+    Parameters
+    ----------
+        value : str
+            The header value, either a number of seconds or an HTTP date.
+
+    Returns
+    -------
+    float | None
+        The seconds to wait, never negative, or None if the value is missing or malformed.
+    """
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            date = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=timezone.utc)
+        seconds = (date - datetime.now(timezone.utc)).total_seconds()
+    return max(seconds, 0.0) if math.isfinite(seconds) else None
+
+
+def check_account(response: httpx.Response, account: Optional[str] = None):
+    """
+    Raises `AccountUnavailableError` if a response shows that its account cannot be used.
+
+    Parameters
+    ----------
+        response : httpx.Response
+            The response to a request made with an account's session.
+        account : str, optional
+            The email of that account, recorded on the error. Defaults to None.
+
+    Raises
+    ------
+    AccountUnavailableError
+        On a 429 response.
+    SessionExpiredError
+        On a 401 response or a redirect to the login page.
+    """
+    if response.status_code == 429:
+        raise AccountUnavailableError(
+            f"Account rate-limited for '{response.request.url}'",
+            request=response.request,
+            response=response,
+            retry_after=parse_retry_after(response.headers.get("Retry-After", "")),
+            account=account,
+        )
+    login_path = httpx.URL(CONSTANTS["LOGIN_URL"]).path
+    location = response.headers.get("Location", "") if response.is_redirect else ""
+    if (
+        response.status_code == 401
+        or login_path in location
+        or response.url.path == login_path
+    ):
+        raise SessionExpiredError(
+            f"Account sent to the login page for '{response.request.url}'",
+            request=response.request,
+            response=response,
+            account=account,
+        )
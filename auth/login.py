@@ -14,15 +14,25 @@
 
 
 import logging
-from typing import Dict
+from datetime import datetime, timezone
+from typing import Dict, Optional
 
 import httpx
 
+from auth.client import async_client_registry, client_registry
 from auth.constants import CONSTANTS
 
 logger = logging.getLogger(__name__)
 
 
+def _token_expiry(cookies: httpx.Cookies) -> Optional[datetime]:
+    """Returns the expiry of the 'token' cookie, or None for a session cookie."""
+    for cookie in cookies.jar:
+        if cookie.name == "token" and cookie.expires is not None:
+            return datetime.fromtimestamp(cookie.expires, tz=timezone.utc)
+    return None
+
+
 class Login:
     r"""
     Login handler for Hugging Face APIs.
@@ -39,12 +49,14 @@ class Login:
     password : str
         User's password
     _client : httpx.Client
-        HTTP client for making requests
+        Pooled HTTP client for making requests, shared with the authenticated session
 
     Methods
     -------
     get_cookies() -> Dict[str, str]:
         Returns a dictionary of cookie names and values from the last HTTP response.
+    get_token_expiry() -> Optional[datetime]:
+        Returns the expiry of the 'token' cookie set by the last login.
     sign_in_with_email() -> bool:
         Signs in to the Huggingface account using the provided email and password.
 
@@ -57,7 +69,9 @@ class Login:
     True
     """
 
-    def __init__(self, email: str, password: str):
+    def __init__(
+        self, email: str, password: str, client: Optional[httpx.Client] = None
+    ):
         """
         Constructs all the necessary attributes for the Login object.
 
@@ -67,12 +81,13 @@ class Login:
             User's email address
         password : str
             User's password
+        client : httpx.Client, optional
+            HTTP client to sign in with. Defaults to the pooled client registered for `email`.
         """
         self.email = email
         self.password = password
-        self._client = httpx.Client(
-            auth=httpx.BasicAuth(email, password),
-            headers={"User-Agent": CONSTANTS["USER_AGENT"]},
+        self._client = client or client_registry.get(
+            email, auth=httpx.BasicAuth(email, password)
         )
 
     def get_cookies(self) -> Dict[str, str]:
@@ -86,6 +101,17 @@ class Login:
         """
         return dict(self._client.cookies.items())
 
+    def get_token_expiry(self) -> Optional[datetime]:
+        """
+        Returns the expiry of the 'token' cookie set by the last login.
+
+        Returns
+        -------
+        datetime | None
+            The expiry as an aware UTC datetime, or None if the cookie has no expiry.
+        """
+        return _token_expiry(self._client.cookies)
+
     def sign_in_with_email(self) -> bool:
         """
         Signs in to the Huggingface account using the provided email and password.
@@ -111,3 +137,109 @@ class Login:
             )
         logger.debug("Login successful")
         return True
+
+
+class AsyncLogin:
+    r"""
+    Asynchronous login handler for Hugging Face APIs.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    The `httpx.AsyncClient` counterpart of `Login`, for use inside an event loop.
+
+    ----
+
+    Attributes
+    ----------
+    email : str
+        User's email address
+    password : str
+        User's password
+    _client : httpx.AsyncClient
+        Pooled asynchronous HTTP client for making requests, shared with the authenticated session
+
+    Methods
+    -------
+    get_cookies() -> Dict[str, str]:
+        Returns a dictionary of cookie names and values from the last HTTP response.
+    get_token_expiry() -> Optional[datetime]:
+        Returns the expiry of the 'token' cookie set by the last login.
+    sign_in_with_email() -> bool:
+        Signs in to the Huggingface account using the provided email and password.
+
+    Example
+    -------
+    >>> from auth.login import AsyncLogin
+    >>>
+    >>> login = AsyncLogin(email, password)
+    >>> await login.sign_in_with_email()
+    True
+    """
+
+    def __init__(
+        self, email: str, password: str, client: Optional[httpx.AsyncClient] = None
+    ):
+        """
+        Constructs all the necessary attributes for the AsyncLogin object.
+
+        Parameters
+        ----------
+        email : str
+            User's email address
+        password : str
+            User's password
+        client : httpx.AsyncClient, optional
+            HTTP client to sign in with. Defaults to the pooled client registered for `email`.
+        """
+        self.email = email
+        self.password = password
+        self._client = client or async_client_registry.get(
+            email, auth=httpx.BasicAuth(email, password)
+        )
+
+    def get_cookies(self) -> Dict[str, str]:
+        """
+        Returns a dictionary of cookie names and values from the last HTTP response.
+
+        Returns
+        -------
+        dict
+            A dictionary of cookie names and values.
+        """
+        return dict(self._client.cookies.items())
+
+    def get_token_expiry(self) -> Optional[datetime]:
+        """
+        Returns the expiry of the 'token' cookie set by the last login.
+
+        Returns
+        -------
+        datetime | None
+            The expiry as an aware UTC datetime, or None if the cookie has no expiry.
+        """
+        return _token_expiry(self._client.cookies)
+
+    async def sign_in_with_email(self) -> bool:
+        """
+        Signs in to the Huggingface account using the provided email and password.
+
+        Raises
+        ------
+        httpx.HTTPStatusError
+            If the HTTP response status code is not 302 (Redirection), an error is raised.
+
+        Returns
+        -------
+        bool
+            True if login is successful, False otherwise.
+        """
+        data = {"username": self.email, "password": self.password}
+        response = await self._client.post(url=CONSTANTS["LOGIN_URL"], data=data)
+        if response.status_code != 302:
+            request = self._client.build_request("POST", url=CONSTANTS["LOGIN_URL"])
+            raise httpx.HTTPStatusError(
+                f"Login failed with status code {response.status_code}",
+                request=request,
+                response=response,
+            )
+        logger.debug("Login successful")
+        return True
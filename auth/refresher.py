@@ -0,0 +1,153 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+from auth.auth_manager import AuthenticationManager
+from auth.constants import CONSTANTS
+
+logger = logging.getLogger(__name__)
+
+
+class TokenRefresher:
+    r"""
+    Background token refresher.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A daemon thread that signs in again with the stored credentials shortly before the
+    stored token expires, so requests never go out with an expired session.
+
+    ----
+
+    Attributes
+    ----------
+    auth_manager : AuthenticationManager
+        Authentication manager whose configuration holds the credentials and the token.
+    margin : float
+        Number of seconds before the expiry at which the token is refreshed.
+    retry_interval : float
+        Number of seconds to wait after a failed refresh, or when the expiry is unknown.
+
+    Methods
+    -------
+    start():
+        Starts the background thread.
+    stop():
+        Stops the background thread and waits for it to finish.
+    seconds_until_refresh() -> float:
+        Returns the number of seconds until the next refresh is due.
+
+    Example
+    -------
+    >>> from auth.refresher import TokenRefresher
+    >>>
+    >>> refresher = TokenRefresher(auth_manager)
+    >>> refresher.start()
+    >>> refresher.stop()
+    """
+
+    def __init__(
+        self,
+        auth_manager: AuthenticationManager,
+        margin: float = CONSTANTS["TOKEN_REFRESH_MARGIN"],
+        retry_interval: float = 60.0,
+    ):
+        """
+        Constructs all the necessary attributes for the TokenRefresher object.
+
+        Parameters
+        ----------
+            auth_manager : AuthenticationManager
+                Authentication manager whose configuration holds the credentials and the token.
+            margin : float
+                Number of seconds before the expiry at which the token is refreshed.
+            retry_interval : float
+                Number of seconds to wait after a failed refresh, or when the expiry is unknown.
+        """
+        self.auth_manager = auth_manager
+        self.margin = margin
+        self.retry_interval = retry_interval
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def seconds_until_refresh(self) -> float:
+        """
+        Returns the number of seconds until the next refresh is due.
+
+        Returns
+        -------
+        float
+            Seconds until `margin` seconds before the expiry, 0 if the refresh is overdue, or
+            `retry_interval` if the expiry is unknown.
+        """
+        config = self.auth_manager.config
+        if not config.is_logged_in:
+            return 0.0
+        expiry = config.token_expiry()
+        if expiry is None:
+            return self.retry_interval
+        remaining = (expiry - datetime.now(timezone.utc)).total_seconds()
+        return max(remaining - self.margin, 0.0)
+
+    def _refresh(self) -> bool:
+        credentials = self.auth_manager.config.user_credentials
+        if not credentials["email"]:
+            logger.warning("No stored credentials, cannot refresh the token.")
+            return False
+        try:
+            return self.auth_manager.set_up_authentication(
+                str(credentials["email"]), str(credentials["password"])
+            )
+        except Exception as e:
+            logger.error(f"Token refresh failed: {str(e)}")
+            return False
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            delay = self.seconds_until_refresh()
+            if delay > 0:
+                self._stop_event.wait(delay)
+                continue
+            logger.info("Token is about to expire, refreshing it.")
+            if not self._refresh() or self.seconds_until_refresh() == 0:
+                # Back off instead of spinning when the new token is not long-lived either
+                self._stop_event.wait(self.retry_interval)
+
+    def start(self):
+        """Starts the background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="token-refresher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background thread and waits for it to finish."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "TokenRefresher":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
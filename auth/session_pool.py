@@ -0,0 +1,609 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import glob
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+import httpx
+
+from auth.auth_manager import AuthenticationManager
+from auth.constants import CONSTANTS
+from auth.errors import (
+    AccountUnavailableError,
+    NoSessionAvailableError,
+    SessionExpiredError,
+)
+from utils.config import Config
+from utils.profiles import ProfileIndex
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _Account:
+    """Bookkeeping for one account of the pool."""
+
+    __slots__ = ("email", "auth_manager", "in_flight", "served", "cooldown_until")
+
+    def __init__(self, email: str, auth_manager: AuthenticationManager):
+        self.email = email
+        self.auth_manager = auth_manager
+        self.in_flight = 0
+        self.served = 0
+        self.cooldown_until = 0.0
+        self.sync_cooldown()
+
+    def sync_cooldown(self):
+        """Adopts a later cooldown stored by another process sharing the configuration."""
+        cooldown = self.auth_manager.config.get_cooldown()
+        if cooldown is not None:
+            self.cooldown_until = max(self.cooldown_until, cooldown.timestamp())
+
+
+class SessionPool:
+    r"""
+    Pool of authenticated sessions for several accounts.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A class that holds one `AuthenticationManager` per account and hands out the session of
+    the least-loaded account for every request, spreading work over the per-account rate
+    limits of HuggingChat.
+
+    An account that is rate-limited is put in cooldown, which is stored in its configuration
+    so it survives restarts and reaches every process sharing the account directory;
+    `call()` and `stream()` then retry the request right away on another account. An account
+    whose session expired signs in again and retries first, and is only cooled down if the
+    new session is rejected as well.
+
+    ----
+
+    Attributes
+    ----------
+    directory : str
+        The directory holding one configuration file per account.
+    suffix : str
+        The suffix of the account configuration files, which selects their storage backend.
+
+    Methods
+    -------
+    from_directory(directory: str = "accounts", suffix: str = ".ini") -> SessionPool:
+        Builds a pool from every account configuration found in `directory`.
+    from_index(profiles: ProfileIndex, names: Iterable[str] | None = None) -> SessionPool:
+        Builds a pool from indexed profiles, loading only the selected ones.
+    add_account(email: str, password: str) -> bool:
+        Authenticates an account and adds it to the pool.
+    remove_account(email: str):
+        Removes an account from the pool.
+    sign_in() -> List[str]:
+        Authenticates every pooled account ahead of its first request.
+    accounts -> List[str]:
+        Returns the email addresses of the pooled accounts.
+    load() -> Dict[str, int]:
+        Returns the number of in-flight requests per account.
+    session() -> Iterator[httpx.Client]:
+        Context manager yielding the session of the least-loaded account.
+    lease(exclude: Iterable[str] = ()) -> Iterator[Tuple[str, httpx.Client]]:
+        Context manager yielding the email and session of the least-loaded account.
+    mark_unavailable(email: str, retry_after: float | None = None):
+        Puts an account in cooldown.
+    cooldowns() -> Dict[str, float]:
+        Returns the remaining cooldown in seconds per cooling account.
+    call(request: Callable[[str, httpx.Client], T]) -> T:
+        Runs a request, failing over to another account when one is unavailable.
+    stream(request: Callable[[str, httpx.Client], Iterator[T]]) -> Iterator[T]:
+        Streams a request, failing over to another account until the first item arrives.
+
+    Example
+    -------
+    >>> from auth.session_pool import SessionPool
+    >>>
+    >>> pool = SessionPool()
+    >>> pool.add_account(email, password)
+    True
+    >>> with pool.session() as session:
+    ...     session.get("https://huggingface.co/chat")
+    """
+
+    def __init__(self, directory: str = "accounts", suffix: str = ".ini"):
+        """
+        Constructs all the necessary attributes for the SessionPool object.
+
+        Parameters
+        ----------
+            directory : str
+                The directory holding one configuration file per account. Defaults to 'accounts'.
+            suffix : str
+                The suffix of the account configuration files. Defaults to '.ini'.
+        """
+        self.directory = directory
+        self.suffix = suffix
+        self._accounts: Dict[str, _Account] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_directory(
+        cls, directory: str = "accounts", suffix: str = ".ini"
+    ) -> "SessionPool":
+        """
+        Builds a pool from every account configuration found in `directory`.
+
+        Parameters
+        ----------
+            directory : str
+                The directory holding one configuration file per account. Defaults to 'accounts'.
+            suffix : str
+                The suffix of the account configuration files. Defaults to '.ini'.
+
+        Returns
+        -------
+        SessionPool
+            A pool holding every account with stored credentials.
+        """
+        pool = cls(directory, suffix)
+        for filename in sorted(glob.glob(os.path.join(directory, f"*{suffix}"))):
+            config = Config(filename=filename)
+            email = config.get_login_details()["email"]
+            if email:
+                pool._add(email, AuthenticationManager(config))
+            else:
+                logger.warning(f"Skipping '{filename}' without stored credentials.")
+        return pool
+
+    @classmethod
+    def from_index(
+        cls, profiles: ProfileIndex, names: Optional[Iterable[str]] = None
+    ) -> "SessionPool":
+        """
+        Builds a pool from indexed profiles, loading only the selected ones.
+
+        Parameters
+        ----------
+            profiles : ProfileIndex
+                The index of account profiles.
+            names : Iterable[str], optional
+                The names of the profiles to pool. Defaults to every indexed profile.
+
+        Returns
+        -------
+        SessionPool
+            A pool holding the selected profiles.
+        """
+        pool = cls(profiles.directory, profiles.suffix)
+        selected = [p.name for p in profiles] if names is None else names
+        for name in selected:
+            profile = profiles.get(name)
+            if profile is None:
+                logger.warning(f"Skipping unknown profile '{name}'.")
+                continue
+            pool._add(profile.email, AuthenticationManager(profiles.config(name)))
+        return pool
+
+    @classmethod
+    def from_credentials(
+        cls,
+        credentials: Iterable[Tuple[str, str]],
+        directory: str = "accounts",
+        suffix: str = ".ini",
+    ) -> "SessionPool":
+        """
+        Builds a pool from (email, password) pairs, signing in where no valid token is stored.
+
+        Parameters
+        ----------
+            credentials : Iterable[Tuple[str, str]]
+                The (email, password) pairs of the accounts.
+            directory : str
+                The directory holding one configuration file per account. Defaults to 'accounts'.
+            suffix : str
+                The suffix of the account configuration files. Defaults to '.ini'.
+
+        Returns
+        -------
+        SessionPool
+            A pool holding every account that could be authenticated.
+        """
+        pool = cls(directory, suffix)
+        for email, password in credentials:
+            pool.add_account(email, password)
+        return pool
+
+    def _add(self, email: str, auth_manager: AuthenticationManager):
+        with self._lock:
+            self._accounts[email] = _Account(email, auth_manager)
+
+    def add_account(self, email: str, password: str) -> bool:
+        """
+        Authenticates an account and adds it to the pool.
+
+        Parameters
+        ----------
+            email : str
+                User's email address
+            password : str
+                User's password
+
+        Returns
+        -------
+        bool
+            True if the account was authenticated and added, False otherwise.
+        """
+        auth_manager = AuthenticationManager(
+            Config.for_account(email, self.directory, self.suffix)
+        )
+        try:
+            authenticated = auth_manager.ensure_authentication(email, password)
+        except httpx.HTTPError as e:
+            logger.error(f"Failed to authenticate account '{email}': {str(e)}")
+            authenticated = False
+        if authenticated:
+            self._add(email, auth_manager)
+        return authenticated
+
+    def add_config(self, config: Config) -> bool:
+        """
+        Adds the account of an existing configuration to the pool, reusing its stored token.
+
+        The account only signs in when the stored token is missing or about to expire, and its
+        token and cookies stay in `config` instead of a new file in the pool directory.
+
+        Parameters
+        ----------
+            config : Config
+                The configuration holding the account's login details and token.
+
+        Returns
+        -------
+        bool
+            True if the account was authenticated and added, False otherwise.
+        """
+        login_details = config.get_login_details()
+        email, password = login_details["email"], login_details["password"]
+        if not email:
+            return False
+        auth_manager = AuthenticationManager(config)
+        try:
+            authenticated = auth_manager.ensure_authentication(
+                str(email), str(password)
+            )
+        except httpx.HTTPError as e:
+            logger.error(f"Failed to authenticate account '{email}': {str(e)}")
+            authenticated = False
+        if authenticated:
+            self._add(str(email), auth_manager)
+        return authenticated
+
+    def remove_account(self, email: str):
+        """
+        Removes an account from the pool.
+
+        Parameters
+        ----------
+            email : str
+                The email address of the account to remove.
+        """
+        with self._lock:
+            self._accounts.pop(email, None)
+
+    def sign_in(self) -> List[str]:
+        """
+        Authenticates every pooled account ahead of its first request.
+
+        Accounts without a valid stored token sign in, and their tokens and cookies are stored
+        in their configurations, e.g. before forking processes that share them.
+
+        Returns
+        -------
+        list
+            The email addresses of the accounts that could be authenticated.
+        """
+        with self._lock:
+            accounts = list(self._accounts.values())
+        signed_in = []
+        for account in accounts:
+            if account.auth_manager.authenticate() is not None:
+                signed_in.append(account.email)
+            else:
+                logger.warning(f"Account '{account.email}' could not be authenticated.")
+        return signed_in
+
+    @property
+    def accounts(self) -> List[str]:
+        """
+        Returns the email addresses of the pooled accounts.
+
+        Returns
+        -------
+        list
+            The email addresses of the pooled accounts.
+        """
+        with self._lock:
+            return list(self._accounts)
+
+    def load(self) -> Dict[str, int]:
+        """
+        Returns the number of in-flight requests per account.
+
+        Returns
+        -------
+        dict
+            A dictionary mapping every account email to its in-flight request count.
+        """
+        with self._lock:
+            return {email: a.in_flight for email, a in self._accounts.items()}
+
+    def mark_unavailable(self, email: str, retry_after: Optional[float] = None):
+        """
+        Puts an account in cooldown.
+
+        Parameters
+        ----------
+            email : str
+                The email address of the account.
+            retry_after : float, optional
+                Seconds until the account can be used again.
+                Defaults to `CONSTANTS["ACCOUNT_COOLDOWN"]`.
+        """
+        delay = CONSTANTS["ACCOUNT_COOLDOWN"] if retry_after is None else retry_after
+        with self._lock:
+            account = self._accounts.get(email)
+            if account is None:
+                return
+            account.cooldown_until = time.time() + delay
+        logger.warning(f"Account '{email}' unavailable, cooling down for {delay:.0f}s.")
+        account.auth_manager.config.set_cooldown(
+            datetime.fromtimestamp(account.cooldown_until, timezone.utc)
+        )
+
+    def cooldowns(self) -> Dict[str, float]:
+        """
+        Returns the remaining cooldown in seconds per cooling account.
+
+        Returns
+        -------
+        dict
+            A dictionary mapping the email of every cooling account to its remaining seconds.
+        """
+        now = time.time()
+        with self._lock:
+            return {
+                email: a.cooldown_until - now
+                for email, a in self._accounts.items()
+                if a.cooldown_until > now
+            }
+
+    def _acquire(self, exclude: Iterable[str] = ()) -> Optional[_Account]:
+        """Reserves the least-loaded account; ties go to the one that served the fewest."""
+        now = time.time()
+        with self._lock:
+            candidates = [
+                a
+                for a in self._accounts.values()
+                if a.email not in exclude and a.cooldown_until <= now
+            ]
+            while True:
+                if not candidates:
+                    return None
+                account = min(candidates, key=lambda a: (a.in_flight, a.served))
+                # Only the chosen account looks for a cooldown set by another process
+                account.sync_cooldown()
+                if account.cooldown_until <= now:
+                    break
+                candidates.remove(account)
+            account.in_flight += 1
+            account.served += 1
+            return account
+
+    def _release(self, account: _Account):
+        with self._lock:
+            account.in_flight -= 1
+
+    @contextmanager
+    def session(self) -> Iterator[httpx.Client]:
+        """
+        Context manager yielding the session of the least-loaded account.
+
+        Raises
+        ------
+        RuntimeError
+            If no account of the pool can be authenticated.
+
+        Yields
+        ------
+        httpx.Client
+            The pooled, authenticated HTTP client of the chosen account.
+        """
+        with self.lease() as (_, client):
+            yield client
+
+    @contextmanager
+    def lease(self, exclude: Iterable[str] = ()) -> Iterator[Tuple[str, httpx.Client]]:
+        """
+        Context manager yielding the email and session of the least-loaded account.
+
+        Accounts in cooldown are skipped.
+
+        Parameters
+        ----------
+            exclude : Iterable[str]
+                Email addresses of accounts not to use. Defaults to ().
+
+        Raises
+        ------
+        RuntimeError
+            If no account of the pool can be authenticated.
+
+        Yields
+        ------
+        Tuple[str, httpx.Client]
+            The email of the chosen account and its pooled, authenticated HTTP client.
+        """
+        tried: List[str] = list(exclude)
+        while True:
+            account = self._acquire(exclude=tried)
+            if account is None:
+                raise NoSessionAvailableError(
+                    "No authenticated session available in the pool."
+                )
+            client = account.auth_manager.authenticate()
+            if client is not None:
+                break
+            logger.warning(f"Account '{account.email}' could not be authenticated.")
+            self._release(account)
+            tried.append(account.email)
+
+        logger.debug(f"Handing out session of '{account.email}'.")
+        try:
+            yield account.email, client
+        finally:
+            self._release(account)
+
+    def call(self, request: Callable[[str, httpx.Client], T]) -> T:
+        """
+        Runs a request, failing over to another account when one is unavailable.
+
+        Parameters
+        ----------
+            request : Callable[[str, httpx.Client], T]
+                Called with the email and session of an account; raises
+                `AccountUnavailableError` if the account cannot serve it.
+
+        Raises
+        ------
+        AccountUnavailableError
+            If every account turned out to be unavailable.
+        RuntimeError
+            If no account of the pool can be used.
+
+        Returns
+        -------
+        T
+            The result of the request.
+        """
+        tried: List[str] = []
+        renewed: List[str] = []
+        while True:
+            with self.lease(exclude=tried) as (email, client):
+                try:
+                    return request(email, client)
+                except AccountUnavailableError as e:
+                    if self._renew(email, e, renewed):
+                        continue
+                    if not self._charge(email, e):
+                        raise
+                    tried.append(email)
+                    if not self._has_candidates(tried):
+                        raise
+
+    def stream(
+        self, request: Callable[[str, httpx.Client], Iterator[T]]
+    ) -> Iterator[T]:
+        """
+        Streams a request, failing over to another account until the first item arrives.
+
+        Once an item was yielded the request is not repeated, so an account becoming
+        unavailable mid-stream raises.
+
+        Parameters
+        ----------
+            request : Callable[[str, httpx.Client], Iterator[T]]
+                Called with the email and session of an account; raises
+                `AccountUnavailableError` if the account cannot serve it.
+
+        Raises
+        ------
+        AccountUnavailableError
+            If every account turned out to be unavailable.
+        RuntimeError
+            If no account of the pool can be used.
+
+        Yields
+        ------
+        T
+            The items of the stream.
+        """
+        tried: List[str] = []
+        renewed: List[str] = []
+        while True:
+            with self.lease(exclude=tried) as (email, client):
+                started = False
+                try:
+                    for item in request(email, client):
+                        started = True
+                        yield item
+                    return
+                except AccountUnavailableError as e:
+                    if not started and self._renew(email, e, renewed):
+                        continue
+                    if not self._charge(email, e):
+                        raise
+                    tried.append(email)
+                    if started or not self._has_candidates(tried):
+                        raise
+
+    def _renew(
+        self, email: str, error: AccountUnavailableError, renewed: List[str]
+    ) -> bool:
+        """
+        Signs the leased account in again if the error says its session expired.
+
+        Every account is renewed at most once per request; when the new session is rejected
+        too, the account is cooled down like an unavailable one.
+        """
+        if not isinstance(error, SessionExpiredError) or email in renewed:
+            return False
+        if error.account is not None and error.account != email:
+            return False
+        renewed.append(email)
+        with self._lock:
+            account = self._accounts.get(email)
+        if account is None:
+            return False
+        logger.info(f"Session of '{email}' expired, signing in again.")
+        user_data = account.auth_manager.config.load_auth_data()
+        try:
+            return account.auth_manager.set_up_authentication(
+                str(user_data["email"]), str(user_data["password"])
+            )
+        except httpx.HTTPError as e:
+            logger.error(f"Failed to sign '{email}' in again: {str(e)}")
+            return False
+
+    def _charge(self, email: str, error: AccountUnavailableError) -> bool:
+        """
+        Puts the leased account into cooldown if the error came from its own request.
+
+        An error raised for another account, e.g. re-raised to the followers of a coalesced
+        request, says nothing about the leased one, so it is neither cooled down nor failed
+        over from; the caller that sent the request cools its own account down.
+        """
+        if error.account is not None and error.account != email:
+            return False
+        self.mark_unavailable(email, error.retry_after)
+        return True
+
+    def _has_candidates(self, exclude: Iterable[str]) -> bool:
+        now = time.time()
+        with self._lock:
+            return any(
+                a.email not in exclude and a.cooldown_until <= now
+                for a in self._accounts.values()
+            )
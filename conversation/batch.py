@@ -0,0 +1,285 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Any, Dict, Optional, Set
+
+import httpx
+
+from auth.session_pool import SessionPool
+from conversation.cache import ResponseCache
+from conversation.chat import ChatSession
+from conversation.constants import CONSTANTS
+from conversation.ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class _Progress:
+    """Lines finished so far: everything below `watermark`, plus `done` above it."""
+
+    def __init__(self, watermark: int = 0, done: Optional[Set[int]] = None):
+        self.watermark = watermark
+        self.done: Set[int] = set()
+        for index in done or ():
+            self.complete(index)
+
+    def complete(self, index: int):
+        self.done.add(index)
+        # Keep the set small: fold the contiguous prefix into the watermark
+        while self.watermark in self.done:
+            self.done.remove(self.watermark)
+            self.watermark += 1
+
+    def is_done(self, index: int) -> bool:
+        return index < self.watermark or index in self.done
+
+
+class BatchRunner:
+    r"""
+    Concurrent JSONL batch runner.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A class that sends every prompt of a JSONL file through a `SessionPool` and appends one
+    JSON result line per prompt to an output file as soon as it finishes. The input is read
+    lazily and at most `2 * concurrency` prompts are in memory at any time, so memory stays
+    flat for inputs of any size.
+
+    Progress is checkpointed every `checkpoint_interval` seconds to '<output>.ckpt' as a
+    low watermark plus the finished lines above it. A restarted run skips those lines, and
+    also the lines whose results reached the output after the last checkpoint. Failed lines
+    are written with an "error" but not checkpointed, so a restarted run retries them and
+    appends a new result for the same line.
+
+    Every prompt is asked in a new conversation, which is deleted once it is answered.
+
+    Input lines are JSON objects with the prompt in "prompt" or "body" and an optional id in
+    "id" or "request_id"; "model" and "system_prompt" override the defaults per line.
+
+    ----
+
+    Attributes
+    ----------
+    pool : SessionPool
+        The pool of authenticated sessions the prompts are sent with.
+    model : str
+        The default model answering the prompts.
+    concurrency : int
+        Maximum number of prompts sent at the same time.
+    checkpoint_interval : float
+        Number of seconds between two checkpoints.
+    cache : ResponseCache | None
+        Cache answering repeated prompts without a round trip to the model.
+    rate_limiter : RateLimiter | None
+        Paces the requests of every account and model.
+
+    Methods
+    -------
+    run(input_path: str, output_path: str) -> Dict[str, int]:
+        Runs every unfinished prompt of the input file.
+
+    Example
+    -------
+    >>> from conversation.batch import BatchRunner
+    >>>
+    >>> runner = BatchRunner(SessionPool.from_directory(), concurrency=8)
+    >>> runner.run("requests.jsonl", "results.jsonl")
+    {'completed': 25, 'failed': 0, 'skipped': 0}
+    """
+
+    def __init__(
+        self,
+        pool: SessionPool,
+        model: str = CONSTANTS["DEFAULT_MODEL"],
+        concurrency: int = 4,
+        checkpoint_interval: float = 10.0,
+        cache: Optional[ResponseCache] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
+        """
+        Constructs all the necessary attributes for the BatchRunner object.
+
+        Parameters
+        ----------
+            pool : SessionPool
+                The pool of authenticated sessions the prompts are sent with.
+            model : str
+                The default model answering the prompts. Defaults to `CONSTANTS["DEFAULT_MODEL"]`.
+            concurrency : int
+                Maximum number of prompts sent at the same time. Defaults to 4.
+            checkpoint_interval : float
+                Number of seconds between two checkpoints. Defaults to 10.0.
+            cache : ResponseCache, optional
+                Cache answering repeated prompts. Defaults to None (no caching).
+            rate_limiter : RateLimiter, optional
+                Paces the requests of every account and model. Defaults to None (no pacing).
+        """
+        self.pool = pool
+        self.model = model
+        self.concurrency = concurrency
+        self.checkpoint_interval = checkpoint_interval
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self._lock = threading.Lock()
+        self._checkpointed = 0.0
+
+    @staticmethod
+    def _load_progress(output_path: str) -> _Progress:
+        """Restores the checkpoint and the results written after it."""
+        progress = _Progress()
+        checkpoint_path = f"{output_path}.ckpt"
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                state = json.load(f)
+            progress = _Progress(state["watermark"], set(state["done"]))
+        if os.path.exists(output_path):
+            with open(output_path) as f:
+                for line in f:
+                    try:
+                        result = json.loads(line)
+                        index = result["line"] - 1
+                    except (ValueError, KeyError, TypeError):
+                        continue  # Torn last line of a killed run
+                    if "error" in result:
+                        continue  # Failed lines are retried
+                    if not progress.is_done(index):
+                        progress.complete(index)
+        return progress
+
+    @staticmethod
+    def _end_torn_line(output_path: str):
+        """Terminates a last result line that a killed run left without a newline."""
+        if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+            return
+        with open(output_path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+    @staticmethod
+    def _save_progress(output_path: str, progress: _Progress):
+        checkpoint_path = f"{output_path}.ckpt"
+        tmp_path = f"{checkpoint_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {"watermark": progress.watermark, "done": sorted(progress.done)}, f
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, checkpoint_path)
+
+    def _ask(self, request: Dict[str, Any]) -> str:
+        prompt = request.get("prompt", request.get("body"))
+        if not isinstance(prompt, str):
+            raise ValueError("Line has no 'prompt' or 'body'.")
+
+        def ask(account: str, session: httpx.Client) -> str:
+            chat = ChatSession(
+                session,
+                model=request.get("model", self.model),
+                system_prompt=request.get("system_prompt", ""),
+                cache=self.cache,
+                account=account,
+                rate_limiter=self.rate_limiter,
+            )
+            try:
+                return chat.ask(prompt)
+            finally:
+                chat.close()
+
+        # A rate-limited account is put in cooldown and the prompt retried on another one
+        return self.pool.call(ask)
+
+    def _process(
+        self,
+        index: int,
+        raw: str,
+        output: IO[str],
+        output_path: str,
+        progress: _Progress,
+        counts: Dict[str, int],
+    ):
+        result: Dict[str, Any] = {"line": index + 1}
+        try:
+            request = json.loads(raw)
+            result["id"] = request.get("id", request.get("request_id"))
+            result["response"] = self._ask(request)
+        except Exception as e:
+            logger.error(f"Line {index + 1} failed: {str(e)}")
+            result["error"] = str(e)
+
+        with self._lock:
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            if "error" in result:
+                counts["failed"] += 1
+            else:
+                progress.complete(index)
+                counts["completed"] += 1
+            if time.monotonic() - self._checkpointed >= self.checkpoint_interval:
+                self._save_progress(output_path, progress)
+                self._checkpointed = time.monotonic()
+
+    def run(self, input_path: str, output_path: str) -> Dict[str, int]:
+        """
+        Runs every unfinished prompt of the input file.
+
+        Parameters
+        ----------
+            input_path : str
+                The JSONL file holding one request per line.
+            output_path : str
+                The JSONL file the results are appended to.
+
+        Returns
+        -------
+        dict
+            The number of 'completed', 'failed' and 'skipped' (finished earlier) lines.
+        """
+        progress = self._load_progress(output_path)
+        self._end_torn_line(output_path)
+        counts = {"completed": 0, "failed": 0, "skipped": 0}
+        self._checkpointed = time.monotonic()
+        # Bounds the lines read ahead of the workers
+        slots = threading.BoundedSemaphore(2 * self.concurrency)
+
+        def process(index: int, raw: str):
+            try:
+                self._process(index, raw, output, output_path, progress, counts)
+            finally:
+                slots.release()
+
+        with open(input_path) as source, open(output_path, "a") as output:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                for index, raw in enumerate(source):
+                    if not raw.strip():
+                        with self._lock:
+                            progress.complete(index)
+                        continue
+                    if progress.is_done(index):
+                        counts["skipped"] += 1
+                        continue
+                    slots.acquire()
+                    executor.submit(process, index, raw)
+            with self._lock:
+                self._save_progress(output_path, progress)
+
+        logger.info(f"Batch finished: {counts}")
+        return counts
@@ -0,0 +1,252 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(
+    model: str,
+    system_prompt: str,
+    messages: Iterable[Dict[str, str]],
+    params: Optional[Dict[str, Any]] = None,
+) -> str:
+    """
+    Returns the cache key of a request.
+
+    Message contents are normalized (line endings, surrounding whitespace), so prompts that only
+    differ in formatting noise share one entry.
+
+    Parameters
+    ----------
+        model : str
+            The model answering the request.
+        system_prompt : str
+            The system prompt of the conversation.
+        messages : Iterable[Dict[str, str]]
+            The transcript up to and including the new user message.
+        params : Dict[str, Any], optional
+            Generation parameters that change the answer, e.g. {"web_search": True}.
+
+    Returns
+    -------
+    str
+        A sha256 hex digest.
+    """
+    normalized = [
+        [m["role"], m["content"].replace("\r\n", "\n").strip()] for m in messages
+    ]
+    material = [model, system_prompt.strip(), normalized, params or {}]
+    encoded = json.dumps(material, sort_keys=True, ensure_ascii=False).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class ResponseCache:
+    r"""
+    Two-tier cache of chat responses.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A class that stores the token list of complete responses under their `cache_key`. The
+    memory tier is a bounded LRU; the optional disk tier is an SQLite database shared by
+    every process using the same file. Entries of both tiers expire after `ttl` seconds.
+
+    ----
+
+    Attributes
+    ----------
+    max_entries : int
+        Maximum number of responses held in memory.
+    ttl : float
+        Number of seconds a response stays valid.
+    filename : str | None
+        Path of the disk tier, or None to cache in memory only.
+
+    Methods
+    -------
+    beside(config: Config, max_entries: int = 256, ttl: float = 3600.0) -> ResponseCache:
+        Builds a cache whose disk tier lives next to a configuration file.
+    get(key: str) -> Optional[List[str]]:
+        Returns the cached tokens of a response.
+    put(key: str, tokens: List[str]):
+        Stores the tokens of a complete response.
+    clear():
+        Removes every entry from both tiers.
+    close():
+        Closes the disk tier.
+
+    Example
+    -------
+    >>> from conversation.cache import ResponseCache
+    >>> from conversation.chat import ChatSession
+    >>>
+    >>> cache = ResponseCache.beside(config)
+    >>> chat = ChatSession(auth_manager.authenticate(), cache=cache)
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl: float = 3600.0,
+        filename: Optional[str] = None,
+    ):
+        """
+        Constructs all the necessary attributes for the ResponseCache object.
+
+        Parameters
+        ----------
+            max_entries : int
+                Maximum number of responses held in memory. Defaults to 256.
+            ttl : float
+                Number of seconds a response stays valid. Defaults to 3600.0.
+            filename : str, optional
+                Path of the SQLite disk tier. Defaults to None (memory only).
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.filename = filename
+        # key -> (expires_at, tokens), least recently used first
+        self._memory: "OrderedDict[str, Tuple[float, List[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        if filename is not None:
+            self._connection = sqlite3.connect(
+                filename, check_same_thread=False, isolation_level=None
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, expires_at REAL NOT NULL, tokens TEXT NOT NULL)"
+            )
+            self._connection.execute(
+                "DELETE FROM responses WHERE expires_at <= ?", (time.time(),)
+            )
+
+    @classmethod
+    def beside(
+        cls, config: Config, max_entries: int = 256, ttl: float = 3600.0
+    ) -> "ResponseCache":
+        """
+        Builds a cache whose disk tier lives next to a configuration file.
+
+        Parameters
+        ----------
+            config : Config
+                The configuration; 'responses.db' is created in its directory. A configuration
+                kept in memory gets a memory-only cache.
+            max_entries : int
+                Maximum number of responses held in memory. Defaults to 256.
+            ttl : float
+                Number of seconds a response stays valid. Defaults to 3600.0.
+
+        Returns
+        -------
+        ResponseCache
+            The cache.
+        """
+        if config.filename == ":memory:":
+            return cls(max_entries, ttl)
+        directory = os.path.dirname(os.path.abspath(config.filename))
+        return cls(max_entries, ttl, os.path.join(directory, "responses.db"))
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """
+        Returns the cached tokens of a response.
+
+        Parameters
+        ----------
+            key : str
+                The `cache_key` of the request.
+
+        Returns
+        -------
+        List[str] | None
+            The tokens, or None on a miss or if the entry expired.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    return list(entry[1])
+                del self._memory[key]
+            if self._connection is None:
+                return None
+            row = self._connection.execute(
+                "SELECT expires_at, tokens FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[0] <= now:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            tokens = json.loads(row[1])
+            self._remember(key, row[0], tokens)
+            return list(tokens)
+
+    def put(self, key: str, tokens: List[str]):
+        """
+        Stores the tokens of a complete response.
+
+        Parameters
+        ----------
+            key : str
+                The `cache_key` of the request.
+            tokens : List[str]
+                The tokens of the response, in order.
+        """
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, list(tokens))
+            if self._connection is not None:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO responses (key, expires_at, tokens) "
+                    "VALUES (?, ?, ?)",
+                    (key, expires_at, json.dumps(tokens, ensure_ascii=False)),
+                )
+
+    def _remember(self, key: str, expires_at: float, tokens: List[str]):
+        self._memory[key] = (expires_at, tokens)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def clear(self):
+        """Removes every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            if self._connection is not None:
+                self._connection.execute("DELETE FROM responses")
+
+    def close(self):
+        """Closes the disk tier."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def __len__(self) -> int:
+        return len(self._memory)
@@ -0,0 +1,488 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import logging
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+
+import httpx
+
+from auth.errors import check_account
+from conversation.cache import ResponseCache, cache_key
+from conversation.coalescer import RequestCoalescer
+from conversation.constants import CONSTANTS
+from conversation.hedge import Hedger
+from conversation.ratelimit import RateLimiter
+from conversation.stream import StreamDecoder
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class ChatSession:
+    r"""
+    Streaming chat session for HuggingChat.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A class that creates a HuggingChat conversation with an authenticated session and sends
+    messages to it, yielding the response tokens while the stream is still arriving.
+
+    ----
+
+    Attributes
+    ----------
+    session : httpx.Client
+        Authenticated HTTP client, e.g. from `AuthenticationManager.authenticate()`.
+    model : str
+        The model answering in the conversation.
+    system_prompt : str
+        The system prompt (preprompt) of the conversation.
+    conversation_id : str | None
+        The id of the server-side conversation, once it has been created.
+    parent_id : str | None
+        The id of the message the next message is appended to. It is taken from the response
+        stream, so follow-up messages need no lookup of the conversation.
+    messages : List[Dict[str, str]]
+        The local transcript as a list of {"role": ..., "content": ...} dictionaries.
+    cache : ResponseCache | None
+        Cache answering repeated requests without a round trip to the model.
+    coalescer : RequestCoalescer | None
+        Lets identical concurrent requests share one upstream stream.
+    account : str
+        The account the session belongs to, which keys its rate limit.
+    rate_limiter : RateLimiter | None
+        Paces every request of the session per account and model.
+    hedger : Hedger | None
+        Hedges the idempotent requests (conversation creation, model list) of the session.
+
+    Methods
+    -------
+    new_conversation(preprompt: str | None = None) -> str:
+        Creates a new server-side conversation and returns its id.
+    delete_conversation(conversation_id: str | None = None):
+        Deletes a server-side conversation.
+    list_models() -> List[str]:
+        Returns the ids of the models available on HuggingChat.
+    prepare():
+        Creates the conversation and looks up its root message ahead of the first message.
+    restore(messages: List[Dict[str, str]]):
+        Replaces the transcript with earlier turns the server conversation never saw.
+    send(text: str, web_search: bool = False) -> Iterator[str]:
+        Sends a message and yields the response tokens as they arrive.
+    ask(text: str, web_search: bool = False) -> str:
+        Sends a message and returns the complete response.
+    close():
+        Deletes the server-side conversation of a one-off session, if it created one.
+
+    Example
+    -------
+    >>> from conversation.chat import ChatSession
+    >>>
+    >>> chat = ChatSession(auth_manager.authenticate())
+    >>> for token in chat.send("Hello!"):
+    ...     print(token, end="", flush=True)
+    """
+
+    def __init__(
+        self,
+        session: httpx.Client,
+        model: str = CONSTANTS["DEFAULT_MODEL"],
+        system_prompt: str = "",
+        cache: Optional[ResponseCache] = None,
+        coalescer: Optional[RequestCoalescer] = None,
+        account: str = "default",
+        rate_limiter: Optional[RateLimiter] = None,
+        hedger: Optional[Hedger] = None,
+    ):
+        """
+        Constructs all the necessary attributes for the ChatSession object.
+
+        Parameters
+        ----------
+        session : httpx.Client
+            Authenticated HTTP client, e.g. from `AuthenticationManager.authenticate()`.
+        model : str
+            The model answering in the conversation. Defaults to `CONSTANTS["DEFAULT_MODEL"]`.
+        system_prompt : str
+            The system prompt (preprompt) of the conversation. Defaults to ''.
+        cache : ResponseCache, optional
+            Cache answering repeated requests. Defaults to None (no caching).
+        coalescer : RequestCoalescer, optional
+            Shares one upstream stream between identical concurrent requests.
+            Defaults to None (no coalescing).
+        account : str
+            The account the session belongs to, which keys its rate limit. Defaults to 'default'.
+        rate_limiter : RateLimiter, optional
+            Paces every request of the session. Defaults to None (no pacing).
+        hedger : Hedger, optional
+            Hedges the idempotent requests of the session. Defaults to None (no hedging).
+        """
+        self.session = session
+        self.model = model
+        self.system_prompt = system_prompt
+        self.conversation_id: Optional[str] = None
+        self.parent_id: Optional[str] = None
+        self.messages: List[Dict[str, str]] = []
+        self.cache = cache
+        self.coalescer = coalescer
+        self.account = account
+        self.rate_limiter = rate_limiter
+        self.hedger = hedger
+        # Set when the transcript holds turns the server conversation never saw
+        self._stale = False
+
+    def _request(
+        self,
+        method: str,
+        url: str,
+        stream: bool = False,
+        paced: bool = True,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        """
+        Sends every request of the session, after waiting for the rate limiter.
+
+        `paced=False` skips the limiter for requests whose caller already waited for it.
+        """
+        if paced and self.rate_limiter is not None:
+            self.rate_limiter.acquire(self.account, self.model)
+        request = self.session.build_request(method, url, **kwargs)
+        response = self.session.send(request, stream=stream)
+        try:
+            check_account(response, self.account)
+            response.raise_for_status()
+        except httpx.HTTPStatusError:
+            response.close()
+            raise
+        return response
+
+    def new_conversation(self, preprompt: Optional[str] = None) -> str:
+        """
+        Creates a new server-side conversation and returns its id.
+
+        Parameters
+        ----------
+        preprompt : str, optional
+            The preprompt of the conversation. Defaults to `system_prompt`.
+
+        Raises
+        ------
+        httpx.HTTPStatusError
+            If the conversation could not be created.
+
+        Returns
+        -------
+        str
+            The id of the new conversation.
+        """
+        payload = {
+            "model": self.model,
+            "preprompt": self.system_prompt if preprompt is None else preprompt,
+        }
+
+        def create() -> str:
+            response = self._request(
+                "POST",
+                f"{CONSTANTS['CHAT_URL']}/conversation",
+                paced=False,
+                json=payload,
+            )
+            return str(response.json()["conversationId"])
+
+        # A hedged duplicate creates a second conversation, which is deleted again
+        self.conversation_id = self._idempotent(create, self.delete_conversation)
+        self.parent_id = None
+        logger.debug(f"Created conversation {self.conversation_id}.")
+        return str(self.conversation_id)
+
+    def _idempotent(
+        self, fn: Callable[[], T], cleanup: Optional[Callable[[T], None]] = None
+    ) -> T:
+        """
+        Runs an idempotent call, through the hedger if the session has one.
+
+        The call's requests must be sent with `paced=False`: the rate limiter is waited for
+        once up front, so the hedger times the network and not the wait for a token.
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(self.account, self.model)
+        if self.hedger is None:
+            return fn()
+        return self.hedger.call(fn, cleanup)
+
+    def delete_conversation(self, conversation_id: Optional[str] = None):
+        """
+        Deletes a server-side conversation.
+
+        Parameters
+        ----------
+        conversation_id : str, optional
+            The id of the conversation. Defaults to the conversation of the session.
+        """
+        conversation_id = conversation_id or self.conversation_id
+        if conversation_id is None:
+            return
+        self._request(
+            "DELETE", f"{CONSTANTS['CHAT_URL']}/conversation/{conversation_id}"
+        )
+        logger.debug(f"Deleted conversation {conversation_id}.")
+        if conversation_id == self.conversation_id:
+            self.conversation_id = None
+            self.parent_id = None
+
+    def list_models(self) -> List[str]:
+        """
+        Returns the ids of the models available on HuggingChat.
+
+        Raises
+        ------
+        httpx.HTTPStatusError
+            If the model list could not be fetched.
+
+        Returns
+        -------
+        list
+            The model ids, e.g. 'mistralai/Mixtral-8x7B-Instruct-v0.1'.
+        """
+        response = self._idempotent(
+            lambda: self._request(
+                "GET", f"{CONSTANTS['CHAT_URL']}/api/models", paced=False
+            )
+        )
+        return [model.get("id") or model["name"] for model in response.json()]
+
+    def _last_message_id(self) -> str:
+        """Fetches the id of the newest message, which the next message is appended to."""
+        response = self._request(
+            "GET",
+            f"{CONSTANTS['CHAT_URL']}/conversation/{self.conversation_id}/__data.json",
+            params={"x-sveltekit-invalidated": "11"},
+        )
+        # SvelteKit serialises the page data as a flat list with index references
+        data = response.json()["nodes"][1]["data"]
+        messages = data[data[0]["messages"]]
+        return data[data[messages[-1]]["id"]]
+
+    def prepare(self):
+        """
+        Creates the conversation and looks up its root message ahead of the first message.
+
+        The first `send()` of a prepared session then needs a single request.
+
+        Raises
+        ------
+        httpx.HTTPStatusError
+            If the conversation could not be created.
+        """
+        if self.conversation_id is None:
+            self.new_conversation()
+        if self.parent_id is None:
+            self.parent_id = self._last_message_id()
+
+    def restore(self, messages: List[Dict[str, str]]):
+        """
+        Replaces the transcript with earlier turns the server conversation never saw.
+
+        Used for stateless callers that send the whole history with every message. The next
+        message that reaches the model starts a conversation seeded with these turns.
+
+        Parameters
+        ----------
+        messages : List[Dict[str, str]]
+            The earlier turns as {"role": "user" | "assistant", "content": ...} dictionaries.
+        """
+        self.messages = [{"role": m["role"], "content": m["content"]} for m in messages]
+        self._stale = bool(self.messages)
+
+    def send(self, text: str, web_search: bool = False) -> Iterator[str]:
+        """
+        Sends a message and yields the response tokens as they arrive.
+
+        With a cache, a repeated request is answered from it through the same generator. With
+        a coalescer, a request identical to one in flight follows that request's stream.
+
+        Parameters
+        ----------
+        text : str
+            The user message.
+        web_search : bool
+            Let the model search the web before answering. Defaults to False.
+
+        Raises
+        ------
+        AccountUnavailableError
+            If the account is rate-limited or no longer signed in.
+        httpx.HTTPStatusError
+            If the message could not be sent.
+        RuntimeError
+            If the server reports an error while generating the response.
+
+        Yields
+        ------
+        str
+            The response tokens.
+        """
+        message = {"role": "user", "content": text}
+        key = cache_key(
+            self.model,
+            self.system_prompt,
+            self.messages + [message],
+            {"web_search": web_search},
+        )
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                logger.debug("Answering from the response cache.")
+                self.messages.append(message)
+                yield from cached
+                self.messages.append({"role": "assistant", "content": "".join(cached)})
+                self._stale = True
+                return
+
+        if self._stale:
+            self._reseed()
+        self.messages.append(message)
+        if self.coalescer is None:
+            stream = self._stream(text, web_search)
+        else:
+
+            def lead() -> Iterator[str]:
+                self._stale = False
+                yield from self._stream(text, web_search)
+
+            # Only the session that leads the flight talks to its own server conversation
+            self._stale = True
+            stream = self.coalescer.stream(key, lead)
+
+        tokens: List[str] = []
+        for token in stream:
+            tokens.append(token)
+            yield token
+        self.messages.append({"role": "assistant", "content": "".join(tokens)})
+        if self.cache is not None:
+            self.cache.put(key, tokens)
+
+    def _reseed(self):
+        """
+        Starts a new server conversation that knows the turns answered from the cache.
+
+        The old conversation is deleted first. Only the most recent turns, up to
+        `CONSTANTS["RESEED_MAX_CHARS"]` characters, are put into the new preprompt, so its size
+        does not grow with the length of the transcript.
+        """
+        if self.conversation_id is not None:
+            try:
+                self.delete_conversation()
+            except httpx.HTTPError as e:
+                logger.warning(
+                    f"Could not delete conversation {self.conversation_id}: {e}"
+                )
+                self.conversation_id = None
+        turns: List[str] = []
+        budget = CONSTANTS["RESEED_MAX_CHARS"]
+        for m in reversed(self.messages):
+            turn = f"{m['role'].capitalize()}: {m['content']}"
+            if len(turn) > budget:
+                break
+            turns.append(turn)
+            budget -= len(turn) + 1
+        history = "\n".join(reversed(turns))
+        if len(turns) < len(self.messages):
+            history = f"(earlier turns omitted)\n{history}"
+        preprompt = f"Conversation so far:\n{history}"
+        if self.system_prompt:
+            preprompt = f"{self.system_prompt}\n\n{preprompt}"
+        self.new_conversation(preprompt)
+        self._stale = False
+
+    def _stream(self, text: str, web_search: bool) -> Iterator[str]:
+        """Posts a message to the server conversation and yields the response tokens."""
+        if self.conversation_id is None:
+            self.new_conversation()
+        # Only the new message and the id it answers are uploaded, never the history
+        parent_id = self.parent_id or self._last_message_id()
+        self.parent_id = None
+        payload = {
+            "inputs": text,
+            "id": parent_id,
+            "is_retry": False,
+            "is_continue": False,
+            "web_search": web_search,
+        }
+
+        response_id: Optional[str] = None
+        response = self._request(
+            "POST",
+            f"{CONSTANTS['CHAT_URL']}/conversation/{self.conversation_id}",
+            stream=True,
+            files={"data": (None, json.dumps(payload), "application/json")},
+        )
+        try:
+            for update in StreamDecoder().decode(response.iter_bytes()):
+                response_id = update.get("messageId") or response_id
+                token = self._handle_update(update)
+                if token:
+                    yield token
+        finally:
+            response.close()
+
+        # Without an id in the stream, the next send looks it up once
+        self.parent_id = response_id
+
+    @staticmethod
+    def _handle_update(update: Dict[str, Any]) -> Optional[str]:
+        """Returns the token carried by a stream update, raising on error updates."""
+        kind = update.get("type")
+        if kind == "stream":
+            # Tokens are padded with NUL characters to flush proxies
+            return update.get("token", "").rstrip("\0")
+        if kind == "status" and update.get("status") == "error":
+            raise RuntimeError(f"HuggingChat error: {update.get('message', update)}")
+        return None
+
+    def ask(self, text: str, web_search: bool = False) -> str:
+        """
+        Sends a message and returns the complete response.
+
+        Parameters
+        ----------
+        text : str
+            The user message.
+        web_search : bool
+            Let the model search the web before answering. Defaults to False.
+
+        Returns
+        -------
+        str
+            The complete response.
+        """
+        return "".join(self.send(text, web_search=web_search))
+
+    def close(self):
+        """
+        Deletes the server-side conversation of a one-off session, if it created one.
+
+        Failures are logged rather than raised, so it can run in a `finally` block without
+        masking the error of the request itself.
+        """
+        if self.conversation_id is None:
+            return
+        try:
+            self.delete_conversation()
+        except httpx.HTTPError as e:
+            logger.warning(
+                f"Failed to delete conversation {self.conversation_id}: {str(e)}"
+            )
@@ -0,0 +1,201 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import logging
+import threading
+from typing import Callable, Dict, Iterator, List, Optional
+
+from conversation.constants import CONSTANTS
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """Tokens received so far for one upstream request."""
+
+    __slots__ = ("tokens", "done", "error", "condition", "subscribers", "read")
+
+    def __init__(self):
+        self.tokens: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.condition = threading.Condition()
+        # Callers following the flight, changed under the coalescer's lock
+        self.subscribers = 1
+        # Number of tokens taken by the subscriber furthest ahead
+        self.read = 0
+
+
+class RequestCoalescer:
+    r"""
+    In-flight request coalescing.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A class that lets identical requests share one upstream stream. The first caller of a key
+    starts the stream on its own thread; everyone asking for the same key while it runs gets
+    a replay of the tokens received so far and then follows the live tokens.
+
+    The stream is read at the pace of its fastest subscriber: it pauses once every subscriber
+    is `max_ahead` tokens behind, and it is closed as soon as the last subscriber leaves, so
+    an abandoned request does not keep reading from HuggingChat.
+
+    ----
+
+    Attributes
+    ----------
+    max_ahead : int
+        Number of tokens the stream reads ahead of its fastest subscriber.
+
+    Methods
+    -------
+    stream(key: str, produce: Callable[[], Iterator[str]]) -> Iterator[str]:
+        Yields the tokens of the request with the given key, starting it if needed.
+    in_flight() -> int:
+        Returns the number of upstream requests currently running.
+
+    Example
+    -------
+    >>> from conversation.chat import ChatSession
+    >>> from conversation.coalescer import RequestCoalescer
+    >>>
+    >>> coalescer = RequestCoalescer()
+    >>> chat = ChatSession(auth_manager.authenticate(), coalescer=coalescer)
+    """
+
+    def __init__(self, max_ahead: int = CONSTANTS["COALESCE_BUFFER"]):
+        """
+        Constructs all the necessary attributes for the RequestCoalescer object.
+
+        Parameters
+        ----------
+            max_ahead : int
+                Number of tokens the stream reads ahead of its fastest subscriber.
+                Defaults to 64.
+        """
+        self.max_ahead = max(max_ahead, 1)
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def stream(self, key: str, produce: Callable[[], Iterator[str]]) -> Iterator[str]:
+        """
+        Yields the tokens of the request with the given key, starting it if needed.
+
+        Parameters
+        ----------
+            key : str
+                Identifies the request, e.g. its `cache_key`.
+            produce : Callable[[], Iterator[str]]
+                Starts the upstream request; only called if no identical one is running.
+
+        Raises
+        ------
+        Exception
+            Whatever the upstream request raised, re-raised for every subscriber.
+
+        Yields
+        ------
+        str
+            The response tokens, starting with the first one.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                threading.Thread(
+                    target=self._run,
+                    args=(key, flight, produce),
+                    name="coalesced-request",
+                    daemon=True,
+                ).start()
+            else:
+                flight.subscribers += 1
+                logger.debug(
+                    f"Joining in-flight request ({flight.subscribers} callers)."
+                )
+        return self._follow(flight)
+
+    def _run(self, key: str, flight: _Flight, produce: Callable[[], Iterator[str]]):
+        stream: Optional[Iterator[str]] = None
+        try:
+            stream = produce()
+            for token in stream:
+                with flight.condition:
+                    flight.tokens.append(token)
+                    flight.condition.notify_all()
+                    while (
+                        flight.subscribers
+                        and len(flight.tokens) - flight.read >= self.max_ahead
+                    ):
+                        flight.condition.wait()
+                if self._abandoned(key, flight):
+                    logger.debug("Every caller left, closing the upstream request.")
+                    break
+        except BaseException as e:
+            flight.error = e
+        finally:
+            # Releases the upstream response
+            getattr(stream, "close", lambda: None)()
+            # Unregister first, so callers after the last token start a new request
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            with flight.condition:
+                flight.done = True
+                flight.condition.notify_all()
+
+    def _abandoned(self, key: str, flight: _Flight) -> bool:
+        """Unregisters a flight without subscribers, so that no caller can join it anymore."""
+        with self._lock:
+            if flight.subscribers:
+                return False
+            del self._flights[key]
+            return True
+
+    def _follow(self, flight: _Flight) -> Iterator[str]:
+        position = 0
+        try:
+            while True:
+                with flight.condition:
+                    while position == len(flight.tokens) and not flight.done:
+                        flight.condition.wait()
+                    # Received tokens are never modified, so a slice is a consistent replay
+                    tokens = flight.tokens[position:]
+                    finished = flight.done
+                    position += len(tokens)
+                    if position > flight.read:
+                        flight.read = position
+                        flight.condition.notify_all()
+                yield from tokens
+                if finished:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+        finally:
+            with self._lock:
+                flight.subscribers -= 1
+            with flight.condition:
+                flight.condition.notify_all()
+
+    def in_flight(self) -> int:
+        """
+        Returns the number of upstream requests currently running.
+
+        Returns
+        -------
+        int
+            The number of running upstream requests.
+        """
+        with self._lock:
+            return len(self._flights)
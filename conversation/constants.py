@@ -0,0 +1,34 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Any, Dict
+
+CONSTANTS: Dict[str, Any] = {
+    "CHAT_URL": "https://huggingface.co/chat",
+    "DEFAULT_MODEL": "mistralai/Mixtral-8x7B-Instruct-v0.1",
+    # Requests per second and back-to-back burst per (account, model)
+    "RATE_LIMIT": 1.0,
+    "RATE_LIMIT_BURST": 5.0,
+    # Share of the rate limits a batch run keeps while interactive chats use the same accounts
+    "BATCH_RATE_SHARE": 0.5,
+    # Seconds between refreshing a lane's activity marker and between reading the other lane's
+    "LANE_ANNOUNCE_INTERVAL": 5.0,
+    "LANE_CHECK_INTERVAL": 1.0,
+    # Seconds after its last refresh that a lane still counts as active
+    "LANE_ACTIVE_WINDOW": 15.0,
+    # Characters of the most recent turns put into the preprompt of a reseeded conversation
+    "RESEED_MAX_CHARS": 8000,
+    # Tokens a coalesced stream reads ahead of its fastest caller before it pauses
+    "COALESCE_BUFFER": 64,
+}
@@ -0,0 +1,189 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Deque, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Hedger:
+    r"""
+    Hedged requests for idempotent calls.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A class that runs a call on a worker thread and, if it has not answered within the
+    `quantile` (p95 by default) of the recent latencies, starts a second identical call. The
+    first successful answer wins. The loser cannot be interrupted mid-request, so it is
+    cancelled if it has not started yet and otherwise left to finish, after which its result
+    is passed to `cleanup` (e.g. to delete a conversation it created) and dropped.
+
+    Until `min_samples` latencies are recorded, `initial_delay` is used as the hedging delay.
+
+    ----
+
+    Attributes
+    ----------
+    quantile : float
+        The latency quantile after which the second call is started.
+    initial_delay : float
+        Number of seconds to wait before hedging while there are too few samples.
+    min_samples : int
+        Number of latencies needed before the quantile is used.
+
+    Methods
+    -------
+    call(fn: Callable[[], T], cleanup: Callable[[T], None] | None = None) -> T:
+        Runs an idempotent call, hedging it if it is slow.
+    delay() -> float:
+        Returns the current hedging delay in seconds.
+    close():
+        Shuts the worker threads down.
+
+    Example
+    -------
+    >>> from conversation.hedge import Hedger
+    >>>
+    >>> hedger = Hedger()
+    >>> chat = ChatSession(session, hedger=hedger)
+    >>> chat.new_conversation()
+    """
+
+    def __init__(
+        self,
+        quantile: float = 0.95,
+        initial_delay: float = 1.0,
+        min_samples: int = 20,
+        window: int = 200,
+        max_workers: int = 8,
+    ):
+        """
+        Constructs all the necessary attributes for the Hedger object.
+
+        Parameters
+        ----------
+            quantile : float
+                The latency quantile after which the second call is started. Defaults to 0.95.
+            initial_delay : float
+                Number of seconds to wait before hedging while there are too few samples.
+                Defaults to 1.0.
+            min_samples : int
+                Number of latencies needed before the quantile is used. Defaults to 20.
+            window : int
+                Number of most recent latencies the quantile is computed over. Defaults to 200.
+            max_workers : int
+                Maximum number of calls running at the same time. Defaults to 8.
+        """
+        self.quantile = quantile
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="hedged-request"
+        )
+
+    def delay(self) -> float:
+        """
+        Returns the current hedging delay in seconds.
+
+        Returns
+        -------
+        float
+            The `quantile` of the recent latencies, or `initial_delay` if there are too few.
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return self.initial_delay
+            latencies = sorted(self._latencies)
+        return latencies[min(int(len(latencies) * self.quantile), len(latencies) - 1)]
+
+    def _timed(self, fn: Callable[[], T]) -> T:
+        started = time.monotonic()
+        result = fn()
+        with self._lock:
+            self._latencies.append(time.monotonic() - started)
+        return result
+
+    @staticmethod
+    def _discard(future: "Future[T]", cleanup: Optional[Callable[[T], None]]):
+        """Cancels a losing call, or cleans up its result once it finishes."""
+        if future.cancel() or cleanup is None:
+            return
+
+        def clean(done: "Future[T]"):
+            if done.cancelled() or done.exception() is not None:
+                return
+            try:
+                cleanup(done.result())
+            except Exception as e:
+                logger.warning(f"Failed to clean up a hedged request: {str(e)}")
+
+        future.add_done_callback(clean)
+
+    def call(
+        self, fn: Callable[[], T], cleanup: Optional[Callable[[T], None]] = None
+    ) -> T:
+        """
+        Runs an idempotent call, hedging it if it is slow.
+
+        Parameters
+        ----------
+            fn : Callable[[], T]
+                The call; it may run twice at the same time.
+            cleanup : Callable[[T], None], optional
+                Called with the result of the losing call, if it succeeds. Defaults to None.
+
+        Raises
+        ------
+        Exception
+            Whatever the call raised, if no attempt succeeded.
+
+        Returns
+        -------
+        T
+            The result of the first successful attempt.
+        """
+        attempts = [self._executor.submit(self._timed, fn)]
+        done, _ = wait(attempts, timeout=self.delay())
+        if not done:
+            logger.debug("Request slower than the hedging delay, sending a second one.")
+            attempts.append(self._executor.submit(self._timed, fn))
+
+        errors: List[BaseException] = []
+        pending = set(attempts)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            # Prefer the attempt that was sent first if both finished
+            for future in sorted(done, key=attempts.index):
+                error = future.exception()
+                if error is not None:
+                    errors.append(error)
+                    continue
+                for loser in attempts:
+                    if loser is not future:
+                        self._discard(loser, cleanup)
+                return future.result()
+        raise errors[0]
+
+    def close(self):
+        """Shuts the worker threads down."""
+        self._executor.shutdown(wait=False)
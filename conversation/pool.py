@@ -0,0 +1,225 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import logging
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+import httpx
+
+from conversation.chat import ChatSession
+from conversation.constants import CONSTANTS
+
+logger = logging.getLogger(__name__)
+
+# (model, system_prompt)
+Key = Tuple[str, str]
+
+
+class ConversationPool:
+    r"""
+    Pool of pre-created conversations.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A class that keeps a few empty, prepared conversations per model and system prompt and
+    refills them from a daemon thread. A chat taken from the pool already has its server-side
+    conversation and root message, so its first message goes out as a single request.
+
+    ----
+
+    Attributes
+    ----------
+    session : httpx.Client
+        Authenticated HTTP client the conversations are created with.
+    size : int
+        Number of warm conversations kept per model and system prompt.
+    retry_interval : float
+        Number of seconds to wait after a conversation could not be created.
+
+    Methods
+    -------
+    warm(model: str = DEFAULT_MODEL, system_prompt: str = ""):
+        Keeps conversations for a model and system prompt warm.
+    chat(model: str = DEFAULT_MODEL, system_prompt: str = "") -> ChatSession:
+        Returns a chat session, using a warm conversation if one is available.
+    available(model: str = DEFAULT_MODEL, system_prompt: str = "") -> int:
+        Returns the number of warm conversations for a model and system prompt.
+    start():
+        Starts the background thread.
+    stop():
+        Stops the background thread and deletes the unused conversations.
+
+    Example
+    -------
+    >>> from conversation.pool import ConversationPool
+    >>>
+    >>> with ConversationPool(auth_manager.authenticate()) as pool:
+    ...     pool.warm()
+    ...     print(pool.chat().ask("Hello!"))
+    """
+
+    def __init__(
+        self, session: httpx.Client, size: int = 2, retry_interval: float = 30.0
+    ):
+        """
+        Constructs all the necessary attributes for the ConversationPool object.
+
+        Parameters
+        ----------
+            session : httpx.Client
+                Authenticated HTTP client the conversations are created with.
+            size : int
+                Number of warm conversations kept per model and system prompt. Defaults to 2.
+            retry_interval : float
+                Number of seconds to wait after a conversation could not be created.
+                Defaults to 30.0.
+        """
+        self.session = session
+        self.size = size
+        self.retry_interval = retry_interval
+        self._warm: Dict[Key, Deque[ChatSession]] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def warm(self, model: str = CONSTANTS["DEFAULT_MODEL"], system_prompt: str = ""):
+        """
+        Keeps conversations for a model and system prompt warm.
+
+        Parameters
+        ----------
+            model : str
+                The model answering in the conversations. Defaults to `CONSTANTS["DEFAULT_MODEL"]`.
+            system_prompt : str
+                The system prompt of the conversations. Defaults to ''.
+        """
+        with self._lock:
+            self._warm.setdefault((model, system_prompt), deque())
+        self._wake.set()
+
+    def chat(
+        self, model: str = CONSTANTS["DEFAULT_MODEL"], system_prompt: str = ""
+    ) -> ChatSession:
+        """
+        Returns a chat session, using a warm conversation if one is available.
+
+        The model and system prompt are kept warm from now on.
+
+        Parameters
+        ----------
+            model : str
+                The model answering in the conversation. Defaults to `CONSTANTS["DEFAULT_MODEL"]`.
+            system_prompt : str
+                The system prompt of the conversation. Defaults to ''.
+
+        Returns
+        -------
+        ChatSession
+            A prepared session, or a new one that creates its conversation on the first send.
+        """
+        with self._lock:
+            warm = self._warm.setdefault((model, system_prompt), deque())
+            chat = warm.popleft() if warm else None
+        self._wake.set()
+        if chat is None:
+            logger.debug(f"No warm conversation for '{model}', creating one on demand.")
+            return ChatSession(self.session, model, system_prompt)
+        return chat
+
+    def available(
+        self, model: str = CONSTANTS["DEFAULT_MODEL"], system_prompt: str = ""
+    ) -> int:
+        """
+        Returns the number of warm conversations for a model and system prompt.
+
+        Parameters
+        ----------
+            model : str
+                The model answering in the conversations. Defaults to `CONSTANTS["DEFAULT_MODEL"]`.
+            system_prompt : str
+                The system prompt of the conversations. Defaults to ''.
+
+        Returns
+        -------
+        int
+            The number of prepared conversations waiting in the pool.
+        """
+        with self._lock:
+            return len(self._warm.get((model, system_prompt), ()))
+
+    def _next_key(self) -> Optional[Key]:
+        """Returns the model and system prompt with the fewest warm conversations, if short."""
+        with self._lock:
+            short = [key for key, warm in self._warm.items() if len(warm) < self.size]
+            return min(short, key=lambda key: len(self._warm[key]), default=None)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            # Clear before checking, so a chat() in between wakes the next wait
+            self._wake.clear()
+            key = self._next_key()
+            if key is None:
+                self._wake.wait()
+                continue
+            chat = ChatSession(self.session, *key)
+            try:
+                chat.prepare()
+            except Exception as e:
+                # Includes unexpected page data, which must not end the thread
+                logger.error(f"Failed to create a warm conversation: {str(e)}")
+                chat.close()
+                self._stop_event.wait(self.retry_interval)
+                continue
+            with self._lock:
+                self._warm[key].append(chat)
+            logger.debug(f"Warmed conversation {chat.conversation_id} for '{key[0]}'.")
+
+    def start(self):
+        """Starts the background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="conversation-pool", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background thread and deletes the unused conversations."""
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            unused = [chat for warm in self._warm.values() for chat in warm]
+            for warm in self._warm.values():
+                warm.clear()
+        for chat in unused:
+            try:
+                chat.delete_conversation()
+            except httpx.HTTPError as e:
+                logger.warning(
+                    f"Failed to delete conversation {chat.conversation_id}: {str(e)}"
+                )
+
+    def __enter__(self) -> "ConversationPool":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
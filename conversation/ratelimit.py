@@ -0,0 +1,301 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from conversation.constants import CONSTANTS
+from utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second up to `burst` tokens.
+
+    `reserve()` takes a token right away, letting the balance go negative, and returns how long
+    the caller has to wait before using it. Waiting happens outside the lock, so threads and
+    asyncio tasks share one bucket and are served in the order they reserved.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def configure(self, rate: float, burst: float):
+        """Changes the rate and burst size, keeping the current balance."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+            self.burst = burst
+            self._tokens = min(self._tokens, burst)
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """Takes one token and returns the number of seconds to wait before using it."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class LaneActivity:
+    """
+    Cross-process record of which lanes recently sent requests with a set of accounts.
+
+    Each lane touches a marker file next to the configuration (`<config>.<lane>-active`) while
+    it sends, holding the share of the limits it claims. Processes sharing the configuration,
+    such as a gateway and a batch run, read each other's markers to split the rate only while
+    both are busy. Writes and reads are throttled to one per `CONSTANTS["LANE_ANNOUNCE_INTERVAL"]`
+    and `CONSTANTS["LANE_CHECK_INTERVAL"]` seconds, and a marker older than
+    `CONSTANTS["LANE_ACTIVE_WINDOW"]` seconds means the lane went idle.
+    """
+
+    def __init__(self, base_path: str):
+        self.base_path = base_path
+        self._announced: Dict[str, float] = {}
+        self._seen: Dict[str, Tuple[float, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, lane: str) -> str:
+        return f"{self.base_path}.{lane}-active"
+
+    def announce(self, lane: str, share: float = 1.0):
+        """Marks a lane as sending, claiming `share` of the limits."""
+        now = time.monotonic()
+        with self._lock:
+            last = self._announced.get(lane)
+            if last is not None and now - last < CONSTANTS["LANE_ANNOUNCE_INTERVAL"]:
+                return
+            self._announced[lane] = now
+        try:
+            with open(self._path(lane), "w") as file:
+                file.write(repr(share))
+        except OSError as e:
+            logger.warning(f"Could not mark the {lane} lane as active: {e}")
+
+    def active_share(self, lane: str) -> Optional[float]:
+        """Returns the share a lane claimed if it sent recently, otherwise None."""
+        now = time.monotonic()
+        with self._lock:
+            seen = self._seen.get(lane)
+            if seen is not None and now - seen[0] < CONSTANTS["LANE_CHECK_INTERVAL"]:
+                return seen[1]
+        share = self._read(lane)
+        with self._lock:
+            self._seen[lane] = (now, share)
+        return share
+
+    def _read(self, lane: str) -> Optional[float]:
+        path = self._path(lane)
+        try:
+            if time.time() - os.path.getmtime(path) > CONSTANTS["LANE_ACTIVE_WINDOW"]:
+                return None
+            with open(path) as file:
+                text = file.read()
+        except OSError:
+            return None
+        try:
+            share = float(text)
+        except ValueError:
+            # Caught the marker halfway through a write
+            share = CONSTANTS["BATCH_RATE_SHARE"]
+        return share if 0 < share < 1 else CONSTANTS["BATCH_RATE_SHARE"]
+
+
+class RateLimiter:
+    r"""
+    Rate limiter for outbound HuggingChat requests.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A class that keeps one `TokenBucket` per (account, model) pair and paces requests so they
+    stay below the upstream limits instead of running into 429 responses. Rates are read from
+    the RATE_LIMIT section of the configuration (see `Config.get_rate_limit`), falling back to
+    `CONSTANTS["RATE_LIMIT"]` and `CONSTANTS["RATE_LIMIT_BURST"]`; changes to the configuration
+    apply to existing buckets on their next use.
+
+    One instance can be shared by any number of threads and asyncio tasks. Processes sending
+    with the same accounts each get a `share` of the limits, e.g. 1/4 for four workers.
+
+    Interactive chats and batch runs on the same accounts set `lane` and coordinate through
+    `LaneActivity` markers next to the configuration: a batch run takes `batch_share` of the
+    limits while interactive traffic is active and all of them otherwise, and the interactive
+    side gives up the share a running batch claims. Together they stay within the limits.
+
+    ----
+
+    Attributes
+    ----------
+    config : Config | None
+        The configuration holding the rate limits.
+    share : float
+        The fraction of the limits this instance may use.
+    lane : str | None
+        "interactive" or "batch" to coordinate with the other lane, or None.
+    batch_share : float
+        The fraction of the limits a batch run keeps while interactive traffic is active.
+
+    Methods
+    -------
+    limits(model: str) -> Tuple[float, float]:
+        Returns the (rate, burst) pair that applies to a model.
+    acquire(account: str, model: str) -> float:
+        Blocks until a request may be sent and returns the time waited.
+    acquire_async(account: str, model: str) -> float:
+        Awaits until a request may be sent and returns the time waited.
+
+    Example
+    -------
+    >>> from conversation.ratelimit import RateLimiter
+    >>>
+    >>> limiter = RateLimiter(Config())
+    >>> chat = ChatSession(session, account=email, rate_limiter=limiter)
+    """
+
+    def __init__(
+        self,
+        config: Optional[Config] = None,
+        share: float = 1.0,
+        lane: Optional[str] = None,
+        batch_share: float = CONSTANTS["BATCH_RATE_SHARE"],
+    ):
+        """
+        Constructs all the necessary attributes for the RateLimiter object.
+
+        Parameters
+        ----------
+            config : Config, optional
+                The configuration holding the rate limits. Defaults to None (built-in limits).
+            share : float
+                The fraction of the limits this instance may use. Defaults to 1.0.
+            lane : str, optional
+                "interactive" or "batch" to coordinate with the other lane. Defaults to None.
+            batch_share : float
+                The fraction of the limits a batch run keeps while interactive traffic is
+                active, in (0, 1). Defaults to `CONSTANTS["BATCH_RATE_SHARE"]`.
+        """
+        if lane not in (None, "interactive", "batch"):
+            raise ValueError(f"Unknown lane '{lane}'.")
+        if not 0 < batch_share < 1:
+            raise ValueError("The batch share must be in (0, 1).")
+        self.config = config
+        self.share = share
+        self.lane = lane
+        self.batch_share = batch_share
+        self.activity: Optional[LaneActivity] = None
+        if lane is not None and config is not None:
+            self.activity = LaneActivity(os.path.splitext(config.lock_path)[0])
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def limits(self, model: str) -> Tuple[float, float]:
+        """
+        Returns the (rate, burst) pair that applies to a model.
+
+        Parameters
+        ----------
+            model : str
+                The model the request goes to.
+
+        Returns
+        -------
+        Tuple[float, float]
+            Requests per second and the number of requests allowed back to back.
+        """
+        configured = self.config.get_rate_limit(model) if self.config else None
+        if configured is None:
+            configured = CONSTANTS["RATE_LIMIT"], CONSTANTS["RATE_LIMIT_BURST"]
+        rate, burst = configured
+        share = self.share * self._lane_share()
+        # A bucket must hold at least one token, or no request could ever pass
+        return rate * share, max(burst * share, 1.0)
+
+    def _lane_share(self) -> float:
+        if self.activity is None:
+            return 1.0
+        if self.lane == "batch":
+            interactive = self.activity.active_share("interactive")
+            return 1.0 if interactive is None else self.batch_share
+        batch = self.activity.active_share("batch")
+        return 1.0 if batch is None else 1.0 - batch
+
+    def _reserve(self, account: str, model: str) -> float:
+        if self.activity is not None and self.lane is not None:
+            share = self.batch_share if self.lane == "batch" else 1.0
+            self.activity.announce(self.lane, share)
+        rate, burst = self.limits(model)
+        with self._lock:
+            bucket = self._buckets.get((account, model))
+            if bucket is None:
+                bucket = self._buckets[(account, model)] = TokenBucket(rate, burst)
+        if (bucket.rate, bucket.burst) != (rate, burst):
+            bucket.configure(rate, burst)
+        delay = bucket.reserve()
+        if delay:
+            logger.debug(f"Pacing request of '{account}' to '{model}' by {delay:.2f}s.")
+        return delay
+
+    def acquire(self, account: str, model: str) -> float:
+        """
+        Blocks until a request may be sent and returns the time waited.
+
+        Parameters
+        ----------
+            account : str
+                The account sending the request.
+            model : str
+                The model the request goes to.
+
+        Returns
+        -------
+        float
+            The number of seconds waited.
+        """
+        delay = self._reserve(account, model)
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    async def acquire_async(self, account: str, model: str) -> float:
+        """
+        Awaits until a request may be sent and returns the time waited.
+
+        Parameters
+        ----------
+            account : str
+                The account sending the request.
+            model : str
+                The model the request goes to.
+
+        Returns
+        -------
+        float
+            The number of seconds waited.
+        """
+        delay = self._reserve(account, model)
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
@@ -0,0 +1,150 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import logging
+from typing import Any, Dict, Iterable, Iterator, List
+
+logger = logging.getLogger(__name__)
+
+
+class StreamDecoder:
+    r"""
+    Incremental decoder for the HuggingChat response stream.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A class that splits the newline-delimited JSON updates ("stream", "finalAnswer",
+    "status", ...) out of raw response chunks. Chunks are appended to one reusable
+    `bytearray`; complete frames are decoded straight from a `memoryview` of it, so no
+    intermediate bytes or strings are built per chunk, and the consumed prefix is dropped
+    once per chunk. A frame split across chunks, even inside a multi-byte UTF-8 character,
+    is completed by the next chunk.
+
+    ----
+
+    Methods
+    -------
+    feed(chunk: bytes) -> List[Dict[str, Any]]:
+        Adds a chunk and returns the updates completed by it.
+    finish() -> List[Dict[str, Any]]:
+        Returns the last update if the stream did not end with a newline.
+    decode(chunks: Iterable[bytes]) -> Iterator[Dict[str, Any]]:
+        Yields every update of a chunked stream.
+
+    Example
+    -------
+    >>> from conversation.stream import StreamDecoder
+    >>>
+    >>> decoder = StreamDecoder()
+    >>> decoder.feed(b'{"type": "stream", "token": "Hel')
+    []
+    >>> decoder.feed(b'lo"}\n{"type"')
+    [{'type': 'stream', 'token': 'Hello'}]
+    """
+
+    def __init__(self):
+        """
+        Constructs all the necessary attributes for the StreamDecoder object.
+        """
+        self._buffer = bytearray()
+        # Bytes at the start of the buffer already searched for a newline
+        self._scanned = 0
+
+    def feed(self, chunk: bytes) -> List[Dict[str, Any]]:
+        """
+        Adds a chunk and returns the updates completed by it.
+
+        Parameters
+        ----------
+            chunk : bytes
+                The next chunk of the response body. Any bytes-like object is accepted.
+
+        Raises
+        ------
+        ValueError
+            If a complete frame is not valid JSON.
+
+        Returns
+        -------
+        list
+            The decoded updates, in stream order.
+        """
+        buffer = self._buffer
+        buffer += chunk
+        newline = buffer.find(b"\n", self._scanned)
+        if newline == -1:
+            self._scanned = len(buffer)
+            return []
+
+        updates: List[Dict[str, Any]] = []
+        start = 0
+        with memoryview(buffer) as view:
+            while newline != -1:
+                if newline > start:
+                    self._decode(view[start:newline], updates)
+                start = newline + 1
+                newline = buffer.find(b"\n", start)
+        # The view must be released before the bytearray can be resized
+        del buffer[:start]
+        self._scanned = len(buffer)
+        return updates
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """
+        Returns the last update if the stream did not end with a newline.
+
+        Raises
+        ------
+        ValueError
+            If the remaining bytes are not valid JSON.
+
+        Returns
+        -------
+        list
+            The decoded update, or an empty list if nothing is left.
+        """
+        updates: List[Dict[str, Any]] = []
+        if self._buffer:
+            with memoryview(self._buffer) as view:
+                self._decode(view, updates)
+            self._buffer.clear()
+        self._scanned = 0
+        return updates
+
+    def decode(self, chunks: Iterable[bytes]) -> Iterator[Dict[str, Any]]:
+        """
+        Yields every update of a chunked stream.
+
+        Parameters
+        ----------
+            chunks : Iterable[bytes]
+                The chunks of the response body, e.g. `response.iter_bytes()`.
+
+        Yields
+        ------
+        dict
+            The decoded updates, as soon as their frame is complete.
+        """
+        for chunk in chunks:
+            yield from self.feed(chunk)
+        yield from self.finish()
+
+    @staticmethod
+    def _decode(frame: memoryview, updates: List[Dict[str, Any]]):
+        # str() decodes straight from the buffer; json.loads(bytes) would copy first
+        text = str(frame, "utf-8")
+        if text.isspace():
+            return
+        updates.append(json.loads(text))
@@ -0,0 +1,533 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, highest first
+LANES = ("interactive", "batch")
+
+
+class QueueFullError(Exception):
+    """Raised when a request is shed; `retry_after` estimates when to try again, in seconds."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Queue:
+    """Requests of one tenant in one lane, with the tenant's deficit in that lane."""
+
+    __slots__ = ("tenant", "waiters", "deficit", "has_turn")
+
+    def __init__(self, tenant: "_Tenant"):
+        self.tenant = tenant
+        # (waiter, cost, enqueued_at), oldest first
+        self.waiters: Deque[Tuple["asyncio.Future[None]", float, float]] = deque()
+        self.deficit = 0.0
+        self.has_turn = False
+
+    def remove(self, waiter: "asyncio.Future[None]") -> bool:
+        for entry in self.waiters:
+            if entry[0] is waiter:
+                self.waiters.remove(entry)
+                return True
+        return False
+
+
+class _Tenant:
+    """Weight, queues and counters of one tenant."""
+
+    __slots__ = (
+        "name",
+        "weight",
+        "queues",
+        "active",
+        "served",
+        "shed",
+        "wait_avg",
+        "wait_max",
+    )
+
+    def __init__(self, name: str, weight: float = 1.0):
+        self.name = name
+        self.weight = weight
+        self.queues = {lane: _Queue(self) for lane in LANES}
+        self.active = 0
+        self.served = 0
+        self.shed = 0
+        self.wait_avg = 0.0
+        self.wait_max = 0.0
+
+    def queued(self) -> int:
+        return sum(len(q.waiters) for q in self.queues.values())
+
+    def record_wait(self, seconds: float):
+        self.served += 1
+        self.wait_avg = (
+            seconds if self.served == 1 else 0.9 * self.wait_avg + 0.1 * seconds
+        )
+        self.wait_max = max(self.wait_max, seconds)
+
+
+class _Lane:
+    """Concurrency cap and round-robin order of one priority class."""
+
+    __slots__ = ("name", "cap", "active", "queued", "round")
+
+    def __init__(self, name: str, cap: int):
+        self.name = name
+        self.cap = cap
+        self.active = 0
+        self.queued = 0
+        # Queues with waiting requests, in round-robin order
+        self.round: Deque[_Queue] = deque()
+
+
+class Admission:
+    r"""
+    Bounded, fair and prioritized admission to upstream slots.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A class that lets at most `slots` requests run upstream at the same time and queues the
+    rest per priority lane and tenant.
+
+    Lanes (`LANES`: 'interactive', then 'batch') are strictly ordered: a free slot goes to a
+    queued interactive request before any queued batch request, so interactive work jumps
+    ahead of a batch backlog. Each lane also has its own concurrency cap (`lane_slots`);
+    keeping the batch cap below `slots` leaves headroom for interactive requests arriving
+    while a batch runs. Running requests are never interrupted.
+
+    Within a lane, free slots go to the tenants by deficit round robin: every turn a
+    tenant's deficit grows by `quantum * weight` and it is served while the deficit covers
+    the cost of its oldest request, so a tenant with weight 2 gets twice the slots of one
+    with weight 1 and a tenant with a long backlog cannot starve the others.
+
+    The queue is bounded by `max_queue` requests in total. When it is full, a queued request
+    is displaced to make room: the newest one of the lowest lane below the arriving request
+    if there is one, otherwise the newest one of the longest backlog (relative to weight)
+    in the arriving request's lane, unless that is the arriving tenant, whose request is shed
+    instead. Requests waiting longer than `max_wait` seconds are shed too. Shed requests fail
+    with `QueueFullError`, so a burst costs a fast 503 instead of memory and latency.
+
+    All methods must be called from the event loop thread.
+
+    ----
+
+    Attributes
+    ----------
+    slots : int
+        Maximum number of requests running upstream at the same time.
+    max_queue : int
+        Maximum number of requests waiting for a slot, over all lanes and tenants.
+    max_wait : float
+        Number of seconds a request waits for a slot before it is shed.
+    quantum : float
+        The deficit a tenant of weight 1 earns per turn, in units of request cost.
+
+    Methods
+    -------
+    set_weight(tenant: str, weight: float):
+        Sets the share of the slots a tenant gets while several are queued.
+    acquire(tenant: str = "default", cost: float = 1.0, lane: str = "interactive"):
+        Waits for a slot.
+    release(duration: float, tenant: str = "default", lane: str = "interactive"):
+        Frees a slot and hands it to the next waiting request.
+    active(lane: str | None = None) -> int:
+        Returns the number of requests holding a slot.
+    queued(tenant: str | None = None, lane: str | None = None) -> int:
+        Returns the number of requests waiting for a slot.
+    retry_after() -> int:
+        Estimates the seconds until a new request would get a slot.
+    stats() -> Dict[str, Dict[str, Any]]:
+        Returns the queue depth, wait times and counters per tenant.
+    lane_stats() -> Dict[str, Dict[str, int]]:
+        Returns the cap, running and queued requests per lane.
+
+    Example
+    -------
+    >>> from gateway.admission import Admission
+    >>>
+    >>> admission = Admission(slots=32, max_queue=64, lane_slots={"batch": 8})
+    >>> admission.set_weight("web", 4)
+    >>> await admission.acquire("web", lane="interactive")
+    >>> try:
+    ...     ...
+    ... finally:
+    ...     admission.release(duration, "web", lane="interactive")
+    """
+
+    def __init__(
+        self,
+        slots: int,
+        max_queue: int,
+        max_wait: float = 30.0,
+        quantum: float = 1.0,
+        lane_slots: Optional[Dict[str, int]] = None,
+    ):
+        """
+        Constructs all the necessary attributes for the Admission object.
+
+        Parameters
+        ----------
+            slots : int
+                Maximum number of requests running upstream at the same time.
+            max_queue : int
+                Maximum number of requests waiting for a slot, over all lanes and tenants.
+            max_wait : float
+                Number of seconds a request waits for a slot before it is shed.
+                Defaults to 30.0.
+            quantum : float
+                The deficit a tenant of weight 1 earns per turn. Defaults to 1.0.
+            lane_slots : Dict[str, int], optional
+                Maximum number of running requests per lane. Defaults to None (every lane
+                may use every slot).
+        """
+        self.slots = slots
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.quantum = quantum
+        caps = lane_slots or {}
+        unknown = set(caps) - set(LANES)
+        if unknown:
+            raise ValueError(f"Unknown lanes: {', '.join(sorted(unknown))}.")
+        self._lanes = {lane: _Lane(lane, caps.get(lane, slots)) for lane in LANES}
+        self._active = 0
+        self._queued = 0
+        self._tenants: Dict[str, _Tenant] = {}
+        # Moving average of the seconds a request holds its slot
+        self._service_time = 1.0
+
+    def _tenant(self, name: str) -> _Tenant:
+        tenant = self._tenants.get(name)
+        if tenant is None:
+            tenant = self._tenants[name] = _Tenant(name)
+        return tenant
+
+    def _lane(self, name: str) -> _Lane:
+        lane = self._lanes.get(name)
+        if lane is None:
+            raise ValueError(f"Unknown lane '{name}', expected one of {LANES}.")
+        return lane
+
+    def set_weight(self, tenant: str, weight: float):
+        """
+        Sets the share of the slots a tenant gets while several are queued.
+
+        Parameters
+        ----------
+            tenant : str
+                The name of the tenant.
+            weight : float
+                The tenant's weight; unknown tenants have weight 1.
+        """
+        if weight <= 0:
+            raise ValueError("Tenant weight must be positive.")
+        self._tenant(tenant).weight = weight
+
+    def active(self, lane: Optional[str] = None) -> int:
+        """
+        Returns the number of requests holding a slot.
+
+        Parameters
+        ----------
+            lane : str, optional
+                Count only the requests of this lane. Defaults to None (every lane).
+
+        Returns
+        -------
+        int
+            The number of requests running upstream.
+        """
+        return self._active if lane is None else self._lane(lane).active
+
+    def queued(self, tenant: Optional[str] = None, lane: Optional[str] = None) -> int:
+        """
+        Returns the number of requests waiting for a slot.
+
+        Parameters
+        ----------
+            tenant : str, optional
+                Count only the requests of this tenant. Defaults to None (every tenant).
+            lane : str, optional
+                Count only the requests of this lane. Defaults to None (every lane).
+
+        Returns
+        -------
+        int
+            The queue length.
+        """
+        if tenant is None:
+            return self._queued if lane is None else self._lane(lane).queued
+        known = self._tenants.get(tenant)
+        if known is None:
+            return 0
+        if lane is None:
+            return known.queued()
+        return len(known.queues[self._lane(lane).name].waiters)
+
+    def retry_after(self) -> int:
+        """
+        Estimates the seconds until a new request would get a slot.
+
+        Returns
+        -------
+        int
+            The estimate, at least 1.
+        """
+        waves = (self._queued + 1) / max(self.slots, 1)
+        return max(1, math.ceil(self._service_time * waves))
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the queue depth, wait times and counters per tenant.
+
+        Returns
+        -------
+        dict
+            Per tenant: 'weight', 'queued', 'active', 'served', 'shed', 'oldest_wait' (age of
+            its oldest queued request), 'wait_avg' (moving average) and 'wait_max', in seconds.
+        """
+        now = time.monotonic()
+        stats: Dict[str, Dict[str, Any]] = {}
+        for name, t in self._tenants.items():
+            oldest = min(
+                (q.waiters[0][2] for q in t.queues.values() if q.waiters), default=now
+            )
+            stats[name] = {
+                "weight": t.weight,
+                "queued": t.queued(),
+                "active": t.active,
+                "served": t.served,
+                "shed": t.shed,
+                "oldest_wait": round(now - oldest, 3),
+                "wait_avg": round(t.wait_avg, 3),
+                "wait_max": round(t.wait_max, 3),
+            }
+        return stats
+
+    def lane_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Returns the cap, running and queued requests per lane.
+
+        Returns
+        -------
+        dict
+            Per lane: 'cap', 'active' and 'queued'.
+        """
+        return {
+            name: {"cap": lane.cap, "active": lane.active, "queued": lane.queued}
+            for name, lane in self._lanes.items()
+        }
+
+    def _shed(self, message: str) -> QueueFullError:
+        return QueueFullError(message, self.retry_after())
+
+    def _displace(self, lane: _Lane, queue: _Queue):
+        waiter, _, _ = queue.waiters.pop()
+        lane.queued -= 1
+        self._queued -= 1
+        queue.tenant.shed += 1
+        logger.warning(
+            f"Shedding queued {lane.name} request of '{queue.tenant.name}' to make room."
+        )
+        waiter.set_exception(self._shed("Request displaced from a full queue."))
+
+    def _make_room(self, arriving: _Tenant, lane: _Lane):
+        """Displaces a queued request for the arriving one, or sheds the arriving one."""
+
+        def longest(candidate: _Lane) -> Optional[_Queue]:
+            return max(
+                (q for q in candidate.round if q.waiters),
+                key=lambda q: len(q.waiters) / q.tenant.weight,
+                default=None,
+            )
+
+        # Lower lanes give way first, the lowest one first
+        position = LANES.index(lane.name)
+        for lower in reversed(LANES[position + 1 :]):
+            queue = longest(self._lanes[lower])
+            if queue is not None:
+                self._displace(self._lanes[lower], queue)
+                return
+
+        queue = longest(lane)
+        own = arriving.queues[lane.name]
+        if (
+            queue is None
+            or len(queue.waiters) / queue.tenant.weight
+            <= (len(own.waiters) + 1) / arriving.weight
+        ):
+            arriving.shed += 1
+            logger.warning(f"Shedding request of '{arriving.name}', queue is full.")
+            raise self._shed("Gateway queue is full.")
+        self._displace(lane, queue)
+
+    def _must_wait(self, lane: _Lane) -> bool:
+        """Whether a new request of `lane` has to queue behind others or for a slot."""
+        if self._active >= self.slots or lane.active >= lane.cap:
+            return True
+        # Only waiters of lanes at or above this one are ahead of it
+        for name in LANES[: LANES.index(lane.name) + 1]:
+            if self._lanes[name].queued:
+                return True
+        return False
+
+    async def acquire(
+        self, tenant: str = "default", cost: float = 1.0, lane: str = "interactive"
+    ):
+        """
+        Waits for a slot.
+
+        Parameters
+        ----------
+            tenant : str
+                The tenant the request is queued for. Defaults to 'default'.
+            cost : float
+                The deficit the request uses up when it is served. Defaults to 1.0.
+            lane : str
+                The priority class of the request, one of `LANES`. Defaults to 'interactive'.
+
+        Raises
+        ------
+        ValueError
+            If the lane is unknown.
+        QueueFullError
+            If the request was shed from a full queue or no slot was free within `max_wait`.
+        """
+        owner = self._tenant(tenant)
+        priority = self._lane(lane)
+        if not self._must_wait(priority):
+            self._active += 1
+            priority.active += 1
+            owner.active += 1
+            owner.record_wait(0.0)
+            return
+        if self._queued >= self.max_queue:
+            self._make_room(owner, priority)
+
+        loop = asyncio.get_running_loop()
+        waiter: "asyncio.Future[None]" = loop.create_future()
+        queue = owner.queues[lane]
+        queue.waiters.append((waiter, cost, time.monotonic()))
+        priority.queued += 1
+        self._queued += 1
+        if queue not in priority.round:
+            priority.round.append(queue)
+        timer = loop.call_later(self.max_wait, self._expire, priority, queue, waiter)
+        try:
+            await waiter
+        except BaseException:
+            if waiter.cancelled() or waiter.exception() is not None:
+                if queue.remove(waiter):
+                    priority.queued -= 1
+                    self._queued -= 1
+            else:
+                # Granted just as the caller gave up, so the slot goes to the next one
+                owner.active -= 1
+                priority.active -= 1
+                self._handover()
+            raise
+        finally:
+            timer.cancel()
+
+    def _expire(self, lane: _Lane, queue: _Queue, waiter: "asyncio.Future[None]"):
+        if waiter.done() or not queue.remove(waiter):
+            return
+        lane.queued -= 1
+        self._queued -= 1
+        queue.tenant.shed += 1
+        waiter.set_exception(
+            self._shed(f"No upstream slot within {self.max_wait:g} seconds.")
+        )
+
+    def release(
+        self, duration: float, tenant: str = "default", lane: str = "interactive"
+    ):
+        """
+        Frees a slot and hands it to the next waiting request.
+
+        Parameters
+        ----------
+            duration : float
+                Number of seconds the slot was held, which tunes `retry_after()`.
+            tenant : str
+                The tenant the slot was acquired for. Defaults to 'default'.
+            lane : str
+                The lane the slot was acquired in. Defaults to 'interactive'.
+        """
+        self._service_time = 0.9 * self._service_time + 0.1 * duration
+        self._tenant(tenant).active -= 1
+        self._lane(lane).active -= 1
+        self._handover()
+
+    def _next_in(
+        self, lane: _Lane
+    ) -> Optional[Tuple[_Tenant, "asyncio.Future[None]", float]]:
+        """Picks the next request of a lane by deficit round robin."""
+        while lane.round:
+            queue = lane.round[0]
+            if not queue.waiters:
+                queue.deficit, queue.has_turn = 0.0, False
+                lane.round.popleft()
+                continue
+            if not queue.has_turn:
+                queue.deficit += self.quantum * queue.tenant.weight
+                queue.has_turn = True
+            waiter, cost, enqueued_at = queue.waiters[0]
+            if waiter.done():
+                # Cancelled; its task has not yet run to take it out of the queue
+                queue.waiters.popleft()
+                lane.queued -= 1
+                self._queued -= 1
+                continue
+            if queue.deficit < cost:
+                # Turn over; the deficit carries into the next round
+                queue.has_turn = False
+                lane.round.rotate(-1)
+                continue
+            queue.deficit -= cost
+            queue.waiters.popleft()
+            lane.queued -= 1
+            self._queued -= 1
+            if not queue.waiters:
+                queue.deficit, queue.has_turn = 0.0, False
+                lane.round.popleft()
+            return queue.tenant, waiter, enqueued_at
+        return None
+
+    def _handover(self):
+        """Gives a freed slot to the next request of the highest lane below its cap."""
+        for name in LANES:
+            lane = self._lanes[name]
+            if lane.active >= lane.cap:
+                continue
+            picked = self._next_in(lane)
+            if picked is None:
+                continue
+            tenant, waiter, enqueued_at = picked
+            lane.active += 1
+            tenant.active += 1
+            tenant.record_wait(time.monotonic() - enqueued_at)
+            waiter.set_result(None)
+            return
+        self._active -= 1
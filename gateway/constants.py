@@ -0,0 +1,42 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from typing import Any, Dict
+
+CONSTANTS: Dict[str, Any] = {
+    "HOST": "127.0.0.1",
+    "PORT": 8000,
+    # Largest request body accepted, in bytes
+    "MAX_BODY": 1024 * 1024,
+    # Seconds an idle keep-alive connection is held open
+    "KEEPALIVE_TIMEOUT": 60.0,
+    # Threads running upstream requests, i.e. requests in flight to HuggingChat
+    "MAX_UPSTREAM": 32,
+    # Requests waiting for an upstream slot, and the seconds they wait, before load is shed
+    "MAX_QUEUE": 64,
+    "QUEUE_TIMEOUT": 30.0,
+    # Upstream slots interactive requests may hold at once; None lets them use every slot
+    "INTERACTIVE_SLOTS": None,
+    # Upstream slots batch requests may hold at once, leaving the rest to interactive ones
+    "BATCH_SLOTS": 8,
+    # Open client connections; further ones are answered 503 and closed
+    "MAX_CONNECTIONS": 1024,
+    # Tokens buffered per stream before the upstream read pauses for a slow client
+    "STREAM_BUFFER": 64,
+    # Bytes buffered per connection before writes wait for the client
+    "WRITE_BUFFER": 64 * 1024,
+    # Seconds the model list is reused before it is fetched again
+    "MODELS_TTL": 300.0,
+}
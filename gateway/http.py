@@ -0,0 +1,175 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import json
+from http import HTTPStatus
+from typing import Any, Dict, Optional, Tuple
+
+
+class HTTPError(Exception):
+    """Error answered to the client with `status` and an OpenAI-style error body."""
+
+    def __init__(
+        self,
+        status: int,
+        message: str,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class Request:
+    """A parsed HTTP/1.1 request."""
+
+    __slots__ = ("method", "path", "headers", "body")
+
+    def __init__(self, method: str, path: str, headers: Dict[str, str], body: bytes):
+        self.method = method
+        self.path = path
+        # Header names are lower-case
+        self.headers = headers
+        self.body = body
+
+    @property
+    def keep_alive(self) -> bool:
+        return self.headers.get("connection", "").lower() != "close"
+
+    def json(self) -> Any:
+        try:
+            return json.loads(self.body or b"null")
+        except ValueError:
+            raise HTTPError(400, "Request body is not valid JSON.")
+
+
+async def read_request(
+    reader: asyncio.StreamReader, max_body: int
+) -> Optional[Request]:
+    """
+    Reads one request from a connection.
+
+    Parameters
+    ----------
+        reader : asyncio.StreamReader
+            The client connection.
+        max_body : int
+            Largest body accepted, in bytes.
+
+    Raises
+    ------
+    HTTPError
+        If the request is malformed or its body too large.
+
+    Returns
+    -------
+    Request | None
+        The request, or None if the client closed the connection between requests.
+    """
+    try:
+        line = await reader.readline()
+        if not line:
+            return None
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+    except (ValueError, asyncio.LimitOverrunError):
+        raise HTTPError(400, "Malformed request.")
+
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HTTPError(411, "Chunked request bodies are not supported.")
+    content_length = headers.get("content-length", "0")
+    # Digits only: int() also takes signs, spaces and underscores
+    if not (content_length.isascii() and content_length.isdigit()):
+        raise HTTPError(400, "Invalid Content-Length.")
+    length = int(content_length)
+    if length > max_body:
+        raise HTTPError(413, f"Request body larger than {max_body} bytes.")
+    try:
+        body = await reader.readexactly(length) if length else b""
+    except asyncio.IncompleteReadError:
+        return None
+    return Request(method.upper(), target.split("?", 1)[0], headers, body)
+
+
+def render_head(status: int, headers: Dict[str, str]) -> bytes:
+    """Returns the status line and headers of a response."""
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+    lines.extend(f"{name}: {value}" for name, value in headers.items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def send_json(
+    writer: asyncio.StreamWriter,
+    status: int,
+    payload: Any,
+    keep_alive: bool = True,
+    headers: Optional[Dict[str, str]] = None,
+):
+    """Writes a complete JSON response."""
+    body = json.dumps(payload, ensure_ascii=False).encode()
+    head = {
+        "Content-Type": "application/json",
+        "Content-Length": str(len(body)),
+        "Connection": "keep-alive" if keep_alive else "close",
+    }
+    head.update(headers or {})
+    writer.write(render_head(status, head) + body)
+    await writer.drain()
+
+
+def error_body(status: int, message: str) -> Dict[str, Any]:
+    """Returns an error in the shape the OpenAI API uses."""
+    kind = "invalid_request_error" if status < 500 else "server_error"
+    return {"error": {"message": message, "type": kind, "code": status}}
+
+
+class EventStream:
+    """Server-sent events written with chunked transfer encoding."""
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+
+    async def open(self, keep_alive: bool = True):
+        head = {
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "Transfer-Encoding": "chunked",
+            "Connection": "keep-alive" if keep_alive else "close",
+        }
+        self.writer.write(render_head(200, head))
+        await self.writer.drain()
+
+    async def send(self, data: str):
+        event = f"data: {data}\n\n".encode()
+        self.writer.write(b"%x\r\n%s\r\n" % (len(event), event))
+        await self.writer.drain()
+
+    async def close(self):
+        self.writer.write(b"0\r\n\r\n")
+        await self.writer.drain()
+
+
+def parse_bearer(request: Request) -> Tuple[str, str]:
+    """Returns the scheme and credentials of the Authorization header."""
+    scheme, _, credentials = request.headers.get("authorization", "").partition(" ")
+    return scheme.lower(), credentials.strip()
@@ -0,0 +1,223 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def reuse_port_supported() -> bool:
+    """Whether the kernel balances connections over sockets bound with SO_REUSEPORT."""
+    return hasattr(socket, "SO_REUSEPORT") and sys.platform.startswith("linux")
+
+
+def listen(
+    host: str, port: int, reuse_port: bool = False, backlog: int = 1024
+) -> socket.socket:
+    """
+    Returns a listening TCP socket.
+
+    Parameters
+    ----------
+        host : str
+            The interface to listen on.
+        port : int
+            The port to listen on.
+        reuse_port : bool
+            Set SO_REUSEPORT, so every worker can bind its own socket to the same port.
+            Defaults to False.
+        backlog : int
+            Number of connections the kernel queues before they are accepted. Defaults to 1024.
+
+    Returns
+    -------
+    socket.socket
+        The bound, non-blocking socket.
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((host, port))
+        sock.listen(backlog)
+        sock.setblocking(False)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def _exit_code(status: int) -> int:
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+class Prefork:
+    r"""
+    Pre-forking process supervisor.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A class that forks `workers` processes, each running `serve` on a listening socket, and
+    restarts the ones that crash. On Linux every worker binds its own socket with SO_REUSEPORT
+    and the kernel spreads new connections over them; elsewhere the socket is bound once and
+    inherited by every worker.
+
+    Nothing holding threads or open connections may be created before `run()`: workers must
+    build their clients, pools and event loops themselves. SIGINT and SIGTERM stop every
+    worker, which see them as `KeyboardInterrupt`.
+
+    Only available where `os.fork` is (POSIX).
+
+    ----
+
+    Attributes
+    ----------
+    serve : Callable[[socket.socket], int]
+        Serves connections in a worker and returns its exit code.
+    host : str
+        The interface to listen on.
+    port : int
+        The port to listen on.
+    workers : int
+        Number of worker processes.
+    restart_delay : float
+        Number of seconds to wait before restarting a worker that crashed.
+
+    Methods
+    -------
+    run() -> int:
+        Forks the workers and supervises them until they all exit.
+
+    Example
+    -------
+    >>> from gateway.prefork import Prefork
+    >>>
+    >>> def serve(sock):
+    ...     asyncio.run(Gateway(SessionPool.from_directory()).serve(sock=sock))
+    ...     return 0
+    >>>
+    >>> Prefork(serve, "127.0.0.1", 8000, workers=4).run()
+    """
+
+    def __init__(
+        self,
+        serve: Callable[[socket.socket], int],
+        host: str,
+        port: int,
+        workers: int,
+        restart_delay: float = 1.0,
+    ):
+        """
+        Constructs all the necessary attributes for the Prefork object.
+
+        Parameters
+        ----------
+            serve : Callable[[socket.socket], int]
+                Serves connections in a worker and returns its exit code.
+            host : str
+                The interface to listen on.
+            port : int
+                The port to listen on.
+            workers : int
+                Number of worker processes.
+            restart_delay : float
+                Number of seconds to wait before restarting a worker that crashed.
+                Defaults to 1.0.
+        """
+        self.serve = serve
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.restart_delay = restart_delay
+        self._children: Dict[int, int] = {}  # pid -> worker number
+        self._stopping = False
+
+    def _spawn(self, number: int, shared: Optional[socket.socket]):
+        pid = os.fork()
+        if pid:
+            self._children[pid] = number
+            return
+        # Worker process: never returns into the supervisor's code
+        code = 1
+        try:
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            sock = shared or listen(self.host, self.port, reuse_port=True)
+            code = self.serve(sock)
+        except KeyboardInterrupt:
+            code = 0
+        except BaseException:
+            logger.exception(f"Worker {number} failed.")
+        finally:
+            logging.shutdown()
+            os._exit(code)
+
+    def _stop(self, signum: int, frame: object):
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> int:
+        """
+        Forks the workers and supervises them until they all exit.
+
+        Returns
+        -------
+        int
+            0 if every worker exited cleanly, otherwise the last failing exit code.
+        """
+        shared = None
+        if reuse_port_supported():
+            # Fails fast if the port is taken, before any worker is forked
+            listen(self.host, self.port, reuse_port=True).close()
+        else:
+            shared = listen(self.host, self.port)
+        previous = {
+            s: signal.signal(s, self._stop) for s in (signal.SIGINT, signal.SIGTERM)
+        }
+        result = 0
+        try:
+            for number in range(self.workers):
+                self._spawn(number, shared)
+            logger.info(f"Started {self.workers} workers on port {self.port}.")
+            while self._children:
+                pid, status = os.wait()
+                number = self._children.pop(pid)
+                code = _exit_code(status)
+                if code == 0 or self._stopping:
+                    continue
+                result = code
+                logger.error(f"Worker {number} exited with {code}, restarting it.")
+                time.sleep(self.restart_delay)
+                if not self._stopping:
+                    self._spawn(number, shared)
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+            if shared is not None:
+                shared.close()
+        return result
@@ -0,0 +1,727 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import (
+    Any,
+    AsyncGenerator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+import httpx
+
+from auth.constants import CONSTANTS as AUTH_CONSTANTS
+from auth.errors import AccountUnavailableError, NoSessionAvailableError
+from auth.session_pool import SessionPool
+from conversation.cache import ResponseCache
+from conversation.chat import ChatSession
+from conversation.coalescer import RequestCoalescer
+from conversation.constants import CONSTANTS as CHAT_CONSTANTS
+from conversation.hedge import Hedger
+from conversation.ratelimit import RateLimiter
+from gateway.admission import LANES, Admission, QueueFullError
+from gateway.constants import CONSTANTS
+from gateway.http import (
+    EventStream,
+    HTTPError,
+    Request,
+    error_body,
+    parse_bearer,
+    read_request,
+    send_json,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Marks the end of a token stream handed from a worker thread to the event loop
+_END = object()
+
+
+def tenant_name(api_key: str) -> str:
+    """Returns the name an API key without a configured tenant is queued and reported as."""
+    return f"key-{hashlib.sha256(api_key.encode()).hexdigest()[:8]}"
+
+
+def split_messages(
+    messages: Any,
+) -> Tuple[str, List[Dict[str, str]], str]:
+    """
+    Splits OpenAI chat messages into a system prompt, the earlier turns and the new prompt.
+
+    Parameters
+    ----------
+        messages : Any
+            The "messages" of a chat completion request.
+
+    Raises
+    ------
+    HTTPError
+        If the messages are malformed or do not end with a user message.
+
+    Returns
+    -------
+    Tuple[str, List[Dict[str, str]], str]
+        The system prompt, the earlier user and assistant turns, and the last user message.
+    """
+    if not isinstance(messages, list) or not messages:
+        raise HTTPError(400, "'messages' must be a non-empty list.")
+    system: List[str] = []
+    turns: List[Dict[str, str]] = []
+    for message in messages:
+        if not isinstance(message, dict):
+            raise HTTPError(400, "Every message must be an object.")
+        role, content = message.get("role"), message.get("content")
+        if isinstance(content, list):
+            # Content parts; only the text parts reach HuggingChat
+            content = "".join(
+                part.get("text", "")
+                for part in content
+                if isinstance(part, dict) and part.get("type") == "text"
+            )
+        if not isinstance(content, str):
+            content = ""
+        if role == "system":
+            system.append(content)
+        elif role in ("user", "assistant"):
+            turns.append({"role": role, "content": content})
+    if not turns or turns[-1]["role"] != "user":
+        raise HTTPError(400, "The last message must be a user message.")
+    return "\n\n".join(system), turns[:-1], turns[-1]["content"]
+
+
+class Gateway:
+    r"""
+    OpenAI-compatible HTTP gateway.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A class that serves `/v1/chat/completions` (streaming and non-streaming) and `/v1/models`
+    over asyncio and answers them through the accounts of a `SessionPool`. Many client
+    connections share the pooled sessions: every completion runs on one of `max_upstream`
+    worker threads and its tokens are handed back to the event loop as they arrive.
+
+    Every stage is bounded. Requests beyond `max_upstream` wait in a queue of `max_queue`
+    for at most `queue_timeout` seconds, connections beyond `max_connections` are refused,
+    and both are answered 503 with a Retry-After. A stream buffers a few tokens for its
+    client; when the client reads slowly its worker stops reading from HuggingChat until
+    the client catches up.
+
+    Every accepted API key is a tenant; an open gateway (no `api_keys` or `tenants`) queues
+    all of its clients as one tenant, so a client cannot gain a share by inventing keys and
+    the set of tenants stays bounded. Queued requests are admitted by deficit round robin over the
+    tenants, weighted per tenant, and `/v1/stats` reports every tenant's queue depth and
+    wait times.
+
+    Every completion has a priority, set by its `X-Priority` header: 'interactive' (the
+    default) or 'batch'. Queued interactive requests get a free slot before queued batch
+    requests and displace them from a full queue, and at most `batch_slots` batch requests
+    run at once, so a batch job leaves slots for the interactive users. `interactive_slots`
+    caps the interactive lane the same way.
+
+    Requests are stateless as in the OpenAI API: the system messages become the system
+    prompt, the earlier turns seed a new HuggingChat conversation and the last user message
+    is sent to it.
+
+    ----
+
+    Attributes
+    ----------
+    pool : SessionPool
+        The pool of authenticated sessions the completions are sent with.
+    model : str
+        The model used when a request names none.
+    cache : ResponseCache | None
+        Cache answering repeated requests without a round trip to the model.
+    coalescer : RequestCoalescer | None
+        Lets identical concurrent requests share one upstream stream.
+    rate_limiter : RateLimiter | None
+        Paces the requests of every account and model.
+    hedger : Hedger | None
+        Hedges conversation creation and model list requests.
+    api_keys : Set[str] | None
+        Bearer tokens accepted from clients, or None to accept any client.
+    tenants : Dict[str, Tuple[str, float]]
+        The (API key, weight) of every named tenant.
+    admission : Admission
+        Hands out the upstream slots and queues the requests waiting for one.
+    max_connections : int
+        Maximum number of open client connections.
+
+    Methods
+    -------
+    start(host: str = HOST, port: int = PORT, sock: socket | None = None) -> AbstractServer:
+        Starts listening for connections.
+    serve(host: str = HOST, port: int = PORT, sock: socket | None = None):
+        Serves connections until cancelled.
+    stats() -> Dict[str, Any]:
+        Returns the load of this gateway process, as served on `/v1/stats`.
+    close():
+        Shuts the worker threads down.
+
+    Example
+    -------
+    >>> from gateway.server import Gateway
+    >>>
+    >>> gateway = Gateway(SessionPool.from_directory())
+    >>> asyncio.run(gateway.serve(port=8000))
+    """
+
+    def __init__(
+        self,
+        pool: SessionPool,
+        model: str = CHAT_CONSTANTS["DEFAULT_MODEL"],
+        cache: Optional[ResponseCache] = None,
+        coalescer: Optional[RequestCoalescer] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        hedger: Optional[Hedger] = None,
+        api_keys: Optional[Iterable[str]] = None,
+        tenants: Optional[Dict[str, Tuple[str, float]]] = None,
+        max_upstream: int = CONSTANTS["MAX_UPSTREAM"],
+        max_queue: int = CONSTANTS["MAX_QUEUE"],
+        queue_timeout: float = CONSTANTS["QUEUE_TIMEOUT"],
+        max_connections: int = CONSTANTS["MAX_CONNECTIONS"],
+        interactive_slots: Optional[int] = CONSTANTS["INTERACTIVE_SLOTS"],
+        batch_slots: int = CONSTANTS["BATCH_SLOTS"],
+    ):
+        """
+        Constructs all the necessary attributes for the Gateway object.
+
+        Parameters
+        ----------
+            pool : SessionPool
+                The pool of authenticated sessions the completions are sent with.
+            model : str
+                The model used when a request names none.
+                Defaults to `CONSTANTS["DEFAULT_MODEL"]`.
+            cache : ResponseCache, optional
+                Cache answering repeated requests. Defaults to None (no caching).
+            coalescer : RequestCoalescer, optional
+                Shares one upstream stream between identical concurrent requests.
+                Defaults to None (no coalescing).
+            rate_limiter : RateLimiter, optional
+                Paces the requests of every account and model. Defaults to None (no pacing).
+            hedger : Hedger, optional
+                Hedges the idempotent requests. Defaults to None (no hedging).
+            api_keys : Iterable[str], optional
+                Bearer tokens accepted from clients. Defaults to None (any client, unless
+                `tenants` are given).
+            tenants : Dict[str, Tuple[str, float]], optional
+                The (API key, weight) per tenant name, e.g. from `Config.get_tenants()`.
+                Their keys are accepted too. Defaults to None (every key has weight 1).
+            max_upstream : int
+                Maximum number of requests in flight to HuggingChat. Defaults to 32.
+            max_queue : int
+                Maximum number of requests waiting for an upstream slot. Defaults to 64.
+            queue_timeout : float
+                Number of seconds a request waits for an upstream slot. Defaults to 30.0.
+            max_connections : int
+                Maximum number of open client connections. Defaults to 1024.
+            interactive_slots : int, optional
+                Maximum number of interactive requests in flight to HuggingChat.
+                Defaults to None (`max_upstream`).
+            batch_slots : int
+                Maximum number of batch requests in flight to HuggingChat. Defaults to 8.
+        """
+        self.pool = pool
+        self.model = model
+        self.cache = cache
+        self.coalescer = coalescer
+        self.rate_limiter = rate_limiter
+        self.hedger = hedger
+        self.tenants = dict(tenants or {})
+        self.api_keys: Optional[Set[str]] = None
+        if api_keys is not None or self.tenants:
+            self.api_keys = set(api_keys or ())
+            self.api_keys.update(key for key, _ in self.tenants.values())
+        self.admission = Admission(
+            max_upstream,
+            max_queue,
+            queue_timeout,
+            lane_slots={
+                "interactive": min(interactive_slots or max_upstream, max_upstream),
+                "batch": min(batch_slots, max_upstream),
+            },
+        )
+        self._tenant_of: Dict[str, str] = {}
+        for name, (key, weight) in self.tenants.items():
+            self._tenant_of[key] = name
+            self.admission.set_weight(name, weight)
+        self.max_connections = max_connections
+        self._connections = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_upstream, thread_name_prefix="gateway-upstream"
+        )
+        self._models: List[str] = []
+        self._models_fetched = 0.0
+
+    async def start(
+        self,
+        host: str = CONSTANTS["HOST"],
+        port: int = CONSTANTS["PORT"],
+        sock: Optional[socket.socket] = None,
+    ) -> asyncio.AbstractServer:
+        """
+        Starts listening for connections.
+
+        Parameters
+        ----------
+            host : str
+                The interface to listen on. Defaults to '127.0.0.1'.
+            port : int
+                The port to listen on, or 0 for any free port. Defaults to 8000.
+            sock : socket.socket, optional
+                An already listening socket to accept on instead, e.g. from
+                `gateway.prefork.listen`. Defaults to None.
+
+        Returns
+        -------
+        asyncio.AbstractServer
+            The listening server.
+        """
+        if sock is not None:
+            server = await asyncio.start_server(self._handle, sock=sock)
+        else:
+            server = await asyncio.start_server(self._handle, host, port)
+        host, port = server.sockets[0].getsockname()[:2]
+        logger.info(f"Gateway listening on http://{host}:{port}/v1 (pid {os.getpid()})")
+        return server
+
+    async def serve(
+        self,
+        host: str = CONSTANTS["HOST"],
+        port: int = CONSTANTS["PORT"],
+        sock: Optional[socket.socket] = None,
+    ):
+        """
+        Serves connections until cancelled.
+
+        Parameters
+        ----------
+            host : str
+                The interface to listen on. Defaults to '127.0.0.1'.
+            port : int
+                The port to listen on. Defaults to 8000.
+            sock : socket.socket, optional
+                An already listening socket to accept on instead. Defaults to None.
+        """
+        server = await self.start(host, port, sock)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        """Shuts the worker threads down."""
+        self._executor.shutdown(wait=False)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serves the requests of one keep-alive connection."""
+        if self._connections >= self.max_connections:
+            logger.warning("Refusing a connection, too many are open.")
+            try:
+                await send_json(
+                    writer,
+                    503,
+                    error_body(503, "Too many open connections."),
+                    False,
+                    {"Retry-After": str(self.admission.retry_after())},
+                )
+            except ConnectionError:
+                pass
+            writer.close()
+            return
+
+        self._connections += 1
+        # Bounds what a slow client can make the gateway buffer
+        writer.transport.set_write_buffer_limits(high=CONSTANTS["WRITE_BUFFER"])
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(
+                        read_request(reader, CONSTANTS["MAX_BODY"]),
+                        CONSTANTS["KEEPALIVE_TIMEOUT"],
+                    )
+                except HTTPError as e:
+                    await send_json(
+                        writer, e.status, error_body(e.status, e.message), False
+                    )
+                    break
+                if request is None:
+                    break
+                try:
+                    await self._dispatch(request, writer)
+                except HTTPError as e:
+                    await send_json(
+                        writer,
+                        e.status,
+                        error_body(e.status, e.message),
+                        request.keep_alive,
+                        e.headers,
+                    )
+                if not request.keep_alive:
+                    break
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            self._connections -= 1
+            writer.close()
+
+    async def _dispatch(self, request: Request, writer: asyncio.StreamWriter):
+        tenant = self._authorize(request)
+        route = (request.method, request.path.rstrip("/"))
+        if route == ("POST", "/v1/chat/completions"):
+            await self._completions(request, writer, tenant)
+        elif route == ("GET", "/v1/models"):
+            models = await self._list_models(tenant)
+            await send_json(writer, 200, models, request.keep_alive)
+        elif route == ("GET", "/v1/stats"):
+            await send_json(writer, 200, self.stats(), request.keep_alive)
+        elif route[1] in ("/v1/chat/completions", "/v1/models", "/v1/stats"):
+            raise HTTPError(405, f"Method {request.method} not allowed.")
+        else:
+            raise HTTPError(404, f"Unknown path '{request.path}'.")
+
+    def _authorize(self, request: Request) -> str:
+        """Checks the API key of a request and returns the tenant it is queued for."""
+        scheme, key = parse_bearer(request)
+        if scheme != "bearer":
+            key = ""
+        if self.api_keys is not None and key not in self.api_keys:
+            raise HTTPError(
+                401, "Invalid API key.", {"WWW-Authenticate": 'Bearer realm="gateway"'}
+            )
+        if not key or self.api_keys is None:
+            # Keys of an open gateway are unverified, so they cannot name a tenant
+            return "anonymous"
+        return self._tenant_of.get(key) or tenant_name(key)
+
+    @staticmethod
+    def _priority(request: Request) -> str:
+        """Returns the lane a completion is queued in, from its `X-Priority` header."""
+        lane = request.headers.get("x-priority", "").strip().lower() or LANES[0]
+        if lane not in LANES:
+            raise HTTPError(
+                400, f"'X-Priority' must be one of {', '.join(LANES)}, not '{lane}'."
+            )
+        return lane
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the load of this gateway process, as served on `/v1/stats`.
+
+        Returns
+        -------
+        dict
+            The process id, the upstream slots in use and in total, the queued requests,
+            `Admission.lane_stats()` per lane and `Admission.stats()` per tenant.
+        """
+        return {
+            "pid": os.getpid(),
+            "slots": self.admission.slots,
+            "active": self.admission.active(),
+            "queued": self.admission.queued(),
+            "lanes": self.admission.lane_stats(),
+            "tenants": self.admission.stats(),
+        }
+
+    async def _completions(
+        self, request: Request, writer: asyncio.StreamWriter, tenant: str
+    ):
+        body = request.json()
+        if not isinstance(body, dict):
+            raise HTTPError(400, "Request body must be a JSON object.")
+        system_prompt, history, prompt = split_messages(body.get("messages"))
+        model = body.get("model") or self.model
+        if not isinstance(model, str):
+            raise HTTPError(400, "'model' must be a string.")
+        lane = self._priority(request)
+        tokens = self._tokens(tenant, lane, model, system_prompt, history, prompt)
+        try:
+            await self._complete(
+                request, writer, model, tokens, bool(body.get("stream"))
+            )
+        finally:
+            # Stops the upstream stream if the client went away before its end
+            await tokens.aclose()
+
+    async def _complete(
+        self,
+        request: Request,
+        writer: asyncio.StreamWriter,
+        model: str,
+        tokens: AsyncGenerator[str, None],
+        stream: bool,
+    ):
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        if not stream:
+            try:
+                content = "".join([token async for token in tokens])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                raise self._upstream_error(e)
+            await send_json(
+                writer,
+                200,
+                {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                },
+                request.keep_alive,
+            )
+            return
+
+        def chunk(delta: Dict[str, str], finish_reason: Optional[str] = None) -> str:
+            return json.dumps(
+                {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                    ],
+                },
+                ensure_ascii=False,
+            )
+
+        # Wait for the first token, so upstream failures still get a proper status
+        try:
+            first = await tokens.__anext__()
+        except StopAsyncIteration:
+            first = ""
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            raise self._upstream_error(e)
+        events = EventStream(writer)
+        await events.open(request.keep_alive)
+        await events.send(chunk({"role": "assistant", "content": first}))
+        try:
+            async for token in tokens:
+                await events.send(chunk({"content": token}))
+        except (ConnectionError, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            error = self._upstream_error(e)
+            await events.send(json.dumps(error_body(error.status, error.message)))
+        else:
+            await events.send(chunk({}, "stop"))
+        await events.send("[DONE]")
+        await events.close()
+
+    async def _tokens(
+        self,
+        tenant: str,
+        lane: str,
+        model: str,
+        system_prompt: str,
+        history: List[Dict[str, str]],
+        prompt: str,
+    ) -> AsyncGenerator[str, None]:
+        """Yields the tokens of a completion, streamed on a worker thread."""
+
+        def request(account: str, session: httpx.Client) -> Iterator[str]:
+            chat = ChatSession(
+                session,
+                model=model,
+                system_prompt=system_prompt,
+                cache=self.cache,
+                coalescer=self.coalescer,
+                account=account,
+                rate_limiter=self.rate_limiter,
+                hedger=self.hedger,
+            )
+            chat.restore(history)
+            try:
+                yield from chat.send(prompt)
+            finally:
+                # Requests are stateless, so the conversation is not kept in the history
+                chat.close()
+
+        async for token in self._iterate(
+            lambda: self.pool.stream(request), tenant, lane
+        ):
+            yield token
+
+    async def _submit(
+        self, fn: Callable[[], T], tenant: str, lane: str = LANES[0]
+    ) -> "asyncio.Future[T]":
+        """Waits for an upstream slot and starts `fn` on a worker thread that frees it."""
+        await self.admission.acquire(tenant, lane=lane)
+        loop = asyncio.get_running_loop()
+
+        def release(duration: float):
+            try:
+                loop.call_soon_threadsafe(
+                    self.admission.release, duration, tenant, lane
+                )
+            except RuntimeError:
+                pass  # The event loop is gone
+
+        def run() -> T:
+            started = time.monotonic()
+            try:
+                return fn()
+            finally:
+                release(time.monotonic() - started)
+
+        future = self._executor.submit(run)
+
+        def unstarted(done: "Future[T]"):
+            if done.cancelled():
+                release(0.0)
+
+        future.add_done_callback(unstarted)
+        return asyncio.wrap_future(future)
+
+    async def _iterate(
+        self, produce: Callable[[], Iterator[str]], tenant: str, lane: str = LANES[0]
+    ) -> AsyncGenerator[str, None]:
+        """
+        Runs a blocking token stream on a worker thread and yields its tokens.
+
+        At most `STREAM_BUFFER` tokens wait for the consumer. When it falls behind, the
+        worker blocks instead of reading on, and TCP flow control pauses the upstream.
+        """
+        loop = asyncio.get_running_loop()
+        queue: "asyncio.Queue[Any]" = asyncio.Queue(CONSTANTS["STREAM_BUFFER"])
+        abandoned = threading.Event()
+
+        def hand_over(item: Any):
+            coroutine = queue.put(item)
+            try:
+                put = asyncio.run_coroutine_threadsafe(coroutine, loop)
+            except RuntimeError:
+                coroutine.close()
+                abandoned.set()  # The event loop is gone
+                return
+            while not abandoned.is_set():
+                try:
+                    put.result(timeout=1.0)
+                    return
+                except FutureTimeoutError:
+                    continue
+            put.cancel()
+
+        def run():
+            stream = produce()
+            try:
+                for token in stream:
+                    if abandoned.is_set():
+                        break
+                    hand_over(token)
+            except BaseException as e:
+                hand_over(e)
+            else:
+                hand_over(_END)
+            finally:
+                # Releases the upstream response and the leased account
+                getattr(stream, "close", lambda: None)()
+
+        await self._submit(run, tenant, lane)
+        try:
+            while True:
+                item = await queue.get()
+                if item is _END:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # The client went away; unblock the worker so it stops at the next token
+            abandoned.set()
+            while not queue.empty():
+                queue.get_nowait()
+
+    async def _list_models(self, tenant: str) -> Dict[str, Any]:
+        if not self._models or time.monotonic() - self._models_fetched > float(
+            CONSTANTS["MODELS_TTL"]
+        ):
+
+            def request(account: str, session: httpx.Client) -> List[str]:
+                chat = ChatSession(
+                    session,
+                    account=account,
+                    rate_limiter=self.rate_limiter,
+                    hedger=self.hedger,
+                )
+                return chat.list_models()
+
+            try:
+                fetch = await self._submit(lambda: self.pool.call(request), tenant)
+                self._models = await fetch
+            except Exception as e:
+                raise self._upstream_error(e)
+            self._models_fetched = time.monotonic()
+        return {
+            "object": "list",
+            "data": [
+                {
+                    "id": model,
+                    "object": "model",
+                    "created": 0,
+                    "owned_by": "huggingchat",
+                }
+                for model in self._models
+            ],
+        }
+
+    @staticmethod
+    def _upstream_error(error: Exception) -> HTTPError:
+        """Translates a failure of the upstream request into the status answered."""
+        if isinstance(error, HTTPError):
+            return error
+        if isinstance(error, QueueFullError):
+            return HTTPError(503, str(error), {"Retry-After": str(error.retry_after)})
+        if isinstance(error, AccountUnavailableError):
+            retry_after = int(error.retry_after or AUTH_CONSTANTS["ACCOUNT_COOLDOWN"])
+            return HTTPError(
+                503,
+                "Every account is rate-limited, retry later.",
+                {"Retry-After": str(retry_after)},
+            )
+        if isinstance(error, NoSessionAvailableError):
+            return HTTPError(503, str(error))
+        logger.error(f"Upstream request failed: {str(error)}")
+        return HTTPError(502, f"Upstream request failed: {str(error)}")
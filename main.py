@@ -13,47 +13,133 @@
 # limitations under the License.
 
 
+import argparse
 import logging
 import os
+import sys
+from typing import List, Optional
 
 from auth.auth_manager import AuthenticationManager
+from auth.session_pool import SessionPool
+from conversation.batch import BatchRunner
+from conversation.cache import ResponseCache
+from conversation.constants import CONSTANTS
+from conversation.ratelimit import RateLimiter
 from utils.config import Config
 
-logging.basicConfig(level=logging.DEBUG)
 
-try:
-    config_obj = Config()
+def set_up(config_obj: Config) -> Optional[AuthenticationManager]:
+    """Signs in with the stored credentials unless the stored token is still valid."""
+    auth_manager = None
+    try:
+        # The file given with --config, not the default 'config.ini'
+        if config_obj.config_exists(config_obj.filename):
+            logging.info(f"Config exists: {config_obj.filename}")
 
-    if config_obj.config_exists():
-        logging.info(f"Config exists: {str(config_obj.config_exists())}")
+            token = config_obj.get_token()
 
-        token = config_obj.get_token()
+            if config_obj.is_token_valid():
+                logging.info(f"Valid token found in config file: {token}")
+                auth_manager = AuthenticationManager(config_obj)
+            else:  # If no valid token can be found, its starts a login process with email, password from file
+                logging.info(
+                    "No valid token found in config file, starting authentication."
+                )
+                login_details = config_obj.get_login_details()
+                email = str(login_details.get("email"))
+                password = str(login_details.get("password"))
+                # delete config.ini
+                os.remove(config_obj.filename)
+                auth_manager = AuthenticationManager(Config(config_obj.filename))
 
-        if token is not None and token != {"token": "", "expire_date": ""}:
-            logging.info(f"Token found in config file: {token}")
-            auth_manager = AuthenticationManager()
-        else:  # If no token can be found, its starts a login process with email, password from file
-            logging.info("No token found in config file, starting authentication.")
-            login_details = config_obj.get_login_details()
-            email = str(login_details.get("email"))
-            password = str(login_details.get("password"))
-            # delete config.ini
-            os.remove("config.ini")
-            auth_manager = AuthenticationManager()
+                if auth_manager.set_up_authentication(email, password):
+                    logging.info("Login and token set up was successful.")
+
+        else:
+            logging.info("Config doesn't exist, setting up initial configurations.")
+            email = "example@mail.com"
+            password = "password123"
+            auth_manager = AuthenticationManager(config_obj)
             auth_manager.set_up_authentication(email, password)
 
-            if auth_manager.set_up_authentication(email, password):
-                logging.info("Login and token set up was successful.")
+    except KeyError:
+        logging.error("Login details missing in config file.")
+
+    return auth_manager
+
+
+def build_pool(config_obj: Config, accounts: str) -> SessionPool:
+    """Pools every account in `accounts`, or the account of `config_obj` if there is none."""
+    pool = SessionPool.from_directory(accounts)
+    if not pool.accounts and not pool.add_config(config_obj):
+        login_details = config_obj.get_login_details()
+        if login_details["email"]:
+            pool.add_account(
+                str(login_details["email"]), str(login_details["password"])
+            )
+    return pool
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="HuggingChat API wrapper")
+    parser.add_argument("--config", default="config.ini", help="configuration file")
+    parser.add_argument(
+        "--batch", metavar="INPUT", help="run every prompt of a JSONL file"
+    )
+    parser.add_argument(
+        "--output", help="JSONL file for batch results (default: <INPUT>.results.jsonl)"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="prompts sent at the same time"
+    )
+    parser.add_argument(
+        "--rate-share",
+        type=float,
+        default=CONSTANTS["BATCH_RATE_SHARE"],
+        help="share of the account rate limits a batch run keeps while interactive "
+        "chats use the same accounts (0-1)",
+    )
+    parser.add_argument(
+        "--accounts", default="accounts", help="directory of pooled account configs"
+    )
+    parser.add_argument("--model", default=CONSTANTS["DEFAULT_MODEL"])
+    parser.add_argument(
+        "--no-cache", action="store_true", help="do not reuse cached responses"
+    )
+    parser.add_argument("--log-level", default="DEBUG")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper())
+    config_obj = Config(args.config)
+
+    if args.batch is None:
+        auth_manager = set_up(config_obj)
+        # session = auth_manager.authenticate()
+        # logging.info(session)
+        return 0 if auth_manager is not None else 1
 
-    else:
-        logging.info("Config doesn't exist, setting up initial configurations.")
-        email = "example@mail.com"
-        password = "password123"
-        auth_manager = AuthenticationManager()
-        auth_manager.set_up_authentication(email, password)
+    if not 0 < args.rate_share < 1:
+        logging.error("--rate-share must be in (0, 1).")
+        return 1
+    pool = build_pool(config_obj, args.accounts)
+    if not pool.accounts:
+        logging.error("No account available for the batch run.")
+        return 1
+    runner = BatchRunner(
+        pool,
+        model=args.model,
+        concurrency=args.concurrency,
+        cache=None if args.no_cache else ResponseCache.beside(config_obj),
+        # Yields rate to interactive chats on the shared accounts while they are active
+        rate_limiter=RateLimiter(config_obj, lane="batch", batch_share=args.rate_share),
+    )
+    output = args.output or f"{os.path.splitext(args.batch)[0]}.results.jsonl"
+    counts = runner.run(args.batch, output)
+    return 1 if counts["failed"] else 0
 
-except KeyError:
-    logging.error("Login details missing in config file.")
 
-# session = auth_manager.authenticate()
-# logging.info(session)
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import sys
+from typing import List, Optional
+
+from auth.client import client_registry
+from conversation.cache import ResponseCache
+from conversation.coalescer import RequestCoalescer
+from conversation.constants import CONSTANTS as CHAT_CONSTANTS
+from conversation.hedge import Hedger
+from conversation.ratelimit import RateLimiter
+from gateway.constants import CONSTANTS
+from gateway.prefork import Prefork
+from gateway.server import Gateway
+from main import build_pool
+from utils.config import Config
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="OpenAI-compatible gateway in front of HuggingChat"
+    )
+    parser.add_argument("--config", default="config.ini", help="configuration file")
+    parser.add_argument(
+        "--accounts", default="accounts", help="directory of pooled account configs"
+    )
+    parser.add_argument("--host", default=CONSTANTS["HOST"])
+    parser.add_argument("--port", type=int, default=CONSTANTS["PORT"])
+    parser.add_argument(
+        "--model",
+        default=CHAT_CONSTANTS["DEFAULT_MODEL"],
+        help="model used when a request names none",
+    )
+    parser.add_argument(
+        "--api-key",
+        action="append",
+        dest="api_keys",
+        help="bearer token clients must send (repeatable; default: accept any client)",
+    )
+    parser.add_argument(
+        "--max-upstream",
+        type=int,
+        default=CONSTANTS["MAX_UPSTREAM"],
+        help="requests in flight to HuggingChat, per worker",
+    )
+    parser.add_argument(
+        "--max-queue",
+        type=int,
+        default=CONSTANTS["MAX_QUEUE"],
+        help="requests waiting for an upstream slot before load is shed",
+    )
+    parser.add_argument(
+        "--queue-timeout",
+        type=float,
+        default=CONSTANTS["QUEUE_TIMEOUT"],
+        help="seconds a request waits for an upstream slot",
+    )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        default=CONSTANTS["MAX_CONNECTIONS"],
+        help="open client connections",
+    )
+    parser.add_argument(
+        "--interactive-slots",
+        type=int,
+        default=CONSTANTS["INTERACTIVE_SLOTS"],
+        help="interactive requests in flight to HuggingChat, per worker "
+        "(default: --max-upstream)",
+    )
+    parser.add_argument(
+        "--batch-slots",
+        type=int,
+        default=CONSTANTS["BATCH_SLOTS"],
+        help="requests with 'X-Priority: batch' in flight to HuggingChat, per worker",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="processes serving the port (POSIX only; default: 1)",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="do not reuse cached responses"
+    )
+    parser.add_argument("--log-level", default="INFO")
+    return parser.parse_args(argv)
+
+
+def serve(
+    args: argparse.Namespace, workers: int = 1, sock: Optional[socket.socket] = None
+) -> int:
+    """Runs one gateway process until it is interrupted."""
+    config_obj = Config(args.config)
+    pool = build_pool(config_obj, args.accounts)
+    if not pool.accounts:
+        logging.error("No account available for the gateway.")
+        return 1
+    gateway = Gateway(
+        pool,
+        model=args.model,
+        cache=None if args.no_cache else ResponseCache.beside(config_obj),
+        coalescer=RequestCoalescer(),
+        # Workers send with the same accounts, so they split the rate limits, and all of
+        # them give up the share of a batch run on those accounts while it is active
+        rate_limiter=RateLimiter(config_obj, share=1 / workers, lane="interactive"),
+        hedger=Hedger(),
+        api_keys=args.api_keys,
+        tenants=config_obj.get_tenants(),
+        max_upstream=args.max_upstream,
+        max_queue=args.max_queue,
+        queue_timeout=args.queue_timeout,
+        max_connections=args.max_connections,
+        interactive_slots=args.interactive_slots,
+        batch_slots=args.batch_slots,
+    )
+    try:
+        asyncio.run(gateway.serve(args.host, args.port, sock))
+    except KeyboardInterrupt:
+        logging.info("Gateway stopped.")
+    finally:
+        gateway.close()
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper())
+
+    if args.workers <= 1 or not hasattr(os, "fork"):
+        if args.workers > 1:
+            logging.warning("Forking is not supported here, serving with one process.")
+        return serve(args)
+
+    # Sign in once up front; the workers find the stored tokens and cookies
+    if not build_pool(Config(args.config), args.accounts).sign_in():
+        logging.error("No account available for the gateway.")
+        return 1
+    # Workers must not inherit the connections of the login clients
+    client_registry.close_all()
+    return Prefork(
+        lambda sock: serve(args, args.workers, sock),
+        args.host,
+        args.port,
+        args.workers,
+    ).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
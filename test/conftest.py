@@ -0,0 +1,100 @@
+# pytest test/
+
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import json
+import time
+from typing import Dict, Iterator, List
+
+import httpx
+import pytest
+
+
+class FakeHuggingChat:
+    """In-memory stand-in for the HuggingChat conversation API."""
+
+    def __init__(self, tokens: List[str]):
+        self.tokens = tokens
+        self.requests: List[httpx.Request] = []
+        self.conversations: Dict[str, List[str]] = {}
+        self.produced: List[str] = []
+        self.send_message_ids = True
+        self.create_delays: List[float] = []
+        self._ids = itertools.count()
+        self.models = [{"id": "test-model", "name": "test-model"}]
+
+    def stream(self, conversation_id: str) -> Iterator[bytes]:
+        ids = self.conversations[conversation_id]
+        answer_id = f"msg-{conversation_id}-{len(ids)}"
+        started = {"type": "status", "status": "started"}
+        if self.send_message_ids:
+            started["messageId"] = answer_id
+        yield json.dumps(started).encode() + b"\n"
+        for token in self.tokens:
+            self.produced.append(token)
+            frame = {"type": "stream", "token": token + "\0\0"}
+            yield json.dumps(frame).encode() + b"\n"
+        answer = {"type": "finalAnswer", "text": "".join(self.tokens)}
+        yield json.dumps(answer).encode() + b"\n"
+        ids.append(answer_id)
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        path = request.url.path
+        if path == "/chat/api/models":
+            return httpx.Response(200, json=self.models)
+        if request.method == "POST" and path == "/chat/conversation":
+            if self.create_delays:
+                time.sleep(self.create_delays.pop(0))
+            conversation_id = f"conv{next(self._ids)}"
+            self.conversations[conversation_id] = [f"msg-{conversation_id}-root"]
+            return httpx.Response(200, json={"conversationId": conversation_id})
+        conversation_id = path.split("/")[3]
+        if request.method == "DELETE":
+            del self.conversations[conversation_id]
+            return httpx.Response(200)
+        if path.endswith("/__data.json"):
+            ids = self.conversations[conversation_id]
+            data = [{"messages": 1}, list(range(2, 2 + 2 * len(ids), 2))]
+            for message_id in ids:
+                data += [{"id": len(data) + 1}, message_id]
+            return httpx.Response(200, json={"nodes": [{}, {"data": data}]})
+        return httpx.Response(200, content=self.stream(conversation_id))
+
+
+def wait_until(predicate, timeout=5.0):
+    """Polls `predicate` until it holds, failing the test after `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "Timed out waiting for the condition"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def chat_tokens():
+    """The tokens `fake_chat` answers with; override it in a module for another answer."""
+    return ["Hello", ", ", "world", "!"]
+
+
+@pytest.fixture
+def fake_chat(chat_tokens):
+    return FakeHuggingChat(chat_tokens)
+
+
+@pytest.fixture
+def session(fake_chat):
+    with httpx.Client(transport=httpx.MockTransport(fake_chat)) as client:
+        yield client
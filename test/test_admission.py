@@ -0,0 +1,286 @@
+# pytest test/test_admission.py
+
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+
+import pytest
+
+from gateway.admission import Admission, QueueFullError
+
+
+def test_free_slots_are_granted_at_once():
+    # Arrange
+    admission = Admission(slots=2, max_queue=0)
+
+    async def run():
+        await admission.acquire()
+        await admission.acquire()
+        return admission.active()
+
+    # Act
+    active = asyncio.run(run())
+
+    # Assert
+    assert active == 2
+
+
+def test_waiters_get_slots_in_arrival_order():
+    # Arrange
+    admission = Admission(slots=1, max_queue=2)
+    order = []
+
+    async def wait(name):
+        await admission.acquire()
+        order.append(name)
+
+    async def run():
+        await admission.acquire()
+        waiters = [asyncio.ensure_future(wait(name)) for name in ("a", "b")]
+        await asyncio.sleep(0)
+        queued = admission.queued()
+        admission.release(0.1)
+        await asyncio.sleep(0)
+        admission.release(0.1)
+        await asyncio.gather(*waiters)
+        return queued
+
+    # Act
+    queued = asyncio.run(run())
+
+    # Assert
+    assert queued == 2
+    assert order == ["a", "b"]
+    assert admission.active() == 1
+
+
+def test_full_queue_sheds_with_retry_after():
+    # Arrange
+    admission = Admission(slots=1, max_queue=1)
+
+    async def run():
+        await admission.acquire()
+        waiter = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0)
+        try:
+            await admission.acquire()
+        finally:
+            waiter.cancel()
+
+    # Act / Assert
+    with pytest.raises(QueueFullError) as raised:
+        asyncio.run(run())
+    assert raised.value.retry_after >= 1
+
+
+def test_waiting_too_long_sheds_and_leaves_the_queue():
+    # Arrange
+    admission = Admission(slots=1, max_queue=1, max_wait=0.01)
+
+    async def run():
+        await admission.acquire()
+        with pytest.raises(QueueFullError):
+            await admission.acquire()
+        return admission.queued()
+
+    # Act
+    queued = asyncio.run(run())
+
+    # Assert
+    assert queued == 0
+    assert admission.active() == 1
+
+
+def test_cancelled_waiter_passes_its_slot_on():
+    # Arrange
+    admission = Admission(slots=1, max_queue=2)
+
+    async def run():
+        await admission.acquire()
+        first = asyncio.ensure_future(admission.acquire())
+        second = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0)
+        # The slot is granted to the first waiter, which gives up before it runs
+        admission.release(0.1)
+        first.cancel()
+        await asyncio.wait_for(second, 1)
+        return admission.active(), admission.queued()
+
+    # Act
+    active, queued = asyncio.run(run())
+
+    # Assert
+    assert (active, queued) == (1, 0)
+
+
+def test_tenants_share_slots_by_weight():
+    # Arrange
+    admission = Admission(slots=1, max_queue=8)
+    admission.set_weight("b", 2)
+    order = []
+
+    async def wait(tenant, number):
+        await admission.acquire(tenant)
+        order.append(f"{tenant}{number}")
+
+    async def run():
+        await admission.acquire("a")
+        waiters = [asyncio.ensure_future(wait("a", n)) for n in range(1, 5)]
+        waiters += [asyncio.ensure_future(wait("b", n)) for n in range(1, 5)]
+        await asyncio.sleep(0)
+        for _ in waiters:
+            admission.release(0.1, "a" if not order else order[-1][0])
+            await asyncio.sleep(0)
+        await asyncio.gather(*waiters)
+
+    # Act
+    asyncio.run(run())
+
+    # Assert
+    assert order == ["a1", "b1", "b2", "a2", "b3", "b4", "a3", "a4"]
+
+
+def test_full_queue_displaces_the_longest_backlog():
+    # Arrange
+    admission = Admission(slots=1, max_queue=3)
+
+    async def run():
+        await admission.acquire("batch")
+        backlog = [asyncio.ensure_future(admission.acquire("batch")) for _ in range(3)]
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(admission.acquire("interactive"))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError):
+            await admission.acquire("batch")
+        depths = admission.queued("batch"), admission.queued("interactive")
+        await asyncio.sleep(0)
+        for waiter in backlog + [interactive]:
+            waiter.cancel()
+        results = await asyncio.gather(*backlog, return_exceptions=True)
+        return depths, results, admission.stats()
+
+    # Act
+    depths, results, stats = asyncio.run(run())
+
+    # Assert
+    assert depths == (2, 1)
+    assert isinstance(results[-1], QueueFullError), "Newest batch request was kept"
+    assert stats["batch"]["shed"] == 2
+    assert stats["interactive"]["shed"] == 0
+
+
+def test_stats_report_queue_depth_and_waits():
+    # Arrange
+    admission = Admission(slots=1, max_queue=4)
+
+    async def run():
+        await admission.acquire("a")
+        waiter = asyncio.ensure_future(admission.acquire("b"))
+        await asyncio.sleep(0.05)
+        queued = admission.stats()["b"]
+        admission.release(0.1, "a")
+        await waiter
+        return queued, admission.stats()["b"]
+
+    # Act
+    queued, served = asyncio.run(run())
+
+    # Assert
+    assert queued["queued"] == 1
+    assert queued["oldest_wait"] >= 0.04
+    assert served["queued"] == 0
+    assert served["active"] == 1
+    assert served["wait_max"] >= 0.04
+
+
+def test_interactive_requests_jump_ahead_of_queued_batch():
+    # Arrange
+    admission = Admission(slots=1, max_queue=4)
+    order = []
+
+    async def wait(name, lane):
+        await admission.acquire("t", lane=lane)
+        order.append(name)
+        admission.release(0.1, "t", lane=lane)
+
+    async def run():
+        await admission.acquire("t", lane="batch")
+        waiters = [asyncio.ensure_future(wait(name, "batch")) for name in ("b1", "b2")]
+        await asyncio.sleep(0)
+        waiters.append(asyncio.ensure_future(wait("i1", "interactive")))
+        await asyncio.sleep(0)
+        admission.release(0.1, "t", lane="batch")
+        await asyncio.gather(*waiters)
+
+    # Act
+    asyncio.run(run())
+
+    # Assert
+    assert order == ["i1", "b1", "b2"]
+
+
+def test_lane_cap_keeps_slots_for_interactive_requests():
+    # Arrange
+    admission = Admission(slots=3, max_queue=4, lane_slots={"batch": 1})
+
+    async def run():
+        await admission.acquire(lane="batch")
+        waiter = asyncio.ensure_future(admission.acquire(lane="batch"))
+        await asyncio.sleep(0)
+        await admission.acquire(lane="interactive")
+        await admission.acquire(lane="interactive")
+        lanes = admission.lane_stats()
+        waiter.cancel()
+        return lanes
+
+    # Act
+    lanes = asyncio.run(run())
+
+    # Assert
+    assert lanes["batch"] == {"cap": 1, "active": 1, "queued": 1}
+    assert lanes["interactive"] == {"cap": 3, "active": 2, "queued": 0}
+
+
+def test_full_queue_displaces_batch_for_interactive():
+    # Arrange
+    admission = Admission(slots=1, max_queue=1)
+
+    async def run():
+        await admission.acquire("t", lane="batch")
+        batch = asyncio.ensure_future(admission.acquire("t", lane="batch"))
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(admission.acquire("t"))
+        await asyncio.sleep(0)
+        queued = admission.queued(lane="interactive")
+        interactive.cancel()
+        results = await asyncio.gather(batch, interactive, return_exceptions=True)
+        return queued, results
+
+    # Act
+    queued, (batch, _) = asyncio.run(run())
+
+    # Assert
+    assert queued == 1
+    assert isinstance(batch, QueueFullError)
+
+
+def test_unknown_lane_is_rejected():
+    # Arrange
+    admission = Admission(slots=1, max_queue=1)
+
+    # Act / Assert
+    with pytest.raises(ValueError):
+        asyncio.run(admission.acquire(lane="urgent"))
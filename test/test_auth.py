@@ -0,0 +1,326 @@
+# pytest test/test_auth.py
+
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+import httpx
+import pytest
+
+from auth.auth_manager import AsyncAuthenticationManager, AuthenticationManager
+from auth.client import async_client_registry, client_registry
+from auth.constants import CONSTANTS
+from auth.refresher import TokenRefresher
+from utils.config import Config
+from utils.filelock import FileLock
+
+# Constants for test
+CONFIG_FILE = "test_auth_config.ini"
+VALID_EMAIL = "test@example.com"
+VALID_PASSWORD = "securepassword123"
+VALID_TOKEN = "sometoken"
+
+
+login_requests: List[httpx.Request] = []
+
+
+def login_handler(request: httpx.Request) -> httpx.Response:
+    if str(request.url) == CONSTANTS["LOGIN_URL"]:
+        login_requests.append(request)
+        return httpx.Response(
+            302,
+            headers={
+                "Location": "https://huggingface.co/",
+                "Set-Cookie": (
+                    f"token={VALID_TOKEN}; Domain=huggingface.co; Path=/; Max-Age=3600"
+                ),
+            },
+        )
+    return httpx.Response(200, json={"cookie": request.headers.get("cookie", "")})
+
+
+@pytest.fixture
+def auth_manager(monkeypatch):
+    # Route every pooled client through a mock transport and start from a clean config
+    if os.path.exists(CONFIG_FILE):
+        os.unlink(CONFIG_FILE)
+    client_registry.close_all()
+    login_requests.clear()
+    monkeypatch.setattr(
+        client_registry, "transport", httpx.MockTransport(login_handler)
+    )
+    manager = AuthenticationManager()
+    manager.config = Config(filename=CONFIG_FILE)
+    yield manager
+    client_registry.close_all()
+    for filename in (CONFIG_FILE, f"{CONFIG_FILE}.lock"):
+        if os.path.exists(filename):
+            os.unlink(filename)
+
+
+def test_authenticate_reuses_login_client(auth_manager):
+    # Act
+    assert auth_manager.set_up_authentication(VALID_EMAIL, VALID_PASSWORD)
+    session = auth_manager.authenticate()
+
+    # Assert
+    assert session is client_registry.get(VALID_EMAIL)
+    assert auth_manager.config.get_token()["token"] == VALID_TOKEN
+    response = session.get("https://huggingface.co/chat")
+    assert response.json()["cookie"] == f"token={VALID_TOKEN}"
+
+
+def test_authenticate_restores_stored_token(auth_manager):
+    # Arrange
+    auth_manager.config.set_login_details(email=VALID_EMAIL, password=VALID_PASSWORD)
+    auth_manager.config.set_token(token=VALID_TOKEN)
+
+    # Act
+    session = auth_manager.authenticate()
+
+    # Assert
+    assert session is not None
+    response = session.get("https://huggingface.co/chat")
+    assert response.json()["cookie"] == f"token={VALID_TOKEN}"
+
+
+def test_login_cookies_are_shared_through_the_config(auth_manager):
+    # Arrange
+    assert auth_manager.set_up_authentication(VALID_EMAIL, VALID_PASSWORD)
+    stored = auth_manager.config.get_cookies()
+    auth_manager.config.set_cookies({**stored, "hf-chat": "session"})
+    # Another process starts with an empty registry and its own configuration
+    client_registry.close_all()
+    other = AuthenticationManager(Config(filename=CONFIG_FILE))
+
+    # Act
+    session = other.authenticate()
+
+    # Assert
+    assert stored == {"token": VALID_TOKEN}
+    assert session is not None
+    cookie = session.get("https://huggingface.co/chat").json()["cookie"]
+    assert sorted(cookie.split("; ")) == ["hf-chat=session", f"token={VALID_TOKEN}"]
+    assert len(login_requests) == 1
+
+
+def test_login_stores_token_expiry(auth_manager):
+    # Act
+    assert auth_manager.set_up_authentication(VALID_EMAIL, VALID_PASSWORD)
+
+    # Assert
+    expiry = auth_manager.config.token_expiry()
+    assert expiry is not None
+    remaining = (expiry - datetime.now(timezone.utc)).total_seconds()
+    assert 3500 < remaining <= 3600
+    assert auth_manager.config.is_token_valid(CONSTANTS["TOKEN_REFRESH_MARGIN"])
+
+
+def test_ensure_authentication_skips_login_with_valid_token(auth_manager):
+    # Act
+    assert auth_manager.ensure_authentication(VALID_EMAIL, VALID_PASSWORD)
+    assert auth_manager.ensure_authentication(VALID_EMAIL, VALID_PASSWORD)
+
+    # Assert
+    assert len(login_requests) == 1
+
+
+def test_authenticate_refreshes_expired_token(auth_manager):
+    # Arrange
+    auth_manager.config.set_login_details(email=VALID_EMAIL, password=VALID_PASSWORD)
+    auth_manager.config.set_token(token="expired", expire_date="2024-06-09")
+
+    # Act
+    session = auth_manager.authenticate()
+
+    # Assert
+    assert session is not None
+    assert len(login_requests) == 1
+    assert auth_manager.config.get_token()["token"] == VALID_TOKEN
+
+
+@pytest.mark.parametrize(
+    "token, expires_in, expected, test_id",
+    [
+        ("", None, 0.0, "no_token"),
+        (VALID_TOKEN, None, 60.0, "unknown_expiry"),
+        (VALID_TOKEN, -10, 0.0, "expired"),
+        (VALID_TOKEN, 1300, 1000.0, "due_later"),
+    ],
+)
+def test_refresher_schedule(auth_manager, token, expires_in, expected, test_id):
+    # Arrange
+    expire_date = ""
+    if expires_in is not None:
+        expire_date = (
+            datetime.now(timezone.utc) + timedelta(seconds=expires_in)
+        ).isoformat()
+    auth_manager.config.set_token(token=token, expire_date=expire_date)
+    refresher = TokenRefresher(auth_manager, margin=300, retry_interval=60.0)
+
+    # Act
+    delay = refresher.seconds_until_refresh()
+
+    # Assert
+    assert delay == pytest.approx(expected, abs=2), f"Failed on {test_id}"
+
+
+def test_concurrent_logins_are_single_flight(auth_manager, monkeypatch):
+    # Arrange
+    def slow_login_handler(request: httpx.Request) -> httpx.Response:
+        time.sleep(0.05)
+        return login_handler(request)
+
+    monkeypatch.setattr(
+        client_registry, "transport", httpx.MockTransport(slow_login_handler)
+    )
+    managers = [AuthenticationManager(Config(filename=CONFIG_FILE)) for _ in range(5)]
+
+    # Act
+    with ThreadPoolExecutor(max_workers=len(managers)) as executor:
+        results = list(
+            executor.map(
+                lambda m: m.set_up_authentication(VALID_EMAIL, VALID_PASSWORD),
+                managers,
+            )
+        )
+
+    # Assert
+    assert all(results)
+    assert len(login_requests) == 1
+    assert all(m.config.get_token()["token"] == VALID_TOKEN for m in managers)
+
+
+def test_async_authenticate_reuses_login_client(monkeypatch):
+    # Arrange
+    if os.path.exists(CONFIG_FILE):
+        os.unlink(CONFIG_FILE)
+    monkeypatch.setattr(
+        async_client_registry, "transport", httpx.MockTransport(login_handler)
+    )
+    manager = AsyncAuthenticationManager()
+    manager.config = Config(filename=CONFIG_FILE)
+
+    async def run():
+        try:
+            assert await manager.set_up_authentication(VALID_EMAIL, VALID_PASSWORD)
+            session = await manager.authenticate()
+            assert session is async_client_registry.get(VALID_EMAIL)
+            response = await session.get("https://huggingface.co/chat")
+            return response.json()["cookie"]
+        finally:
+            await async_client_registry.aclose_all()
+
+    # Act
+    cookie = asyncio.run(run())
+
+    # Assert
+    assert cookie == f"token={VALID_TOKEN}"
+    assert Config(filename=CONFIG_FILE).get_token()["token"] == VALID_TOKEN
+    os.unlink(CONFIG_FILE)
+    os.unlink(f"{CONFIG_FILE}.lock")
+
+
+def test_async_tear_down_removes_the_token(tmp_path):
+    # Arrange
+    manager = AsyncAuthenticationManager(Config(filename=str(tmp_path / "config.ini")))
+    manager.config.set_token(token=VALID_TOKEN, expire_date="")
+
+    # Act
+    asyncio.run(manager.tear_down_authentication())
+
+    # Assert
+    assert manager.config.get_token()["token"] == ""
+    assert not isinstance(manager, AuthenticationManager), "Blocking methods leaked in"
+
+
+def test_close_all_closes_clients():
+    # Arrange
+    client = client_registry.get("close@example.com")
+
+    # Act
+    client_registry.close_all()
+
+    # Assert
+    assert client.is_closed
+    assert client_registry.get("close@example.com") is not client
+    client_registry.close_all()
+
+
+def test_concurrent_async_logins_do_not_exhaust_the_executor(monkeypatch):
+    # Arrange
+    if os.path.exists(CONFIG_FILE):
+        os.unlink(CONFIG_FILE)
+    login_requests.clear()
+    monkeypatch.setattr(
+        async_client_registry, "transport", httpx.MockTransport(login_handler)
+    )
+    managers = [
+        AsyncAuthenticationManager(Config(filename=CONFIG_FILE)) for _ in range(8)
+    ]
+
+    async def run():
+        # Fewer executor threads than waiting callers
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(2))
+        try:
+            return await asyncio.wait_for(
+                asyncio.gather(
+                    *(
+                        m.set_up_authentication(VALID_EMAIL, VALID_PASSWORD)
+                        for m in managers
+                    )
+                ),
+                timeout=10,
+            )
+        finally:
+            await async_client_registry.aclose_all()
+
+    # Act
+    results = asyncio.run(run())
+
+    # Assert
+    assert all(results)
+    assert len(login_requests) == 1
+    os.unlink(CONFIG_FILE)
+    os.unlink(f"{CONFIG_FILE}.lock")
+
+
+def test_cancelled_async_login_releases_the_lock(auth_manager):
+    # Arrange
+    holder = FileLock(auth_manager.config.lock_path)
+    holder.acquire()
+    manager = AsyncAuthenticationManager(Config(filename=CONFIG_FILE))
+
+    async def run():
+        waiter = asyncio.ensure_future(
+            manager.set_up_authentication(VALID_EMAIL, VALID_PASSWORD)
+        )
+        await asyncio.sleep(0.1)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+
+    # Act
+    asyncio.run(run())
+    holder.release()
+
+    # Assert
+    other = FileLock(auth_manager.config.lock_path)
+    assert other.acquire(blocking=False), "Cancelled login kept the lock"
+    other.release()
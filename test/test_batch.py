@@ -0,0 +1,157 @@
+# pytest test/test_batch.py
+
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+import httpx
+import pytest
+
+from conversation.batch import BatchRunner
+
+
+class FakePool:
+    """Hands out one shared client and records the peak number of sessions in use."""
+
+    def __init__(self, client):
+        self.client = client
+        self.in_use = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def lease(self):
+        with self._lock:
+            self.in_use += 1
+            self.peak = max(self.peak, self.in_use)
+        try:
+            time.sleep(0.01)
+            yield "user@example.com", self.client
+        finally:
+            with self._lock:
+                self.in_use -= 1
+
+    def call(self, request):
+        with self.lease() as (email, client):
+            return request(email, client)
+
+
+@pytest.fixture
+def chat_tokens():
+    return ["Hi", "!"]
+
+
+@pytest.fixture
+def pool(fake_chat):
+    with httpx.Client(transport=httpx.MockTransport(fake_chat)) as client:
+        yield FakePool(client)
+
+
+def write_lines(path, lines):
+    path.write_text("".join(line + "\n" for line in lines))
+
+
+def read_results(path):
+    return sorted(
+        (json.loads(line) for line in path.read_text().splitlines()),
+        key=lambda r: r["line"],
+    )
+
+
+def test_run_writes_one_result_per_line(tmp_path, pool):
+    # Arrange
+    source, output = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_lines(
+        source,
+        [
+            json.dumps({"request_id": "a", "body": "first"}),
+            "",
+            json.dumps({"id": 2, "prompt": "second"}),
+            "not json",
+        ],
+    )
+    runner = BatchRunner(pool, concurrency=2)
+
+    # Act
+    counts = runner.run(str(source), str(output))
+
+    # Assert
+    results = read_results(output)
+    assert counts == {"completed": 2, "failed": 1, "skipped": 0}
+    assert [r["line"] for r in results] == [1, 3, 4]
+    assert results[0] == {"line": 1, "id": "a", "response": "Hi!"}
+    assert results[1]["id"] == 2
+    assert "error" in results[2]
+    checkpoint = json.loads((tmp_path / "out.jsonl.ckpt").read_text())
+    assert checkpoint == {"watermark": 3, "done": []}, "Failed line was checkpointed"
+
+
+def test_run_resumes_without_redoing_finished_lines(tmp_path, pool, fake_chat):
+    # Arrange
+    source, output = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_lines(source, [json.dumps({"prompt": f"p{i}"}) for i in range(5)])
+    (tmp_path / "out.jsonl.ckpt").write_text(json.dumps({"watermark": 1, "done": [2]}))
+    # Line 4 finished after the last checkpoint, followed by a torn line
+    output.write_text(json.dumps({"line": 4, "response": "x"}) + '\n{"line": 5, "re')
+    runner = BatchRunner(pool)
+
+    # Act
+    counts = runner.run(str(source), str(output))
+
+    # Assert
+    assert counts == {"completed": 2, "failed": 0, "skipped": 3}
+    created = [r for r in fake_chat.requests if r.url.path == "/chat/conversation"]
+    assert len(created) == 2
+    assert fake_chat.conversations == {}, "Conversations were not deleted"
+    new_results = [json.loads(line) for line in output.read_text().splitlines()[2:]]
+    assert sorted(r["line"] for r in new_results) == [2, 5]
+
+
+def test_run_retries_failed_lines_on_resume(tmp_path, pool):
+    # Arrange
+    source, output = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_lines(source, [json.dumps({"prompt": "p0"}), json.dumps({"prompt": "p1"})])
+    runner = BatchRunner(pool)
+    ask = runner._ask
+    runner._ask = lambda request: (  # type: ignore[assignment]
+        ask(request) if request["prompt"] == "p0" else 1 / 0
+    )
+    first = runner.run(str(source), str(output))
+
+    # Act
+    second = BatchRunner(pool).run(str(source), str(output))
+
+    # Assert
+    assert first == {"completed": 1, "failed": 1, "skipped": 0}
+    assert second == {"completed": 1, "failed": 0, "skipped": 1}
+    latest = {r["line"]: r for r in read_results(output)}
+    assert latest[2]["response"] == "Hi!"
+
+
+def test_run_bounds_concurrency(tmp_path, pool):
+    # Arrange
+    source, output = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_lines(source, [json.dumps({"prompt": f"p{i}"}) for i in range(20)])
+    runner = BatchRunner(pool, concurrency=3)
+
+    # Act
+    counts = runner.run(str(source), str(output))
+
+    # Assert
+    assert counts["completed"] == 20
+    assert pool.peak <= 3
@@ -0,0 +1,168 @@
+# pytest test/test_cache.py
+
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import time
+
+import pytest
+
+from conversation.cache import ResponseCache, cache_key
+from conversation.chat import ChatSession
+from conversation.constants import CONSTANTS
+from utils.config import Config
+
+
+@pytest.fixture
+def chat_tokens():
+    return ["Hi", "!"]
+
+
+def test_cache_key_ignores_formatting_noise():
+    # Arrange
+    messages = [{"role": "user", "content": "Hello\r\nthere "}]
+    same = [{"role": "user", "content": "Hello\nthere"}]
+
+    # Act / Assert
+    assert cache_key("m", "", messages) == cache_key("m", "", same)
+    assert cache_key("m", "", messages) != cache_key("other", "", same)
+    assert cache_key("m", "", messages) != cache_key("m", "", same, {"web_search": 1})
+
+
+def test_memory_tier_evicts_least_recently_used():
+    # Arrange
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", ["1"])
+    cache.put("b", ["2"])
+
+    # Act
+    cache.get("a")
+    cache.put("c", ["3"])
+
+    # Assert
+    assert cache.get("a") == ["1"]
+    assert cache.get("b") is None
+    assert len(cache) == 2
+
+
+def test_entries_expire(monkeypatch):
+    # Arrange
+    cache = ResponseCache(ttl=10.0)
+    cache.put("a", ["1"])
+    now = time.time()
+
+    # Act
+    monkeypatch.setattr(time, "time", lambda: now + 11.0)
+
+    # Assert
+    assert cache.get("a") is None
+
+
+def test_disk_tier_is_shared_next_to_config(tmp_path):
+    # Arrange
+    config = Config(filename=str(tmp_path / "config.ini"))
+    writer = ResponseCache.beside(config)
+    writer.put("a", ["Grüß", " dich"])
+
+    # Act
+    reader = ResponseCache.beside(config)
+
+    # Assert
+    assert reader.filename == str(tmp_path / "responses.db")
+    assert reader.get("a") == ["Grüß", " dich"]
+    writer.close()
+    reader.close()
+
+
+def test_repeated_prompt_is_streamed_from_cache(fake_chat, session):
+    # Arrange
+    cache = ResponseCache()
+    ChatSession(session, cache=cache).ask("Hello")
+    posts_before = len(fake_chat.requests)
+
+    # Act
+    chat = ChatSession(session, cache=cache)
+    tokens = list(chat.send("Hello"))
+
+    # Assert
+    assert tokens == ["Hi", "!"]
+    assert len(fake_chat.requests) == posts_before
+    assert chat.messages[-1] == {"role": "assistant", "content": "Hi!"}
+
+
+def test_live_turn_after_cache_hit_reseeds_conversation(fake_chat, session):
+    # Arrange
+    cache = ResponseCache()
+    ChatSession(session, system_prompt="Be nice.", cache=cache).ask("Hello")
+    chat = ChatSession(session, system_prompt="Be nice.", cache=cache)
+    chat.ask("Hello")
+
+    # Act
+    answer = chat.ask("And now?")
+
+    # Assert
+    create, lookup, post = fake_chat.requests[-3:]
+    assert answer == "Hi!"
+    assert json.loads(create.content)["preprompt"] == (
+        "Be nice.\n\nConversation so far:\nUser: Hello\nAssistant: Hi!"
+    )
+    assert chat.conversation_id == "conv1"
+    assert b'"inputs": "And now?"' in post.content
+
+
+def answer_from_cache(chat, cache, text, tokens):
+    message = {"role": "user", "content": text}
+    key = cache_key(
+        chat.model, chat.system_prompt, chat.messages + [message], {"web_search": False}
+    )
+    cache.put(key, tokens)
+    return chat.ask(text)
+
+
+def test_reseed_deletes_the_old_conversation(fake_chat, session):
+    # Arrange
+    cache = ResponseCache()
+    chat = ChatSession(session, cache=cache)
+    chat.ask("Hello")
+    old = chat.conversation_id
+    answer_from_cache(chat, cache, "Again", ["Yes"])
+
+    # Act
+    chat.ask("And now?")
+
+    # Assert
+    assert chat.conversation_id != old
+    assert old not in fake_chat.conversations, "Old conversation was orphaned"
+    assert any(r.method == "DELETE" for r in fake_chat.requests)
+
+
+def test_reseed_keeps_only_the_most_recent_turns(fake_chat, session, monkeypatch):
+    # Arrange
+    monkeypatch.setitem(CONSTANTS, "RESEED_MAX_CHARS", 45)
+    cache = ResponseCache()
+    chat = ChatSession(session, cache=cache)
+    chat.ask("A first question that is long enough")
+    answer_from_cache(chat, cache, "Second", ["Two"])
+
+    # Act
+    chat.ask("Third")
+
+    # Assert
+    create = [r for r in fake_chat.requests if r.url.path == "/chat/conversation"][-1]
+    preprompt = json.loads(create.content)["preprompt"]
+    assert preprompt == (
+        "Conversation so far:\n(earlier turns omitted)\n"
+        "Assistant: Hi!\nUser: Second\nAssistant: Two"
+    )
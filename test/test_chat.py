@@ -0,0 +1,107 @@
+# pytest test/test_chat.py
+
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import pytest
+
+from conversation.chat import ChatSession
+from conversation.constants import CONSTANTS
+
+CHAT_URL = CONSTANTS["CHAT_URL"]
+
+
+def test_send_yields_tokens_while_streaming(fake_chat, session):
+    # Arrange
+    chat = ChatSession(session, model="test-model", system_prompt="Be nice.")
+
+    # Act
+    stream = chat.send("Hi")
+    first = next(stream)
+
+    # Assert
+    assert first == "Hello"
+    assert fake_chat.produced == ["Hello"], "Response was buffered before yielding"
+    assert list(stream) == [", ", "world", "!"]
+    create = json.loads(fake_chat.requests[0].content)
+    assert create == {"model": "test-model", "preprompt": "Be nice."}
+    assert chat.messages == [
+        {"role": "user", "content": "Hi"},
+        {"role": "assistant", "content": "Hello, world!"},
+    ]
+
+
+def test_send_appends_to_last_message(fake_chat, session):
+    # Arrange
+    chat = ChatSession(session)
+
+    # Act
+    assert chat.ask("Hi") == "Hello, world!"
+
+    # Assert
+    post = fake_chat.requests[-1]
+    assert b'"id": "msg-conv0-root"' in post.content
+    assert b'"inputs": "Hi"' in post.content
+
+
+def test_error_status_raises(session, fake_chat):
+    # Arrange
+    def failing_stream(conversation_id):
+        yield b'{"type": "status", "status": "error", "message": "overloaded"}\n'
+
+    fake_chat.stream = failing_stream
+    chat = ChatSession(session)
+
+    # Act / Assert
+    with pytest.raises(RuntimeError, match="overloaded"):
+        chat.ask("Hi")
+
+
+@pytest.mark.parametrize("send_message_ids, lookups", [(True, 1), (False, 3)])
+def test_follow_up_messages_reuse_tracked_ids(
+    fake_chat, session, send_message_ids, lookups
+):
+    # Arrange
+    fake_chat.send_message_ids = send_message_ids
+    chat = ChatSession(session)
+
+    # Act
+    for _ in range(3):
+        chat.ask("again")
+
+    # Assert
+    posts = [r for r in fake_chat.requests if r.url.path == "/chat/conversation/conv0"]
+    data_lookups = [r for r in fake_chat.requests if r.method == "GET"]
+    parents = [json.loads(r.content.split(b"\r\n")[4])["id"] for r in posts]
+    assert len(data_lookups) == lookups
+    assert parents == ["msg-conv0-root", "msg-conv0-1", "msg-conv0-2"]
+    sizes = {len(r.content) - len(p) for r, p in zip(posts, parents)}
+    assert len(sizes) == 1, "Upload grew with the history"
+
+
+def test_close_deletes_the_conversation(fake_chat, session):
+    # Arrange
+    chat = ChatSession(session)
+    chat.ask("Hi")
+
+    # Act
+    chat.close()
+    chat.close()
+
+    # Assert
+    assert fake_chat.conversations == {}
+    assert chat.conversation_id is None
+    assert [r.method for r in fake_chat.requests].count("DELETE") == 1
@@ -0,0 +1,123 @@
+# pytest test/test_coalescer.py
+
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+import pytest
+
+from conversation.chat import ChatSession
+from conversation.coalescer import RequestCoalescer
+
+
+def test_identical_requests_share_one_upstream_stream(fake_chat, session):
+    # Arrange
+    release = threading.Event()
+    original = fake_chat.stream
+
+    def gated_stream(conversation_id):
+        for index, chunk in enumerate(original(conversation_id)):
+            yield chunk
+            if index == 1:
+                release.wait(5.0)
+
+    fake_chat.stream = gated_stream
+    coalescer = RequestCoalescer()
+    leader = ChatSession(session, coalescer=coalescer)
+    follower = ChatSession(session, coalescer=coalescer)
+
+    # Act
+    leader_stream = leader.send("Hi")
+    first = next(leader_stream)
+    follower_stream = follower.send("Hi")
+    replayed = next(follower_stream)
+    release.set()
+
+    # Assert
+    assert (first, replayed) == ("Hello", "Hello")
+    assert list(follower_stream) == [", ", "world", "!"]
+    assert list(leader_stream) == [", ", "world", "!"]
+    assert len(fake_chat.conversations) == 1, "Follower sent its own request"
+    assert follower.messages == leader.messages
+    assert coalescer.in_flight() == 0
+
+
+def test_follower_continues_in_a_seeded_conversation(fake_chat, session):
+    # Arrange
+    coalescer = RequestCoalescer()
+    follower = ChatSession(session, coalescer=coalescer)
+    follower._stale = True  # as after joining another session's flight
+    follower.messages = [
+        {"role": "user", "content": "Hi"},
+        {"role": "assistant", "content": "Hello, world!"},
+    ]
+
+    # Act
+    follower.ask("Again")
+
+    # Assert
+    assert follower.conversation_id == "conv0"
+    assert b"Conversation so far" in fake_chat.requests[0].content
+
+
+def test_upstream_error_reaches_every_subscriber():
+    # Arrange
+    coalescer = RequestCoalescer()
+    release = threading.Event()
+
+    def produce():
+        yield "partial"
+        release.wait(5.0)
+        raise RuntimeError("upstream failed")
+
+    first = coalescer.stream("key", produce)
+    assert next(first) == "partial"
+    second = coalescer.stream("key", produce)
+    release.set()
+
+    # Act / Assert
+    for stream in (first, second):
+        with pytest.raises(RuntimeError, match="upstream failed"):
+            list(stream)
+
+
+def test_stream_pauses_for_slow_subscribers_and_stops_when_they_leave():
+    # Arrange
+    coalescer = RequestCoalescer(max_ahead=4)
+    produced = []
+    closed = threading.Event()
+
+    def produce():
+        try:
+            for i in range(1000):
+                produced.append(i)
+                yield str(i)
+        finally:
+            closed.set()
+
+    stream = coalescer.stream("key", produce)
+
+    # Act
+    first = next(stream)
+    time.sleep(0.2)
+    paused_at = len(produced)
+    stream.close()
+
+    # Assert
+    assert first == "0"
+    assert paused_at <= 4 + 1, "Upstream kept reading for a stalled subscriber"
+    assert closed.wait(5.0), "Upstream was not closed after the last subscriber left"
+    assert coalescer.in_flight() == 0
@@ -15,9 +15,11 @@
 # limitations under the License.
 
 import os
+import threading
 
 import pytest
 
+from utils.backends import MemoryBackend
 from utils.config import Config
 
 # Constants for test
@@ -138,3 +140,203 @@ def test_set_details_with_invalid_keys(config, key, value, exception, test_id):
             assert (
                 config.get_token()[key] == value
             ), f"Failed on {test_id}: Token detail {key} was not set correctly"
+
+
+@pytest.mark.parametrize(
+    "token, expire_date, expected, test_id",
+    [
+        (VALID_TOKEN, "", True, "unknown_expiry"),
+        (VALID_TOKEN, VALID_EXPIRE_DATE, False, "expired_date"),
+        (VALID_TOKEN, "2999-01-01T00:00:00+00:00", True, "future_datetime"),
+        (VALID_TOKEN, "not-a-date", True, "malformed_expiry"),
+        ("", "2999-01-01", False, "no_token"),
+    ],
+)
+def test_is_token_valid(config, token, expire_date, expected, test_id):
+    # Act
+    config.set_token(token=token, expire_date=expire_date)
+
+    # Assert
+    assert config.is_token_valid() == expected, f"Failed on {test_id}"
+
+
+def test_transaction_writes_once(config, monkeypatch):
+    # Arrange
+    writes = []
+    real_replace = os.replace
+    monkeypatch.setattr(
+        os, "replace", lambda src, dst: writes.append(dst) or real_replace(src, dst)
+    )
+
+    # Act
+    with config.transaction():
+        config.set_login_details(email=VALID_EMAIL, password=VALID_PASSWORD)
+        config.set_token(token=VALID_TOKEN, expire_date=VALID_EXPIRE_DATE)
+        assert not os.path.exists(CONFIG_FILE), "Transaction wrote before exiting"
+
+    # Assert
+    assert writes == [CONFIG_FILE]
+    reloaded = Config(filename=CONFIG_FILE)
+    assert reloaded.get_login_details()["email"] == VALID_EMAIL
+    assert reloaded.get_token()["token"] == VALID_TOKEN
+
+
+def test_transaction_rolls_back_on_error(config):
+    # Arrange
+    config.set_login_details(email=VALID_EMAIL, password=VALID_PASSWORD)
+
+    # Act
+    with pytest.raises(RuntimeError):
+        with config.transaction():
+            config.set_login_details(email="other@example.com")
+            config.set_token(token=VALID_TOKEN)
+            raise RuntimeError("abort")
+
+    # Assert
+    assert config.get_login_details()["email"] == VALID_EMAIL
+    assert not config.is_logged_in
+    assert Config(filename=CONFIG_FILE).get_login_details()["email"] == VALID_EMAIL
+    assert not [f for f in os.listdir(".") if f.startswith(".config-")]
+
+
+def test_snapshot_reparses_only_on_file_change():
+    # Arrange
+    if os.path.exists(CONFIG_FILE):
+        os.unlink(CONFIG_FILE)
+    config = Config(filename=CONFIG_FILE, stat_interval=0)
+    config.set_login_details(email=VALID_EMAIL, password=VALID_PASSWORD)
+    first = config.snapshot
+
+    # Act / Assert
+    assert config.snapshot is first, "Unchanged file was re-parsed"
+    assert config.config_exists(CONFIG_FILE)
+
+    other = Config(filename=CONFIG_FILE)
+    other.set_token(token=VALID_TOKEN, expire_date=VALID_EXPIRE_DATE)
+
+    assert config.snapshot is not first
+    assert config.snapshot.token == VALID_TOKEN
+    assert config.get_login_details()["email"] == VALID_EMAIL
+
+
+def test_snapshot_is_immutable(config):
+    # Act / Assert
+    with pytest.raises(AttributeError):
+        config.snapshot.token = VALID_TOKEN  # type: ignore[misc]
+    with pytest.raises(AttributeError):
+        config.snapshot.__dict__
+
+
+@pytest.mark.parametrize(
+    "filename, test_id",
+    [
+        ("config.ini", "ini_backend"),
+        ("config.json", "json_backend"),
+        ("config.db", "sqlite_backend"),
+    ],
+)
+def test_backends_share_storage(tmp_path, filename, test_id):
+    # Arrange
+    path = str(tmp_path / filename)
+    writer = Config(filename=path)
+    reader = Config(filename=path, stat_interval=0)
+    assert not reader.config_exists(path)
+
+    # Act
+    with writer.transaction():
+        writer.set_login_details(email=VALID_EMAIL, password=VALID_PASSWORD)
+        writer.set_token(token=VALID_TOKEN, expire_date=VALID_EXPIRE_DATE)
+    writer.delete_section("TOKEN")
+    writer.set_token(token="newtoken")
+
+    # Assert
+    assert reader.config_exists(path), f"Failed on {test_id}: change not picked up"
+    assert reader.get_login_details()["email"] == VALID_EMAIL, f"Failed on {test_id}"
+    assert reader.get_token() == {"token": "newtoken", "expire_date": ""}
+    assert Config(filename=path).get_token()["token"] == "newtoken"
+
+
+def test_memory_backend_shared_between_configs():
+    # Arrange
+    backend = MemoryBackend()
+    writer = Config(filename=":memory:", backend=backend)
+    reader = Config(filename=":memory:", backend=backend, stat_interval=0)
+
+    # Act
+    writer.set_token(token=VALID_TOKEN)
+
+    # Assert
+    assert reader.get_token()["token"] == VALID_TOKEN
+    assert Config(filename=":memory:").get_token()["token"] == ""
+
+
+def test_cookies_round_trip_through_the_file(tmp_path):
+    # Arrange
+    path = str(tmp_path / "config.ini")
+    cookies = {"token": VALID_TOKEN, "hf-Chat": "a%20b"}
+
+    # Act
+    Config(filename=path).set_cookies(cookies)
+
+    # Assert
+    assert Config(filename=path).get_cookies() == cookies
+
+
+@pytest.mark.parametrize(
+    "rate, burst, test_id",
+    [
+        (0, 5, "zero_rate"),
+        (-1, 5, "negative_rate"),
+        (2, -1, "negative_burst"),
+        ("fast", 5, "malformed_rate"),
+        ("nan", 5, "nan_rate"),
+    ],
+)
+def test_invalid_rate_limits_are_ignored(config, caplog, rate, burst, test_id):
+    # Arrange
+    config.set_rate_limit(2, 4)
+
+    # Act
+    config.set_rate_limit(rate, burst, model="Org/Model-1")
+    override = config.get_rate_limit("Org/Model-1")
+    config.set_rate_limit(rate, burst)
+    default = config.get_rate_limit("Org/Model-1")
+
+    # Assert
+    assert override == (2.0, 4.0), f"Failed on {test_id}: override was not ignored"
+    assert default is None, f"Failed on {test_id}: default was not ignored"
+    assert "Ignoring invalid rate limit" in caplog.text
+
+
+def test_tenants_are_stored_with_weights(config):
+    # Act
+    config.set_tenant("web", "sk-web", 4)
+    config.set_tenant("batch", "sk-batch")
+
+    # Assert
+    assert config.get_tenants() == {"web": ("sk-web", 4.0), "batch": ("sk-batch", 1.0)}
+
+
+def test_background_reloads_do_not_lose_concurrent_writes(tmp_path):
+    # Arrange
+    config = Config(filename=str(tmp_path / "shared.ini"))
+    stop = threading.Event()
+
+    def reload_continuously():
+        while not stop.is_set():
+            config.refresh(force=True)
+
+    reloader = threading.Thread(target=reload_continuously)
+    reloader.start()
+
+    # Act
+    try:
+        for i in range(200):
+            config.set_tenant(f"t{i}", f"sk-{i}")
+    finally:
+        stop.set()
+        reloader.join()
+
+    # Assert
+    stored = Config(filename=str(tmp_path / "shared.ini")).get_tenants()
+    assert len(stored) == 200, "Writes racing with a reload were lost"
@@ -0,0 +1,420 @@
+# pytest test/test_gateway.py
+
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import json
+import threading
+from contextlib import contextmanager
+
+import httpx
+import pytest
+
+from auth.errors import AccountUnavailableError
+from gateway.constants import CONSTANTS
+from gateway.http import HTTPError
+from gateway.server import Gateway, split_messages, tenant_name
+
+
+class FakePool:
+    """Hands out one shared client, optionally failing with an unavailable account."""
+
+    def __init__(self, client, unavailable=False):
+        self.client = client
+        self.unavailable = unavailable
+
+    @contextmanager
+    def lease(self):
+        if self.unavailable:
+            request = httpx.Request("POST", "https://huggingface.co/chat")
+            raise AccountUnavailableError(
+                "rate-limited",
+                request=request,
+                response=httpx.Response(429, request=request),
+                retry_after=7,
+            )
+        yield "user@example.com", self.client
+
+    def call(self, request):
+        with self.lease() as (email, client):
+            return request(email, client)
+
+    def stream(self, request):
+        with self.lease() as (email, client):
+            yield from request(email, client)
+
+
+@pytest.fixture
+def client(fake_chat):
+    with httpx.Client(transport=httpx.MockTransport(fake_chat)) as client:
+        yield client
+
+
+def serve(gateway, exchange):
+    """Runs `exchange(http)` against the gateway listening on a free port."""
+
+    async def run():
+        server = await gateway.start("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            async with httpx.AsyncClient(
+                base_url=f"http://127.0.0.1:{port}", timeout=10
+            ) as http:
+                return await exchange(http)
+        finally:
+            server.close()
+            await server.wait_closed()
+            gateway.close()
+
+    return asyncio.run(run())
+
+
+def completion(stream=False, **body):
+    messages = [
+        {"role": "system", "content": "Be nice."},
+        {"role": "user", "content": "Hi"},
+        {"role": "assistant", "content": "Hello!"},
+        {"role": "user", "content": "How are you?"},
+    ]
+    return {"model": "test-model", "messages": messages, "stream": stream, **body}
+
+
+def test_split_messages_separates_system_history_and_prompt():
+    # Arrange
+    messages = completion()["messages"]
+    messages[3] = {"role": "user", "content": [{"type": "text", "text": "Hey"}]}
+
+    # Act
+    system_prompt, history, prompt = split_messages(messages)
+
+    # Assert
+    assert system_prompt == "Be nice."
+    assert history == [
+        {"role": "user", "content": "Hi"},
+        {"role": "assistant", "content": "Hello!"},
+    ]
+    assert prompt == "Hey"
+
+
+def test_split_messages_requires_a_last_user_message():
+    # Act / Assert
+    with pytest.raises(HTTPError) as raised:
+        split_messages([{"role": "assistant", "content": "Hi"}])
+    assert raised.value.status == 400
+
+
+def test_completion_returns_the_whole_answer(client, fake_chat):
+    # Arrange
+    gateway = Gateway(FakePool(client))
+
+    # Act
+    response = serve(
+        gateway, lambda http: http.post("/v1/chat/completions", json=completion())
+    )
+
+    # Assert
+    assert response.status_code == 200
+    body = response.json()
+    assert body["object"] == "chat.completion"
+    assert body["model"] == "test-model"
+    assert body["choices"][0]["message"] == {
+        "role": "assistant",
+        "content": "Hello, world!",
+    }
+    create = json.loads(fake_chat.requests[0].content)
+    assert create["preprompt"] == (
+        "Be nice.\n\nConversation so far:\nUser: Hi\nAssistant: Hello!"
+    )
+
+
+def test_streaming_completion_sends_server_sent_events(client):
+    # Arrange
+    gateway = Gateway(FakePool(client))
+
+    async def exchange(http):
+        request = http.build_request(
+            "POST", "/v1/chat/completions", json=completion(stream=True)
+        )
+        response = await http.send(request, stream=True)
+        lines = [line async for line in response.aiter_lines() if line]
+        await response.aclose()
+        return response, lines
+
+    # Act
+    response, lines = serve(gateway, exchange)
+
+    # Assert
+    assert response.headers["content-type"] == "text/event-stream"
+    assert lines[-1] == "data: [DONE]"
+    chunks = [json.loads(line[len("data: ") :]) for line in lines[:-1]]
+    assert chunks[0]["choices"][0]["delta"]["role"] == "assistant"
+    assert "".join(c["choices"][0]["delta"].get("content", "") for c in chunks) == (
+        "Hello, world!"
+    )
+    assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+
+
+def test_connection_is_kept_alive_between_requests(client, fake_chat):
+    # Arrange
+    gateway = Gateway(FakePool(client))
+
+    async def exchange(http):
+        first = await http.post("/v1/chat/completions", json=completion())
+        second = await http.post("/v1/chat/completions", json=completion())
+        return first, second
+
+    # Act
+    first, second = serve(gateway, exchange)
+
+    # Assert
+    assert first.status_code == second.status_code == 200
+    assert first.headers["connection"] == "keep-alive"
+    assert fake_chat.conversations == {}, "Completions left conversations behind"
+
+
+def test_models_lists_the_huggingchat_models(client):
+    # Arrange
+    gateway = Gateway(FakePool(client))
+
+    # Act
+    response = serve(gateway, lambda http: http.get("/v1/models"))
+
+    # Assert
+    assert response.status_code == 200
+    assert [m["id"] for m in response.json()["data"]] == ["test-model"]
+
+
+def test_api_keys_are_enforced(client):
+    # Arrange
+    gateway = Gateway(FakePool(client), api_keys=["secret"])
+
+    async def exchange(http):
+        denied = await http.get("/v1/models")
+        allowed = await http.get(
+            "/v1/models", headers={"Authorization": "Bearer secret"}
+        )
+        return denied, allowed
+
+    # Act
+    denied, allowed = serve(gateway, exchange)
+
+    # Assert
+    assert denied.status_code == 401
+    assert denied.json()["error"]["type"] == "invalid_request_error"
+    assert allowed.status_code == 200
+
+
+def test_unavailable_accounts_answer_503_with_retry_after(client):
+    # Arrange
+    gateway = Gateway(FakePool(client, unavailable=True))
+
+    # Act
+    response = serve(
+        gateway,
+        lambda http: http.post("/v1/chat/completions", json=completion(stream=True)),
+    )
+
+    # Assert
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "7"
+
+
+def test_unknown_path_answers_404(client):
+    # Arrange
+    gateway = Gateway(FakePool(client))
+
+    # Act
+    response = serve(gateway, lambda http: http.get("/v1/embeddings"))
+
+    # Assert
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("length", ["-5", "+5", "1_0", "abc"])
+def test_invalid_content_length_answers_400(client, length):
+    # Arrange
+    gateway = Gateway(FakePool(client))
+
+    async def run():
+        server = await gateway.start("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(
+                b"POST /v1/chat/completions HTTP/1.1\r\nHost: test\r\n"
+                + f"Content-Length: {length}\r\n\r\n".encode()
+            )
+            status_line = await asyncio.wait_for(reader.readline(), 5)
+            writer.close()
+            return status_line
+        finally:
+            server.close()
+            await server.wait_closed()
+            gateway.close()
+
+    # Act
+    status_line = asyncio.run(run())
+
+    # Assert
+    assert status_line.startswith(b"HTTP/1.1 400")
+
+
+def test_full_queue_sheds_load_with_503(client):
+    # Arrange
+    release = threading.Event()
+    pool = FakePool(client)
+    pool.stream = lambda request: iter(release.wait(5) and ["late"])
+    gateway = Gateway(pool, max_upstream=1, max_queue=0)
+
+    async def exchange(http):
+        busy = asyncio.ensure_future(
+            http.post("/v1/chat/completions", json=completion())
+        )
+        while gateway.admission.active() == 0:
+            await asyncio.sleep(0.01)
+        shed = await http.post("/v1/chat/completions", json=completion())
+        release.set()
+        return shed, await busy
+
+    # Act
+    shed, busy = serve(gateway, exchange)
+
+    # Assert
+    assert shed.status_code == 503
+    assert int(shed.headers["retry-after"]) >= 1
+    assert busy.status_code == 200
+
+
+def test_slow_consumer_pauses_the_upstream(client, monkeypatch):
+    # Arrange
+    monkeypatch.setitem(CONSTANTS, "STREAM_BUFFER", 4)
+    produced = []
+
+    def produce():
+        for i in range(1000):
+            produced.append(i)
+            yield str(i)
+
+    gateway = Gateway(FakePool(client))
+
+    async def run():
+        tokens = gateway._iterate(produce, "default")
+        first = await tokens.__anext__()
+        await asyncio.sleep(0.2)
+        paused_at = len(produced)
+        await tokens.aclose()
+        # Let the worker see that the consumer is gone before the loop closes
+        await asyncio.sleep(0.1)
+        gateway.close()
+        return first, paused_at
+
+    # Act
+    first, paused_at = asyncio.run(run())
+
+    # Assert
+    assert first == "0"
+    assert paused_at <= 4 + 2, "Upstream kept reading for a stalled consumer"
+
+
+def test_stats_report_requests_per_tenant(client):
+    # Arrange
+    gateway = Gateway(FakePool(client), tenants={"web": ("sk-web", 3.0)})
+
+    async def exchange(http):
+        headers = {"Authorization": "Bearer sk-web"}
+        await http.post("/v1/chat/completions", json=completion(), headers=headers)
+        return await http.get("/v1/stats", headers=headers)
+
+    # Act
+    response = serve(gateway, exchange)
+
+    # Assert
+    assert response.status_code == 200
+    tenants = response.json()["tenants"]
+    assert tenants["web"]["weight"] == 3.0
+    assert tenants["web"]["served"] == 1
+    assert tenants["web"]["queued"] == 0
+
+
+def test_priority_header_selects_the_lane(client):
+    # Arrange
+    gateway = Gateway(FakePool(client), interactive_slots=3, batch_slots=2)
+
+    async def exchange(http):
+        headers = {"X-Priority": "batch"}
+        ok = await http.post("/v1/chat/completions", json=completion(), headers=headers)
+        headers = {"X-Priority": "urgent"}
+        bad = await http.post(
+            "/v1/chat/completions", json=completion(), headers=headers
+        )
+        # The slot is released once the response has been sent
+        while gateway.admission.active("batch"):
+            await asyncio.sleep(0.01)
+        return ok, bad, await http.get("/v1/stats")
+
+    # Act
+    ok, bad, stats = serve(gateway, exchange)
+
+    # Assert
+    assert ok.status_code == 200
+    assert bad.status_code == 400
+    assert stats.json()["lanes"]["batch"] == {"cap": 2, "active": 0, "queued": 0}
+    assert stats.json()["lanes"]["interactive"]["cap"] == 3
+
+
+def test_interactive_lane_defaults_to_every_upstream_slot(client):
+    # Act
+    gateway = Gateway(FakePool(client), max_upstream=5)
+
+    # Assert
+    assert gateway.admission.lane_stats()["interactive"]["cap"] == 5
+
+
+def test_accepted_keys_are_separate_tenants(client):
+    # Arrange
+    gateway = Gateway(FakePool(client), api_keys=["one", "two"])
+
+    async def exchange(http):
+        for key in ("one", "two"):
+            headers = {"Authorization": f"Bearer {key}"}
+            await http.post("/v1/chat/completions", json=completion(), headers=headers)
+        return await http.get("/v1/stats", headers=headers)
+
+    # Act
+    response = serve(gateway, exchange)
+
+    # Assert
+    assert sorted(response.json()["tenants"]) == sorted(
+        [tenant_name("one"), tenant_name("two")]
+    )
+
+
+def test_open_gateway_queues_every_client_as_one_tenant(client):
+    # Arrange
+    gateway = Gateway(FakePool(client))
+
+    async def exchange(http):
+        for key in ("one", "two"):
+            headers = {"Authorization": f"Bearer {key}"}
+            await http.post("/v1/chat/completions", json=completion(), headers=headers)
+        await http.post("/v1/chat/completions", json=completion())
+        return await http.get("/v1/stats")
+
+    # Act
+    response = serve(gateway, exchange)
+
+    # Assert
+    assert list(response.json()["tenants"]) == ["anonymous"]
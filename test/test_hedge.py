@@ -0,0 +1,126 @@
+# pytest test/test_hedge.py
+
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import threading
+import time
+from test.conftest import FakeHuggingChat, wait_until
+
+import httpx
+import pytest
+
+from conversation.chat import ChatSession
+from conversation.constants import CONSTANTS
+from conversation.hedge import Hedger
+from conversation.ratelimit import RateLimiter
+
+
+@pytest.fixture
+def hedger():
+    hedger = Hedger(initial_delay=0.05, min_samples=5)
+    yield hedger
+    hedger.close()
+
+
+def test_delay_follows_the_latency_quantile(hedger):
+    # Arrange
+    assert hedger.delay() == 0.05
+
+    # Act
+    hedger._latencies.extend([0.1] * 19 + [2.0])
+
+    # Assert
+    assert hedger.delay() == 2.0
+    hedger._latencies.extend([0.1] * 40)
+    assert hedger.delay() == 0.1
+
+
+def test_slow_call_is_hedged_and_loser_cleaned_up(hedger):
+    # Arrange
+    release = threading.Event()
+    attempt = itertools.count()
+    cleaned = []
+
+    def call():
+        number = next(attempt)
+        if number == 0:
+            release.wait(5.0)
+        return number
+
+    # Act
+    result = hedger.call(call, cleanup=cleaned.append)
+    release.set()
+
+    # Assert
+    assert result == 1
+    wait_until(lambda: cleaned == [0])
+
+
+def test_fast_call_is_not_hedged(hedger):
+    # Arrange
+    calls = []
+
+    # Act
+    result = hedger.call(lambda: calls.append(1) or "done")
+
+    # Assert
+    assert result == "done"
+    assert calls == [1]
+
+
+def test_error_is_raised_when_every_attempt_fails(hedger):
+    # Arrange
+    def call():
+        time.sleep(0.1)
+        raise httpx.ConnectError("down")
+
+    # Act / Assert
+    with pytest.raises(httpx.ConnectError):
+        hedger.call(call)
+
+
+def test_hedged_conversation_creation_deletes_duplicate(hedger):
+    # Arrange
+    fake_chat = FakeHuggingChat(["Hi"])
+    fake_chat.create_delays = [0.5]
+    with httpx.Client(transport=httpx.MockTransport(fake_chat)) as client:
+        chat = ChatSession(client, hedger=hedger)
+
+        # Act
+        conversation_id = chat.new_conversation()
+
+        # Assert
+        assert conversation_id == "conv0"
+        wait_until(lambda: any(r.method == "DELETE" for r in fake_chat.requests))
+        wait_until(lambda: list(fake_chat.conversations) == ["conv0"])
+        assert chat.list_models() == ["test-model"]
+
+
+def test_waiting_for_the_rate_limiter_does_not_trigger_a_hedge(hedger, monkeypatch):
+    # Arrange
+    monkeypatch.setitem(CONSTANTS, "RATE_LIMIT", 5.0)
+    monkeypatch.setitem(CONSTANTS, "RATE_LIMIT_BURST", 1.0)
+    fake_chat = FakeHuggingChat(["Hi"])
+    with httpx.Client(transport=httpx.MockTransport(fake_chat)) as client:
+        chat = ChatSession(client, hedger=hedger, rate_limiter=RateLimiter())
+
+        # Act
+        for _ in range(3):
+            chat.new_conversation()
+
+    # Assert
+    methods = [r.method for r in fake_chat.requests]
+    assert methods == ["POST"] * 3, "Limiter wait was hedged as a slow response"
@@ -0,0 +1,80 @@
+# pytest test/test_pool.py
+
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from test.conftest import wait_until
+
+import httpx
+import pytest
+
+from conversation.pool import ConversationPool
+
+
+@pytest.fixture
+def chat_tokens():
+    return ["Hi", "!"]
+
+
+def test_warm_chat_sends_a_single_request(fake_chat, session):
+    # Arrange
+    with ConversationPool(session, size=2) as pool:
+        pool.warm("test-model")
+        wait_until(lambda: pool.available("test-model") == 2)
+
+        # Act
+        chat = pool.chat("test-model")
+        answer = chat.ask("Hello")
+
+        # Assert
+        conversation_requests = [
+            r for r in fake_chat.requests if chat.conversation_id in r.url.path
+        ]
+        assert answer == "Hi!"
+        assert [r.method for r in conversation_requests] == ["GET", "POST"]
+        wait_until(lambda: pool.available("test-model") == 2)
+    assert len(fake_chat.conversations) == 1, "Unused conversations were not deleted"
+
+
+def test_chat_without_warm_conversation_creates_on_demand(fake_chat, session):
+    # Arrange
+    pool = ConversationPool(session)
+
+    # Act
+    chat = pool.chat("test-model", "Be brief.")
+
+    # Assert
+    assert chat.conversation_id is None
+    assert chat.ask("Hello") == "Hi!"
+    assert (chat.model, chat.system_prompt) == ("test-model", "Be brief.")
+
+
+def test_unexpected_page_data_does_not_stop_the_pool(fake_chat, session):
+    # Arrange
+    broken = [True]
+
+    def handler(request):
+        if broken[0] and request.url.path.endswith("/__data.json"):
+            broken[0] = False
+            return httpx.Response(200, json={"nodes": []})
+        return fake_chat(request)
+
+    with httpx.Client(transport=httpx.MockTransport(handler)) as client:
+        with ConversationPool(client, size=1, retry_interval=0.01) as pool:
+            # Act
+            pool.warm("test-model")
+
+            # Assert
+            wait_until(lambda: pool.available("test-model") == 1)
+            assert len(fake_chat.conversations) == 1, "Broken conversation leaked"
@@ -0,0 +1,83 @@
+# pytest test/test_prefork.py
+
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import socket
+
+import pytest
+
+from gateway.prefork import Prefork, listen, reuse_port_supported
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+@pytest.mark.skipif(not reuse_port_supported(), reason="needs SO_REUSEPORT")
+def test_reuse_port_lets_sockets_share_a_port():
+    # Arrange
+    port = free_port()
+
+    # Act
+    first = listen("127.0.0.1", port, reuse_port=True)
+    second = listen("127.0.0.1", port, reuse_port=True)
+
+    # Assert
+    try:
+        assert first.getsockname() == second.getsockname()
+    finally:
+        first.close()
+        second.close()
+
+
+def test_workers_serve_in_separate_processes(tmp_path):
+    # Arrange
+    port = free_port()
+
+    def serve(sock):
+        (tmp_path / str(os.getpid())).write_text(str(sock.getsockname()[1]))
+        return 0
+
+    # Act
+    code = Prefork(serve, "127.0.0.1", port, workers=3).run()
+
+    # Assert
+    assert code == 0
+    ports = [path.read_text() for path in tmp_path.iterdir()]
+    assert ports == [str(port)] * 3
+    assert str(os.getpid()) not in [path.name for path in tmp_path.iterdir()]
+
+
+def test_crashed_worker_is_restarted(tmp_path):
+    # Arrange
+    attempts = tmp_path / "attempts"
+
+    def serve(sock):
+        with open(attempts, "a") as f:
+            f.write("x")
+        return 3 if attempts.read_text() == "x" else 0
+
+    # Act
+    code = Prefork(serve, "127.0.0.1", free_port(), workers=1, restart_delay=0).run()
+
+    # Assert
+    assert code == 3
+    assert attempts.read_text() == "xx"
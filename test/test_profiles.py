@@ -0,0 +1,140 @@
+# pytest test/test_profiles.py
+
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from auth.session_pool import SessionPool
+from utils.backends import SqliteBackend
+from utils.config import Config
+from utils.profiles import ProfileIndex
+
+# Constants for test
+VALID_EMAIL = "test@example.com"
+VALID_PASSWORD = "securepassword123"
+
+
+@pytest.fixture
+def profiles(tmp_path):
+    index = ProfileIndex(directory=str(tmp_path))
+    yield index
+    index.close()
+
+
+def test_lookup_by_name_and_email(profiles):
+    # Act
+    profiles.add("main", VALID_EMAIL, VALID_PASSWORD)
+    profiles.add("backup", "backup@example.com", VALID_PASSWORD)
+
+    # Assert
+    assert len(profiles) == 2
+    assert "main" in profiles
+    assert profiles.by_email(VALID_EMAIL) == profiles.get("main")
+    assert profiles.config("main").get_login_details()["email"] == VALID_EMAIL
+    assert profiles.by_email("unknown@example.com") is None
+
+
+def test_index_is_shared_and_loads_configs_lazily(profiles, monkeypatch):
+    # Arrange
+    profiles.add("main", VALID_EMAIL, VALID_PASSWORD)
+    loaded = []
+    real_init = Config.__init__
+
+    def tracking_init(self, *args, **kwargs):
+        loaded.append(kwargs.get("filename", args[0] if args else None))
+        real_init(self, *args, **kwargs)
+
+    monkeypatch.setattr(Config, "__init__", tracking_init)
+
+    # Act
+    other = ProfileIndex(directory=profiles.directory)
+    profile = other.by_email(VALID_EMAIL)
+
+    # Assert
+    assert profile is not None and profile.name == "main"
+    assert loaded == [], "Profile configuration was parsed before it was needed"
+    other.config("main")
+    assert loaded == [profile.filename]
+    other.close()
+
+
+def test_remove_and_refresh(profiles):
+    # Arrange
+    profiles.add("main", VALID_EMAIL, VALID_PASSWORD)
+    other = ProfileIndex(directory=profiles.directory)
+
+    # Act
+    profiles.remove("main")
+
+    # Assert
+    assert other.refresh()
+    assert other.get("main") is None
+    assert other.by_email(VALID_EMAIL) is None
+    other.close()
+
+
+def test_reads_pick_up_changes_of_other_processes(profiles):
+    # Arrange
+    other = ProfileIndex(directory=profiles.directory)
+    assert other.get("main") is None
+
+    # Act
+    profiles.add("main", VALID_EMAIL, VALID_PASSWORD)
+
+    # Assert
+    assert other.get("main") is not None, "Index was not re-read"
+    assert other.by_email(VALID_EMAIL) == other.get("main")
+    assert "main" in other and len(other) == 1
+    other.close()
+
+
+def test_import_directory_closes_the_configs_it_reads(tmp_path, monkeypatch):
+    # Arrange
+    profiles = ProfileIndex(directory=str(tmp_path), suffix=".db")
+    config = Config.for_account("legacy@example.com", profiles.directory, ".db")
+    config.set_login_details(email="legacy@example.com", password=VALID_PASSWORD)
+    config.backend.close()
+    closed = []
+    real_close = SqliteBackend.close
+
+    def tracking_close(self):
+        closed.append(self)
+        real_close(self)
+
+    monkeypatch.setattr(SqliteBackend, "close", tracking_close)
+
+    # Act
+    added = profiles.import_directory()
+
+    # Assert
+    assert added == 1
+    assert len(closed) == 1, "Configuration read by the import was left open"
+    profiles.close()
+
+
+def test_import_directory_and_pool(profiles):
+    # Arrange
+    Config.for_account("legacy@example.com", profiles.directory).set_login_details(
+        email="legacy@example.com", password=VALID_PASSWORD
+    )
+
+    # Act
+    added = profiles.import_directory()
+    pool = SessionPool.from_index(profiles)
+
+    # Assert
+    assert added == 1
+    assert profiles.get("legacy@example.com") is not None
+    assert pool.accounts == ["legacy@example.com"]
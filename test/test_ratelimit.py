@@ -0,0 +1,178 @@
+# pytest test/test_ratelimit.py
+
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import time
+from test.conftest import FakeHuggingChat
+
+import httpx
+import pytest
+
+from conversation.chat import ChatSession
+from conversation.constants import CONSTANTS
+from conversation.ratelimit import RateLimiter, TokenBucket
+from utils.config import Config
+
+
+def test_bucket_allows_burst_then_paces():
+    # Arrange
+    bucket = TokenBucket(rate=10.0, burst=2.0)
+
+    # Act
+    delays = [bucket.reserve() for _ in range(4)]
+
+    # Assert
+    assert delays[:2] == [0.0, 0.0]
+    assert delays[2] == pytest.approx(0.1, abs=0.01)
+    assert delays[3] == pytest.approx(0.2, abs=0.01)
+
+
+def test_limits_come_from_config():
+    # Arrange
+    config = Config(filename=":memory:")
+    limiter = RateLimiter(config)
+    defaults = (CONSTANTS["RATE_LIMIT"], CONSTANTS["RATE_LIMIT_BURST"])
+    assert limiter.limits("any") == defaults
+
+    # Act
+    config.set_rate_limit(0.5, 2)
+    config.set_rate_limit(4, 8, model="Org/Model-1")
+
+    # Assert
+    assert limiter.limits("any") == (0.5, 2.0)
+    assert limiter.limits("Org/Model-1") == (4.0, 8.0)
+
+
+def test_buckets_are_per_account_and_model():
+    # Arrange
+    config = Config(filename=":memory:")
+    config.set_rate_limit(1, 1)
+    limiter = RateLimiter(config)
+
+    # Act
+    first = limiter._reserve("a@example.com", "m")
+    other_account = limiter._reserve("b@example.com", "m")
+    other_model = limiter._reserve("a@example.com", "n")
+    same = limiter._reserve("a@example.com", "m")
+
+    # Assert
+    assert (first, other_account, other_model) == (0.0, 0.0, 0.0)
+    assert same == pytest.approx(1.0, abs=0.05)
+
+
+def test_acquire_async_waits_for_a_token():
+    # Arrange
+    config = Config(filename=":memory:")
+    config.set_rate_limit(50, 1)
+    limiter = RateLimiter(config)
+
+    # Act
+    async def acquire_twice():
+        return [await limiter.acquire_async("a", "m") for _ in range(2)]
+
+    delays = asyncio.run(acquire_twice())
+
+    # Assert
+    assert delays[0] == 0.0
+    assert delays[1] == pytest.approx(0.02, abs=0.01)
+
+
+def test_every_chat_request_goes_through_the_limiter():
+    # Arrange
+    class CountingLimiter(RateLimiter):
+        def __init__(self):
+            super().__init__()
+            self.calls = []
+
+        def acquire(self, account, model):
+            self.calls.append((account, model))
+            return 0.0
+
+    limiter = CountingLimiter()
+    transport = httpx.MockTransport(FakeHuggingChat(["Hi"]))
+    with httpx.Client(transport=transport) as client:
+        chat = ChatSession(client, model="m", account="a", rate_limiter=limiter)
+
+        # Act
+        chat.ask("Hello")
+
+    # Assert
+    assert limiter.calls == [("a", "m")] * 3
+
+
+def test_share_splits_the_limits():
+    # Arrange
+    config = Config(filename=":memory:")
+    config.set_rate_limit(4, 8)
+
+    # Act
+    limits = RateLimiter(config, share=0.25).limits("any")
+    tiny = RateLimiter(config, share=0.01).limits("any")
+
+    # Assert
+    assert limits == (1.0, 2.0)
+    assert tiny == (0.04, 1.0), "Burst must stay at least one request"
+
+
+def test_batch_and_gateway_stay_within_the_limits(tmp_path, monkeypatch):
+    # Arrange
+    monkeypatch.setitem(CONSTANTS, "LANE_CHECK_INTERVAL", 0.0)
+    filename = str(tmp_path / "config.ini")
+    Config(filename=filename).set_rate_limit(8, 4)
+    batch = RateLimiter(Config(filename=filename), lane="batch", batch_share=0.25)
+    workers = [
+        RateLimiter(Config(filename=filename), share=0.5, lane="interactive")
+        for _ in range(2)
+    ]
+    alone = batch.limits("m")
+
+    # Act
+    for worker in workers:
+        worker.acquire("a", "m")
+    batch.acquire("a", "m")
+    limits = [batch.limits("m")] + [worker.limits("m") for worker in workers]
+
+    # Assert
+    assert alone == (8.0, 4.0), "An idle gateway must leave the whole rate to the batch"
+    assert limits[0] == (2.0, 1.0)
+    assert limits[1] == limits[2] == (3.0, 1.5)
+    assert sum(rate for rate, _ in limits) == 8.0
+
+
+def test_idle_lanes_stop_counting(tmp_path, monkeypatch):
+    # Arrange
+    monkeypatch.setitem(CONSTANTS, "LANE_CHECK_INTERVAL", 0.0)
+    monkeypatch.setitem(CONSTANTS, "LANE_ACTIVE_WINDOW", 0.05)
+    config = Config(filename=str(tmp_path / "config.ini"))
+    config.set_rate_limit(8, 4)
+    batch = RateLimiter(config, lane="batch")
+    gateway = RateLimiter(config, lane="interactive")
+    batch.acquire("a", "m")
+    assert gateway.limits("m") == (4.0, 2.0)
+
+    # Act
+    time.sleep(0.1)
+
+    # Assert
+    assert gateway.limits("m") == (8.0, 4.0)
+
+
+def test_unknown_lane_or_share_is_rejected():
+    # Act / Assert
+    with pytest.raises(ValueError):
+        RateLimiter(lane="bulk")
+    with pytest.raises(ValueError):
+        RateLimiter(lane="batch", batch_share=1.0)
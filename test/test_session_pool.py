@@ -0,0 +1,272 @@
+# pytest test/test_session_pool.py
+
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from test.test_auth import login_handler, login_requests
+
+import httpx
+import pytest
+
+from auth.auth_manager import AuthenticationManager
+from auth.client import client_registry
+from auth.errors import AccountUnavailableError, check_account, parse_retry_after
+from auth.session_pool import SessionPool, _Account
+from utils.config import Config
+
+# Constants for test
+ACCOUNTS = [
+    ("one@example.com", "password1"),
+    ("two@example.com", "password2"),
+    ("three@example.com", "password3"),
+]
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    client_registry.close_all()
+    monkeypatch.setattr(
+        client_registry, "transport", httpx.MockTransport(login_handler)
+    )
+    yield SessionPool.from_credentials(ACCOUNTS, directory=str(tmp_path))
+    client_registry.close_all()
+
+
+def test_pool_authenticates_every_account(pool):
+    # Assert
+    assert sorted(pool.accounts) == sorted(email for email, _ in ACCOUNTS)
+
+
+def test_session_hands_out_least_loaded_account(pool):
+    # Act
+    with pool.session() as first, pool.session() as second, pool.session() as third:
+        load_while_busy = pool.load()
+        clients = {first, second, third}
+
+    # Assert
+    assert len(clients) == len(ACCOUNTS), "Sessions were not spread over the accounts"
+    assert set(load_while_busy.values()) == {1}
+    assert set(pool.load().values()) == {0}
+
+
+def test_from_directory_restores_accounts(pool):
+    # Act
+    restored = SessionPool.from_directory(pool.directory)
+
+    # Assert
+    assert sorted(restored.accounts) == sorted(pool.accounts)
+    with restored.session() as session:
+        assert session is not None
+
+
+def test_add_config_reuses_the_stored_token(pool, tmp_path):
+    # Arrange
+    config = Config(filename=str(tmp_path / "config.ini"))
+    AuthenticationManager(config).set_up_authentication("main@example.com", "secret")
+    login_requests.clear()
+    directory = tmp_path / "accounts"
+    empty = SessionPool(directory=str(directory))
+
+    # Act
+    added = empty.add_config(config)
+
+    # Assert
+    assert added
+    assert empty.accounts == ["main@example.com"]
+    assert login_requests == [], "A valid stored token must not sign in again"
+    assert not directory.exists(), "The account must stay in its own configuration"
+
+
+def test_add_config_without_login_details_adds_nothing(tmp_path):
+    # Arrange
+    pool = SessionPool(directory=str(tmp_path))
+
+    # Act
+    added = pool.add_config(Config(filename=str(tmp_path / "config.ini")))
+
+    # Assert
+    assert not added
+    assert pool.accounts == []
+
+
+def test_empty_pool_raises(tmp_path):
+    # Arrange
+    pool = SessionPool(directory=str(tmp_path))
+
+    # Act / Assert
+    with pytest.raises(RuntimeError):
+        with pool.session():
+            pass
+
+
+def rate_limited(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(429, headers={"Retry-After": "120"}, request=request)
+
+
+def test_call_fails_over_and_persists_cooldown(pool):
+    # Arrange
+    attempts = []
+
+    def request(email, client):
+        attempts.append(email)
+        if len(attempts) == 1:
+            check_account(rate_limited(httpx.Request("GET", "https://huggingface.co")))
+        return email
+
+    # Act
+    served_by = pool.call(request)
+
+    # Assert
+    limited = attempts[0]
+    assert served_by == attempts[1] != limited
+    assert list(pool.cooldowns()) == [limited]
+    assert 110 < pool.cooldowns()[limited] <= 120
+    restored = SessionPool.from_directory(pool.directory)
+    assert list(restored.cooldowns()) == [limited], "Cooldown was not persisted"
+    for _ in ACCOUNTS:
+        with restored.lease() as (email, _):
+            assert email != limited
+
+
+def sent_to_login(request: httpx.Request) -> httpx.Response:
+    headers = {"Location": "https://huggingface.co/login"}
+    return httpx.Response(302, headers=headers, request=request)
+
+
+def test_expired_session_signs_in_again_instead_of_cooling_down(pool):
+    # Arrange
+    attempts = []
+    login_requests.clear()
+
+    def request(email, client):
+        attempts.append(email)
+        if len(attempts) == 1:
+            check_account(sent_to_login(httpx.Request("GET", "https://huggingface.co")))
+        return email
+
+    # Act
+    served_by = pool.call(request)
+
+    # Assert
+    assert len(login_requests) == 1, "Expired account did not sign in again"
+    assert served_by in pool.accounts
+    assert pool.cooldowns() == {}
+
+
+@pytest.mark.parametrize(
+    "value, expected, test_id",
+    [
+        ("120", 120.0, "seconds"),
+        ("1.5", 1.5, "fractional_seconds"),
+        ("-3", 0.0, "negative_seconds"),
+        ("Wed, 21 Oct 2015 07:28:00 GMT", 0.0, "past_date"),
+        ("soon", None, "malformed"),
+        ("inf", None, "infinite"),
+        ("", None, "missing"),
+    ],
+)
+def test_parse_retry_after(value, expected, test_id):
+    # Act / Assert
+    assert parse_retry_after(value) == expected, f"Failed on {test_id}"
+
+
+def test_parse_retry_after_reads_http_dates():
+    # Arrange
+    later = datetime.now(timezone.utc) + timedelta(seconds=90)
+
+    # Act
+    seconds = parse_retry_after(format_datetime(later, usegmt=True))
+
+    # Assert
+    assert seconds is not None and 80 < seconds <= 90
+
+
+def test_stream_raises_once_every_account_is_unavailable(pool):
+    # Arrange
+    def request(email, client):
+        check_account(
+            sent_to_login(httpx.Request("GET", "https://huggingface.co/chat"))
+        )
+        yield email
+
+    # Act / Assert
+    with pytest.raises(AccountUnavailableError):
+        list(pool.stream(request))
+    assert sorted(pool.cooldowns()) == sorted(email for email, _ in ACCOUNTS)
+
+
+def test_cooldowns_reach_pools_sharing_the_directory(pool):
+    # Arrange
+    other = SessionPool.from_directory(pool.directory)
+    limited = pool.accounts[0]
+    for account in other._accounts.values():
+        account.auth_manager.config.stat_interval = 0
+
+    # Act
+    pool.mark_unavailable(limited, 60)
+
+    # Assert
+    for _ in ACCOUNTS:
+        with other.lease() as (email, _):
+            assert email != limited
+    assert list(other.cooldowns()) == [limited]
+
+
+def test_errors_of_another_account_do_not_cool_the_leased_one_down(pool):
+    # Arrange
+    attempts = []
+    response = rate_limited(httpx.Request("GET", "https://huggingface.co"))
+
+    def request(email, client):
+        attempts.append(email)
+        # E.g. a coalesced leader's error, re-raised to this follower
+        check_account(response, "leader@example.com")
+        yield email
+
+    # Act
+    with pytest.raises(AccountUnavailableError) as error:
+        list(pool.stream(request))
+
+    # Assert
+    assert error.value.account == "leader@example.com"
+    assert len(attempts) == 1, "Follower failed over because of the leader's error"
+    assert pool.cooldowns() == {}
+
+
+def test_lease_checks_only_the_chosen_account_for_shared_cooldowns(pool, monkeypatch):
+    # Arrange
+    synced = []
+    monkeypatch.setattr(
+        _Account, "sync_cooldown", lambda account: synced.append(account.email)
+    )
+
+    # Act
+    with pool.lease() as (email, _):
+        pass
+
+    # Assert
+    assert synced == [email]
+
+
+def test_sign_in_authenticates_restored_accounts(pool):
+    # Arrange
+    restored = SessionPool.from_directory(pool.directory)
+
+    # Act
+    signed_in = restored.sign_in()
+
+    # Assert
+    assert sorted(signed_in) == sorted(email for email, _ in ACCOUNTS)
@@ -0,0 +1,77 @@
+# pytest test/test_stream.py
+
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import pytest
+
+from conversation.stream import StreamDecoder
+
+UPDATES = [
+    {"type": "status", "status": "started"},
+    {"type": "stream", "token": "Grüß"},
+    {"type": "stream", "token": " dich 👋"},
+    {"type": "finalAnswer", "text": "Grüß dich 👋"},
+]
+BODY = b"".join(json.dumps(u, ensure_ascii=False).encode() + b"\n" for u in UPDATES)
+
+
+@pytest.mark.parametrize("size", [1, 2, 7, 64, len(BODY)])
+def test_decode_across_chunk_boundaries(size):
+    # Arrange
+    chunks = [BODY[i : i + size] for i in range(0, len(BODY), size)]
+
+    # Act
+    updates = list(StreamDecoder().decode(chunks))
+
+    # Assert
+    assert updates == UPDATES
+
+
+def test_feed_returns_only_completed_frames():
+    # Arrange
+    decoder = StreamDecoder()
+
+    # Act
+    first = decoder.feed(b'{"type": "stream", "token": "Hel')
+    second = decoder.feed(b'lo"}\r\n\n{"type": "stream", ')
+
+    # Assert
+    assert first == []
+    assert second == [{"type": "stream", "token": "Hello"}]
+    assert decoder._buffer == bytearray(b'{"type": "stream", ')
+
+
+def test_finish_decodes_trailing_frame():
+    # Arrange
+    decoder = StreamDecoder()
+    decoder.feed(b'{"type": "finalAnswer", "text": "done"}')
+
+    # Act
+    updates = decoder.finish()
+
+    # Assert
+    assert updates == [{"type": "finalAnswer", "text": "done"}]
+    assert decoder.finish() == []
+
+
+def test_invalid_frame_raises():
+    # Arrange
+    decoder = StreamDecoder()
+
+    # Act / Assert
+    with pytest.raises(ValueError):
+        decoder.feed(b"not json\n")
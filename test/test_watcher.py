@@ -0,0 +1,54 @@
+# pytest test/test_watcher.py
+
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import queue
+
+import pytest
+
+from utils.backends import MemoryBackend
+from utils.config import Config
+from utils.watcher import ConfigWatcher
+
+
+@pytest.mark.parametrize(
+    "filename, test_id",
+    [
+        ("config.ini", "ini_inotify_or_poll"),
+        ("config.db", "sqlite_wal"),
+        (":memory:", "memory_poll"),
+    ],
+)
+def test_watcher_pushes_changes(tmp_path, filename, test_id):
+    # Arrange
+    backend = MemoryBackend() if filename == ":memory:" else None
+    path = filename if backend else str(tmp_path / filename)
+    watched = Config(filename=path, backend=backend)
+    writer = Config(filename=path, backend=backend)
+    received: "queue.Queue" = queue.Queue()
+
+    with ConfigWatcher(watched, poll_interval=0.05) as watcher:
+        watcher.subscribe(received.put)
+        assert watched.stat_interval == float("inf")
+
+        # Act
+        writer.set_token(token="pushed")
+
+        # Assert
+        snapshot = received.get(timeout=5)
+        assert snapshot.token == "pushed", f"Failed on {test_id}"
+        assert watched.get_token()["token"] == "pushed"
+
+    assert watched.stat_interval == 1.0
@@ -0,0 +1,280 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import configparser
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import stat
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from typing import IO, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# {section: {key: value}}
+Sections = Dict[str, Dict[str, str]]
+# ("set", section, key, value) or ("delete", section, None, None)
+Change = Tuple[str, str, Optional[str], Optional[str]]
+
+
+def _atomic_write(filename: str, write: Callable[[IO[str]], None]):
+    """Replaces `filename` through a synced temporary file in the same directory."""
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".config-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(filename):
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(filename).st_mode))
+        os.replace(tmp_path, filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _file_signature(filename: str) -> Optional[Tuple[int, int, int]]:
+    """Returns (mtime, inode, size) of a file, or None if it is missing."""
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_ino, st.st_size
+
+
+class ConfigBackend(ABC):
+    r"""
+    Storage backend interface for `utils.config.Config`.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    `Config` keeps the configuration in memory and hands every flush to its backend, both as
+    the complete set of sections and as the list of changes since the previous flush, so a
+    backend can either rewrite everything or only apply the changed rows.
+
+    ----
+
+    Attributes
+    ----------
+    lock_path : str
+        Path of the advisory lock file guarding logins for this storage.
+
+    Methods
+    -------
+    load() -> Optional[Sections]:
+        Returns the stored sections, or None if the storage does not exist yet.
+    save(sections: Sections, changes: List[Change]):
+        Persists the configuration.
+    signature() -> object:
+        Returns a value that changes whenever the storage is modified by someone else.
+    close():
+        Releases the resources held by the backend.
+    """
+
+    lock_path: str
+
+    @abstractmethod
+    def load(self) -> Optional[Sections]:
+        """Returns the stored sections, or None if the storage does not exist yet."""
+
+    @abstractmethod
+    def save(self, sections: Sections, changes: List[Change]):
+        """Persists the configuration."""
+
+    @abstractmethod
+    def signature(self) -> object:
+        """Returns a value that changes whenever the storage is modified by someone else."""
+
+    def close(self):
+        """Releases the resources held by the backend."""
+
+
+class IniBackend(ConfigBackend):
+    """Stores the configuration in an INI file that is atomically replaced on every flush."""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.lock_path = f"{filename}.lock"
+
+    def load(self) -> Optional[Sections]:
+        if not os.path.exists(self.filename):
+            return None
+        parser = configparser.ConfigParser()
+        parser.read(self.filename)
+        return {section: dict(parser[section]) for section in parser.sections()}
+
+    def save(self, sections: Sections, changes: List[Change]):
+        parser = configparser.ConfigParser()
+        parser.read_dict(sections)
+        _atomic_write(self.filename, parser.write)
+
+    def signature(self) -> object:
+        return _file_signature(self.filename)
+
+
+class JsonBackend(ConfigBackend):
+    """Stores the configuration in a JSON file that is atomically replaced on every flush."""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.lock_path = f"{filename}.lock"
+
+    def load(self) -> Optional[Sections]:
+        if not os.path.exists(self.filename):
+            return None
+        with open(self.filename) as f:
+            return json.load(f)
+
+    def save(self, sections: Sections, changes: List[Change]):
+        _atomic_write(
+            self.filename, lambda f: json.dump(sections, f, indent=2, sort_keys=True)
+        )
+
+    def signature(self) -> object:
+        return _file_signature(self.filename)
+
+
+class SqliteBackend(ConfigBackend):
+    """
+    Stores the configuration in an SQLite database in WAL mode.
+
+    Readers never block the writer, and a flush only upserts or deletes the rows that changed.
+    Every section also has a marker row with an empty key, so empty sections survive a reload.
+    """
+
+    def __init__(self, filename: str, timeout: float = 5.0):
+        self.filename = filename
+        self.lock_path = f"{filename}.lock"
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            filename, timeout=timeout, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS config ("
+            "section TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (section, key))"
+        )
+
+    def load(self) -> Optional[Sections]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT section, key, value FROM config ORDER BY rowid"
+            ).fetchall()
+        if not rows:
+            return None
+        sections: Sections = {}
+        for section, key, value in rows:
+            values = sections.setdefault(section, {})
+            if key:
+                values[key] = value
+        return sections
+
+    def save(self, sections: Sections, changes: List[Change]):
+        upsert = "INSERT OR REPLACE INTO config (section, key, value) VALUES (?, ?, ?)"
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                for op, section, key, value in changes:
+                    if op == "delete":
+                        self._connection.execute(
+                            "DELETE FROM config WHERE section = ?", (section,)
+                        )
+                    else:
+                        self._connection.execute(upsert, (section, key, value))
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO config (section, key, value) VALUES (?, '', '')",
+                    [(section,) for section in sections],
+                )
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def signature(self) -> object:
+        # data_version only changes when another connection commits
+        with self._lock:
+            return self._connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class MemoryBackend(ConfigBackend):
+    """
+    Keeps the configuration in process memory.
+
+    Several `Config` objects can share one instance to see each other's changes.
+    """
+
+    _ids = itertools.count()
+
+    def __init__(self) -> None:
+        self._sections: Optional[Sections] = None
+        self._version = 0
+        self._lock = threading.Lock()
+        self.lock_path = os.path.join(
+            tempfile.gettempdir(), f"config-memory-{os.getpid()}-{next(self._ids)}.lock"
+        )
+
+    def load(self) -> Optional[Sections]:
+        with self._lock:
+            if self._sections is None:
+                return None
+            return {section: dict(values) for section, values in self._sections.items()}
+
+    def save(self, sections: Sections, changes: List[Change]):
+        with self._lock:
+            self._sections = {
+                section: dict(values) for section, values in sections.items()
+            }
+            self._version += 1
+
+    def signature(self) -> object:
+        return self._version
+
+
+def backend_for(filename: str) -> ConfigBackend:
+    """
+    Returns the backend matching a configuration filename.
+
+    ':memory:' selects `MemoryBackend`, '.db', '.sqlite' and '.sqlite3' select `SqliteBackend`,
+    '.json' selects `JsonBackend` and everything else `IniBackend`.
+
+    Parameters
+    ----------
+        filename : str
+            The name of the configuration file.
+
+    Returns
+    -------
+    ConfigBackend
+        The backend storing the configuration.
+    """
+    if filename == ":memory:":
+        return MemoryBackend()
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in (".db", ".sqlite", ".sqlite3"):
+        return SqliteBackend(filename)
+    if extension == ".json":
+        return JsonBackend(filename)
+    return IniBackend(filename)
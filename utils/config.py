@@ -14,13 +14,66 @@
 
 
 import configparser
+import json
 import logging
 import os
-from typing import Dict, Optional
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from utils.backends import Change, ConfigBackend, backend_for
 
 logger = logging.getLogger(__name__)
 
 
+# Malformed rate limits already warned about, so a request loop does not repeat the warning
+_reported_rate_limits: Set[Tuple[str, str, Optional[str]]] = set()
+
+
+def _parse_rate_limit(
+    name: str, rate: str, burst: Optional[str]
+) -> Optional[Tuple[float, float]]:
+    """Parses a stored (rate, burst) pair, ignoring values that are not positive numbers."""
+    try:
+        parsed_rate = float(rate)
+        parsed_burst = float(burst) if burst else max(parsed_rate, 1.0)
+    except ValueError:
+        parsed_rate = parsed_burst = 0.0
+    # Written so that NaN fails the check as well
+    if parsed_rate > 0 and parsed_burst > 0:
+        return parsed_rate, parsed_burst
+    if (name, rate, burst) not in _reported_rate_limits:
+        _reported_rate_limits.add((name, rate, burst))
+        logger.warning(f"Ignoring invalid rate limit '{name}' ({rate}, {burst}).")
+    return None
+
+
+def _parse_expire_date(expire_date: str) -> Optional[datetime]:
+    """Parses a stored expire date into an aware datetime, treating naive values as UTC."""
+    if not expire_date:
+        return None
+    try:
+        expiry = datetime.fromisoformat(expire_date)
+    except ValueError:
+        logger.warning(f"Ignoring malformed token expire date '{expire_date}'.")
+        return None
+    if expiry.tzinfo is None:
+        expiry = expiry.replace(tzinfo=timezone.utc)
+    return expiry
+
+
+class ConfigSnapshot(NamedTuple):
+    """Immutable view of the LOGIN and TOKEN sections, parsed once per version of the file."""
+
+    email: str
+    password: str
+    token: str
+    expire_date: str
+    expires_at: Optional[datetime]
+
+
 class Config:
     r"""
     Configuration handler for Huggingface-Chat.
@@ -28,6 +81,14 @@ class Config:
 
     A class that handles reading from and writing to a configuration file.
 
+    One instance can be shared by threads: loading, setting and flushing hold a reentrant
+    lock, and a transaction holds it until it ends, so a background reload never drops the
+    changes of a concurrent writer.
+
+    The storage is pluggable (see `utils.backends`): by default the backend is chosen from the
+    filename, so 'config.ini' is an INI file, 'config.db' an SQLite database in WAL mode,
+    'config.json' a JSON file and ':memory:' lives in process memory only.
+
     ----
 
     Attributes
@@ -35,12 +96,24 @@ class Config:
     filename : str
         The name of the configuration file. Defaults to 'config.ini'.
     config : configparser.ConfigParser
-        An instance of the `configparser.ConfigParser` class used to read and write INI files.
+        An instance of the `configparser.ConfigParser` class holding the configuration in memory.
+    backend : ConfigBackend
+        The storage the configuration is loaded from and flushed to.
+    stat_interval : float
+        Minimum number of seconds between two checks of the file for external changes.
 
     Methods
     -------
+    snapshot -> ConfigSnapshot:
+        Returns the parsed LOGIN and TOKEN values, re-parsing only when the file changed.
+    refresh(force: bool = False) -> bool:
+        Re-parses the configuration file if it changed on disk.
+    transaction():
+        Context manager that buffers changes and writes the file once on exit.
     config_exists() -> bool:
         Checks if the configuration file has values for email and password.
+    reload():
+        Re-reads the configuration file, picking up changes made by other processes.
     get_login_details() -> Dict[str, str]:
         Returns login details as a dictionary.
     set_login_details(**kwargs):
@@ -49,6 +122,10 @@ class Config:
         Returns token information as a dictionary.
     set_token(**kwargs):
         Sets token information using kwargs.
+    get_cookies() -> Dict[str, str]:
+        Returns the cookies stored by the last login.
+    set_cookies(cookies: Dict[str, str]):
+        Stores the cookies of a login, so other processes can reuse the session.
     save_auth_data(*args, **kwargs):
         Saves authentication data.
     load_auth_data() -> Dict[str, Optional[str]]:
@@ -59,8 +136,26 @@ class Config:
         Deletes a section from the configuration file.
     is_logged_in() -> bool:
         Checks whether there is a valid token present.
+    token_expiry() -> Optional[datetime]:
+        Returns the stored token expiry as an aware datetime.
+    is_token_valid(margin: float = 0) -> bool:
+        Checks whether the stored token is present and not about to expire.
     user_credentials() -> Dict[str, Optional[str]]:
         Returns user credentials as a dictionary.
+    get_cooldown() -> Optional[datetime]:
+        Returns the time until which the account is cooling down.
+    set_cooldown(until: datetime | None):
+        Stores or clears the cooldown of the account.
+    get_rate_limit(model: str | None = None) -> Optional[Tuple[float, float]]:
+        Returns the configured request rate and burst size.
+    set_rate_limit(rate: float, burst: float, model: str | None = None):
+        Sets the request rate and burst size, globally or for one model.
+    get_tenants() -> Dict[str, Tuple[str, float]]:
+        Returns the API key and scheduling weight of every gateway tenant.
+    set_tenant(name: str, api_key: str, weight: float = 1.0):
+        Adds or updates a gateway tenant.
+    for_account(email: str, directory: str = "accounts") -> Config:
+        Returns the configuration of one account of a multi-account setup.
 
     Example
     -------
@@ -71,7 +166,12 @@ class Config:
     >>> config.update_tokens_data(token="TOKEN", expire_date="2024-06-09")
     """
 
-    def __init__(self, filename="config.ini"):
+    def __init__(
+        self,
+        filename="config.ini",
+        stat_interval: float = 1.0,
+        backend: Optional[ConfigBackend] = None,
+    ):
         """
         Constructs all the necessary attributes for the Config object.
 
@@ -79,14 +179,58 @@ class Config:
         ----------
             filename : str
                 The name of the configuration file. Defaults to 'config.ini'.
+            stat_interval : float
+                Minimum number of seconds between two checks of the file for external changes.
+                Defaults to 1.0.
+            backend : ConfigBackend, optional
+                The storage to use. Defaults to the backend matching `filename`.
         """
         self.filename = filename
+        self.stat_interval = stat_interval
+        self.backend = backend or backend_for(filename)
         self.config = configparser.ConfigParser()
+        self._lock = threading.RLock()
+        self._transaction_depth = 0
+        self._dirty = False
+        self._changes: List[Change] = []
+        self._signature: object = None
+        self._stored = False
+        self._checked_at = time.monotonic()
+        self._snapshot: ConfigSnapshot
+        self._load()
 
-        if not os.path.exists(self.filename):
-            self._create_config()
-        else:
-            self.config.read(self.filename)
+    @property
+    def lock_path(self) -> str:
+        """Path of the advisory lock file guarding logins for this configuration."""
+        return self.backend.lock_path
+
+    @classmethod
+    def for_account(
+        cls, email: str, directory: str = "accounts", suffix: str = ".ini"
+    ) -> "Config":
+        """
+        Returns the configuration of one account of a multi-account setup.
+
+        Every account keeps its own LOGIN and TOKEN sections in `<directory>/<email>.ini`, so
+        token refreshes of one account never rewrite the file of another.
+
+        Parameters
+        ----------
+            email : str
+                The email address of the account.
+            directory : str
+                The directory holding one configuration file per account. Defaults to 'accounts'.
+            suffix : str
+                The file suffix, which selects the storage backend. Defaults to '.ini'.
+
+        Returns
+        -------
+        Config
+            The configuration of the account.
+        """
+        os.makedirs(directory, exist_ok=True)
+        name = "".join(c if c.isalnum() or c in "@.-_" else "_" for c in email)
+        return cls(filename=os.path.join(directory, f"{name}{suffix}"))
 
     def _create_config(self):
         """Creates a default configuration file."""
@@ -94,6 +238,138 @@ class Config:
         self.config["LOGIN"] = {}
         self.config["TOKEN"] = {}
 
+    def _load(self):
+        """Parses the stored configuration and rebuilds the snapshot."""
+        with self._lock:
+            # Take the signature first: a write racing with the read then only causes one extra re-parse
+            self._signature = self.backend.signature()
+            self._changes = []
+            sections = self.backend.load()
+            self._stored = sections is not None
+            # Readers without the lock see the old or the new configuration, never a partial one
+            config = configparser.ConfigParser()
+            if sections is not None:
+                config.read_dict(sections)
+            self.config = config
+            if sections is None:
+                self._create_config()
+            self._update_snapshot()
+
+    def _update_snapshot(self):
+        """Rebuilds the snapshot from the in-memory configuration."""
+        expire_date = self.config.get("TOKEN", "expire_date", fallback="")
+        self._snapshot = ConfigSnapshot(
+            email=self.config.get("LOGIN", "email", fallback=""),
+            password=self.config.get("LOGIN", "password", fallback=""),
+            token=self.config.get("TOKEN", "token", fallback=""),
+            expire_date=expire_date,
+            expires_at=_parse_expire_date(expire_date),
+        )
+
+    @property
+    def snapshot(self) -> ConfigSnapshot:
+        """
+        Returns the parsed LOGIN and TOKEN values, re-parsing only when the file changed.
+
+        The file is checked for external changes at most once every `stat_interval` seconds.
+
+        Returns
+        -------
+        ConfigSnapshot
+            The current values of the configuration.
+        """
+        self._refresh_if_due()
+        return self._snapshot
+
+    def _refresh_if_due(self):
+        if time.monotonic() - self._checked_at >= self.stat_interval:
+            self.refresh()
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Re-parses the configuration if it changed in storage (e.g. the file's mtime or inode).
+
+        Parameters
+        ----------
+            force : bool
+                Re-parse the file even if it looks unchanged. Defaults to False.
+
+        Returns
+        -------
+        bool
+            True if the file was re-parsed, False otherwise.
+        """
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if self._transaction_depth:
+                return False
+            if not force and self.backend.signature() == self._signature:
+                return False
+            self.reload()
+            return True
+
+    @contextmanager
+    def transaction(self) -> Iterator["Config"]:
+        """
+        Context manager that buffers changes and writes the file once on exit.
+
+        Transactions can be nested; only the outermost one writes. If the block raises, the
+        buffered changes are rolled back and nothing is written.
+
+        Yields
+        ------
+        Config
+            The configuration itself.
+        """
+        with self._lock:
+            state = {s: dict(self.config[s]) for s in self.config.sections()}
+            changes = len(self._changes)
+            self._transaction_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._transaction_depth -= 1
+                logger.debug("Rolling back configuration transaction.")
+                config = configparser.ConfigParser()
+                config.read_dict(state)
+                self.config = config
+                del self._changes[changes:]
+                self._update_snapshot()
+                if self._transaction_depth == 0:
+                    self._dirty = False
+                raise
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0 and self._dirty:
+                self._flush()
+
+    def _write(self):
+        """Persists the configuration, or defers it until the open transaction ends."""
+        if self._transaction_depth:
+            self._dirty = True
+        else:
+            self._flush()
+
+    def _flush(self):
+        """Hands the configuration and the changes since the last flush to the backend."""
+        with self._lock:
+            sections = {s: dict(self.config[s]) for s in self.config.sections()}
+            self.backend.save(sections, self._changes)
+            self._changes = []
+            self._dirty = False
+            self._stored = True
+            self._signature = self.backend.signature()
+
+    def reload(self):
+        """
+        Re-reads the configuration file, picking up changes made by other processes.
+
+        Changes buffered by an open transaction are discarded.
+        """
+        logger.debug("Reloading configuration file.")
+        with self._lock:
+            self._dirty = False
+            self._load()
+
     def config_exists(self, config_name: str = "config.ini") -> bool:
         """
         Checks if the configuration file exists and has values for email and password.
@@ -109,6 +385,9 @@ class Config:
             True if the configuration file exists and has values for email and password, False otherwise.
         """
         logger.debug("Checking if configuration file exists.")
+        if os.path.abspath(config_name) == os.path.abspath(self.filename):
+            snapshot = self.snapshot
+            return self._stored and bool(snapshot.email and snapshot.password)
         # check if config_name file exist in the current directory
         if os.path.exists(config_name):
             # read config_name file
@@ -123,6 +402,14 @@ class Config:
                 return True
         return False
 
+    def _set(self, section: str, key: str, value: str):
+        """Sets a value in memory and records the change for the next flush."""
+        with self._lock:
+            if not self.config.has_section(section):
+                self.config.add_section(section)
+            self.config[section][key] = value
+            self._changes.append(("set", section, key, value))
+
     def get_login_details(self) -> Dict[str, str]:
         """
         Returns login details as a dictionary.
@@ -133,10 +420,8 @@ class Config:
             A dictionary of login details.
         """
         logger.debug("Retrieving login details.")
-        return {
-            "email": self.config.get("LOGIN", "email", fallback=""),
-            "password": self.config.get("LOGIN", "password", fallback=""),
-        }
+        snapshot = self.snapshot
+        return {"email": snapshot.email, "password": snapshot.password}
 
     def set_login_details(self, **kwargs):
         """
@@ -149,13 +434,14 @@ class Config:
         """
         logger.debug(f"Setting login details ({', '.join(kwargs)}).")
         allowed_keys = ("email", "password")
-        for key, value in kwargs.items():
-            assert key in allowed_keys, f"Invalid keyword argument '{key}'."
-            if value is not None:
-                self.config["LOGIN"][key] = value
+        with self._lock:
+            for key, value in kwargs.items():
+                assert key in allowed_keys, f"Invalid keyword argument '{key}'."
+                if value is not None:
+                    self._set("LOGIN", key, value)
 
-        with open(self.filename, "w") as f:
-            self.config.write(f)
+            self._update_snapshot()
+            self._write()
 
     def get_token(self) -> Dict[str, str]:
         """
@@ -167,10 +453,8 @@ class Config:
             A dictionary of token information.
         """
         logger.debug("Retrieving token information.")
-        return {
-            "token": self.config.get("TOKEN", "token", fallback=""),
-            "expire_date": self.config.get("TOKEN", "expire_date", fallback=""),
-        }
+        snapshot = self.snapshot
+        return {"token": snapshot.token, "expire_date": snapshot.expire_date}
 
     def set_token(self, **kwargs):
         """
@@ -183,13 +467,43 @@ class Config:
         """
         logger.debug(f"Setting token information ({', '.join(kwargs)}).")
         allowed_keys = ("token", "expire_date")
-        for key, value in kwargs.items():
-            assert key in allowed_keys, f"Invalid keyword argument '{key}'."
-            if value is not None:
-                self.config["TOKEN"][key] = value
+        with self._lock:
+            for key, value in kwargs.items():
+                assert key in allowed_keys, f"Invalid keyword argument '{key}'."
+                if value is not None:
+                    self._set("TOKEN", key, value)
+
+            self._update_snapshot()
+            self._write()
+
+    def get_cookies(self) -> Dict[str, str]:
+        """
+        Returns the cookies stored by the last login.
+
+        Returns
+        -------
+        dict
+            A dictionary of cookie names and values.
+        """
+        self._refresh_if_due()
+        stored = self.config.get("COOKIES", "jar", fallback="")
+        return json.loads(stored) if stored else {}
 
-        with open(self.filename, "w") as f:
-            self.config.write(f)
+    def set_cookies(self, cookies: Dict[str, str]):
+        """
+        Stores the cookies of a login, so other processes can reuse the session.
+
+        Parameters
+        ----------
+            cookies : Dict[str, str]
+                The cookie names and values.
+        """
+        logger.debug(f"Storing {len(cookies)} cookies.")
+        # One JSON value keeps the names' case; '%' would trip configparser's interpolation
+        jar = json.dumps(cookies, sort_keys=True).replace("%", "\\u0025")
+        with self._lock:
+            self._set("COOKIES", "jar", jar)
+            self._write()
 
     def save_auth_data(self, *args, **kwargs):
         """
@@ -213,10 +527,8 @@ class Config:
         dict
             A dictionary of authentication data.
         """
-        return {
-            "email": self.get_login_details().get("email"),
-            "password": self.get_login_details().get("password"),
-        }
+        snapshot = self.snapshot
+        return {"email": snapshot.email, "password": snapshot.password}
 
     def update_tokens_data(self, *args, **kwargs):
         """
@@ -241,9 +553,11 @@ class Config:
                 The name of the section to delete.
         """
         logger.debug(f"Deleting section '{section}'.")
-        self.config.remove_section(section)
-        with open(self.filename, "w") as f:
-            self.config.write(f)
+        with self._lock:
+            self.config.remove_section(section)
+            self._changes.append(("delete", section, None, None))
+            self._update_snapshot()
+            self._write()
 
     @property
     def is_logged_in(self) -> bool:
@@ -256,7 +570,44 @@ class Config:
             True if there is a valid token present, False otherwise.
         """
         logger.debug("Checking if logged in.")
-        return bool(self.get_token().get("token"))
+        return bool(self.snapshot.token)
+
+    def token_expiry(self) -> Optional[datetime]:
+        """
+        Returns the stored token expiry as an aware datetime.
+
+        Dates without a time or timezone (e.g. '2024-06-09') are interpreted as UTC.
+
+        Returns
+        -------
+        datetime | None
+            The expiry of the stored token, or None if it is unknown or malformed.
+        """
+        return self.snapshot.expires_at
+
+    def is_token_valid(self, margin: float = 0) -> bool:
+        """
+        Checks whether the stored token is present and not about to expire.
+
+        A token without a known expiry is treated as valid.
+
+        Parameters
+        ----------
+            margin : float
+                Number of seconds the token has to stay valid for. Defaults to 0.
+
+        Returns
+        -------
+        bool
+            True if a token is stored and does not expire within `margin` seconds, False otherwise.
+        """
+        snapshot = self.snapshot
+        if not snapshot.token:
+            return False
+        expiry = snapshot.expires_at
+        if expiry is None:
+            return True
+        return expiry - timedelta(seconds=margin) > datetime.now(timezone.utc)
 
     @property
     def user_credentials(self) -> Dict[str, Optional[str]]:
@@ -268,10 +619,137 @@ class Config:
         dict
             A dictionary of user credentials.
         """
-        return {
-            "email": self.get_login_details().get("email"),
-            "password": self.get_login_details().get("password"),
-        }
+        snapshot = self.snapshot
+        return {"email": snapshot.email, "password": snapshot.password}
+
+    def get_cooldown(self) -> Optional[datetime]:
+        """
+        Returns the time until which the account is cooling down.
+
+        Returns
+        -------
+        datetime | None
+            The end of the cooldown, or None if none is stored.
+        """
+        self._refresh_if_due()
+        return _parse_expire_date(self.config.get("COOLDOWN", "until", fallback=""))
+
+    def set_cooldown(self, until: Optional[datetime]):
+        """
+        Stores or clears the cooldown of the account.
+
+        Parameters
+        ----------
+            until : datetime | None
+                The end of the cooldown, or None to clear it.
+        """
+        with self._lock:
+            if until is None:
+                if self.config.has_section("COOLDOWN"):
+                    self.delete_section("COOLDOWN")
+                return
+            logger.debug(f"Setting cooldown until {until.isoformat()}.")
+            self._set("COOLDOWN", "until", until.isoformat())
+            self._write()
+
+    def get_rate_limit(
+        self, model: Optional[str] = None
+    ) -> Optional[Tuple[float, float]]:
+        """
+        Returns the configured request rate and burst size.
+
+        The RATE_LIMIT section holds the defaults as 'rate' (requests per second) and 'burst'
+        (requests allowed back to back), and optional per-model overrides as
+        '<model> = <rate>, <burst>'. Values that are not positive numbers are ignored with a
+        warning, falling back to the defaults.
+
+        Parameters
+        ----------
+            model : str, optional
+                The model to look up an override for. Defaults to None (defaults only).
+
+        Returns
+        -------
+        Tuple[float, float] | None
+            The (rate, burst) pair, or None if no rate limit is configured.
+        """
+        self._refresh_if_due()
+        if not self.config.has_section("RATE_LIMIT"):
+            return None
+        section = self.config["RATE_LIMIT"]
+        override = section.get(model) if model else None
+        if override:
+            rate, _, burst = override.partition(",")
+            limits = _parse_rate_limit(
+                str(model), rate.strip(), burst.strip() or rate.strip()
+            )
+            if limits is not None:
+                return limits
+        if "rate" not in section:
+            return None
+        return _parse_rate_limit("rate", section["rate"], section.get("burst"))
+
+    def set_rate_limit(self, rate: float, burst: float, model: Optional[str] = None):
+        """
+        Sets the request rate and burst size, globally or for one model.
+
+        Parameters
+        ----------
+            rate : float
+                Number of requests per second.
+            burst : float
+                Number of requests allowed back to back.
+            model : str, optional
+                The model the limit applies to. Defaults to None (the defaults).
+        """
+        logger.debug(f"Setting rate limit for {model or 'all models'}.")
+        with self._lock:
+            if model:
+                self._set("RATE_LIMIT", model, f"{rate}, {burst}")
+            else:
+                self._set("RATE_LIMIT", "rate", str(rate))
+                self._set("RATE_LIMIT", "burst", str(burst))
+            self._write()
+
+    def get_tenants(self) -> Dict[str, Tuple[str, float]]:
+        """
+        Returns the API key and scheduling weight of every gateway tenant.
+
+        The TENANTS section holds one '<name> = <api key>, <weight>' line per tenant; the
+        weight defaults to 1. Names are case-insensitive.
+
+        Returns
+        -------
+        dict
+            A dictionary mapping every tenant name to its (API key, weight).
+        """
+        self._refresh_if_due()
+        if not self.config.has_section("TENANTS"):
+            return {}
+        tenants: Dict[str, Tuple[str, float]] = {}
+        for name, value in self.config.items("TENANTS", raw=True):
+            key, _, weight = value.partition(",")
+            tenants[name] = (key.strip(), float(weight or 1.0))
+        return tenants
+
+    def set_tenant(self, name: str, api_key: str, weight: float = 1.0):
+        """
+        Adds or updates a gateway tenant.
+
+        Parameters
+        ----------
+            name : str
+                The name the tenant is reported as.
+            api_key : str
+                The bearer token the tenant authenticates with.
+            weight : float
+                The tenant's share of the upstream slots relative to the others.
+                Defaults to 1.0.
+        """
+        logger.debug(f"Setting tenant '{name}'.")
+        with self._lock:
+            self._set("TENANTS", name, f"{api_key}, {weight}")
+            self._write()
 
 
 if __name__ == "__main__":
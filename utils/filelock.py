@@ -0,0 +1,155 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import logging
+import os
+import threading
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+_thread_locks: Dict[str, threading.Lock] = {}
+_thread_locks_guard = threading.Lock()
+
+
+def _thread_lock(path: str) -> threading.Lock:
+    """Returns the in-process lock guarding `path`."""
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(path, threading.Lock())
+
+
+class FileLock:
+    r"""
+    Advisory inter-process lock.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A class that serialises a critical section across threads (through an in-process lock) and
+    across processes (through an advisory lock on a lock file). The lock is not reentrant, and
+    one instance must not be shared between threads.
+
+    ----
+
+    Attributes
+    ----------
+    path : str
+        Absolute path of the lock file.
+
+    Methods
+    -------
+    acquire(blocking: bool = True) -> bool:
+        Takes the lock, waiting for it unless `blocking` is False.
+    release():
+        Releases the lock.
+
+    Example
+    -------
+    >>> from utils.filelock import FileLock
+    >>>
+    >>> with FileLock("config.ini.lock"):
+    ...     pass
+    """
+
+    def __init__(self, path: str):
+        """
+        Constructs all the necessary attributes for the FileLock object.
+
+        Parameters
+        ----------
+            path : str
+                Path of the lock file. It is created if it does not exist.
+        """
+        self.path = os.path.abspath(path)
+        self._thread_lock = _thread_lock(self.path)
+        self._fd: Optional[int] = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """
+        Takes the lock, waiting for it unless `blocking` is False.
+
+        Parameters
+        ----------
+            blocking : bool
+                Wait until the lock is free. Defaults to True.
+
+        Returns
+        -------
+        bool
+            Whether the lock is now held by the caller; always True when blocking.
+        """
+        if not self._thread_lock.acquire(blocking):
+            return False
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if not self._lock_file(fd, blocking):
+                    os.close(fd)
+                    self._thread_lock.release()
+                    return False
+            except BaseException:
+                os.close(fd)
+                raise
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        self._fd = fd
+        logger.debug(f"Acquired lock '{self.path}'.")
+        return True
+
+    @staticmethod
+    def _lock_file(fd: int, blocking: bool) -> bool:
+        if fcntl is not None:
+            try:
+                fcntl.flock(
+                    fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+                )
+            except BlockingIOError:
+                return False
+            return True
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+                return True
+            except OSError:  # LK_LOCK gives up after ~10 seconds
+                if not blocking:
+                    return False
+
+    def release(self):
+        """Releases the lock."""
+        fd, self._fd = self._fd, None
+        if fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+            self._thread_lock.release()
+            logger.debug(f"Released lock '{self.path}'.")
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
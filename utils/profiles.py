@@ -0,0 +1,334 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import glob
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterator, NamedTuple, Optional
+
+from utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class Profile(NamedTuple):
+    """Index entry of one named account profile."""
+
+    name: str
+    email: str
+    filename: str
+
+
+class ProfileIndex:
+    r"""
+        Index of named account profiles.
+        ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+        A class that maps profile names and emails to per-account configuration files. Only the
+        small index (name, email, filename) is read up front, from an SQLite table ('.profiles.db')
+        next to the account files; a profile's credentials and token are parsed the first time
+        its `Config` is requested. Lookups by name or email are dictionary lookups, preceded by a
+    cheap `PRAGMA data_version` check that re-reads the index after another process changed it.
+
+        ----
+
+        Attributes
+        ----------
+        directory : str
+            The directory holding the index and one configuration file per profile.
+        suffix : str
+            The suffix of the profile configuration files, which selects their storage backend.
+
+        Methods
+        -------
+        add(name: str, email: str, password: str) -> Profile:
+            Creates or updates a profile and stores its credentials.
+        remove(name: str):
+            Removes a profile and its configuration file.
+        get(name: str) -> Optional[Profile]:
+            Returns the profile with the given name.
+        by_email(email: str) -> Optional[Profile]:
+            Returns the profile with the given email.
+        config(name: str) -> Config:
+            Returns the configuration of a profile, loading it on first access.
+        import_directory() -> int:
+            Adds every account configuration in `directory` that is not indexed yet.
+        refresh() -> bool:
+            Re-reads the index if another process changed it.
+
+        Example
+        -------
+        >>> from utils.profiles import ProfileIndex
+        >>>
+        >>> profiles = ProfileIndex()
+        >>> profiles.add("main", "user@example.com", "PASS")
+        >>> profiles.by_email("user@example.com").name
+        'main'
+        >>> profiles.config("main").get_token()
+    """
+
+    def __init__(self, directory: str = "accounts", suffix: str = ".ini"):
+        """
+        Constructs all the necessary attributes for the ProfileIndex object.
+
+        Parameters
+        ----------
+            directory : str
+                The directory holding the index and one configuration file per profile.
+                Defaults to 'accounts'.
+            suffix : str
+                The suffix of the profile configuration files. Defaults to '.ini'.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.suffix = suffix
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(
+            # Dot-file, so globs over the account files never pick up the index
+            os.path.join(directory, ".profiles.db"),
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS profiles ("
+            "name TEXT PRIMARY KEY, email TEXT NOT NULL UNIQUE, filename TEXT NOT NULL)"
+        )
+        self._by_name: Dict[str, Profile] = {}
+        self._by_email: Dict[str, str] = {}
+        self._configs: Dict[str, Config] = {}
+        self._version: Optional[int] = None
+        self.refresh()
+
+    def _data_version(self) -> int:
+        return self._connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def refresh(self) -> bool:
+        """
+        Re-reads the index if another process changed it.
+
+        Returns
+        -------
+        bool
+            True if the index was re-read, False otherwise.
+        """
+        with self._lock:
+            version = self._data_version()
+            if version == self._version:
+                return False
+            rows = self._connection.execute(
+                "SELECT name, email, filename FROM profiles"
+            ).fetchall()
+            self._by_name = {row[0]: Profile(*row) for row in rows}
+            self._by_email = {
+                profile.email: name for name, profile in self._by_name.items()
+            }
+            # Drop cached configurations of profiles that were removed or moved
+            for name in list(self._configs):
+                profile = self._by_name.get(name)
+                if profile is None or profile.filename != self._configs[name].filename:
+                    self._configs.pop(name).backend.close()
+            self._version = version
+            logger.debug(f"Loaded profile index with {len(rows)} profiles.")
+            return True
+
+    def add(self, name: str, email: str, password: str) -> Profile:
+        """
+        Creates or updates a profile and stores its credentials.
+
+        Parameters
+        ----------
+            name : str
+                The name of the profile.
+            email : str
+                User's email address
+            password : str
+                User's password
+
+        Returns
+        -------
+        Profile
+            The index entry of the profile.
+        """
+        with self._lock:
+            config = Config.for_account(name, self.directory, self.suffix)
+            config.set_login_details(email=email, password=password)
+            profile = Profile(name, email, config.filename)
+            self._connection.execute(
+                "INSERT OR REPLACE INTO profiles (name, email, filename) VALUES (?, ?, ?)",
+                profile,
+            )
+            # REPLACE also drops another profile that used the same email
+            owner = self._by_email.get(email)
+            if owner is not None and owner != name:
+                self._by_name.pop(owner, None)
+                self._close_config(owner)
+            previous = self._by_name.get(name)
+            if previous is not None:
+                self._by_email.pop(previous.email, None)
+            if self._configs.get(name) is not config:
+                self._close_config(name)
+            self._by_name[name] = profile
+            self._by_email[email] = name
+            self._configs[name] = config
+            return profile
+
+    def remove(self, name: str):
+        """
+        Removes a profile and its configuration file.
+
+        Parameters
+        ----------
+            name : str
+                The name of the profile.
+        """
+        with self._lock:
+            profile = self._by_name.pop(name, None)
+            if profile is None:
+                return
+            self._by_email.pop(profile.email, None)
+            self._close_config(name)
+            self._connection.execute("DELETE FROM profiles WHERE name = ?", (name,))
+            if os.path.exists(profile.filename):
+                os.unlink(profile.filename)
+
+    def _close_config(self, name: str):
+        config = self._configs.pop(name, None)
+        if config is not None:
+            config.backend.close()
+
+    def get(self, name: str) -> Optional[Profile]:
+        """
+        Returns the profile with the given name.
+
+        Parameters
+        ----------
+            name : str
+                The name of the profile.
+
+        Returns
+        -------
+        Profile | None
+            The index entry, or None if there is no such profile.
+        """
+        self.refresh()
+        return self._by_name.get(name)
+
+    def by_email(self, email: str) -> Optional[Profile]:
+        """
+        Returns the profile with the given email.
+
+        Parameters
+        ----------
+            email : str
+                The email address of the profile.
+
+        Returns
+        -------
+        Profile | None
+            The index entry, or None if there is no such profile.
+        """
+        self.refresh()
+        name = self._by_email.get(email)
+        return None if name is None else self._by_name.get(name)
+
+    def config(self, name: str) -> Config:
+        """
+        Returns the configuration of a profile, loading it on first access.
+
+        Parameters
+        ----------
+            name : str
+                The name of the profile.
+
+        Raises
+        ------
+        KeyError
+            If there is no profile with the given name.
+
+        Returns
+        -------
+        Config
+            The configuration holding the profile's credentials and token.
+        """
+        self.refresh()
+        config = self._configs.get(name)
+        if config is None:
+            with self._lock:
+                config = self._configs.get(name)
+                if config is None:
+                    config = Config(filename=self._by_name[name].filename)
+                    self._configs[name] = config
+        return config
+
+    def import_directory(self) -> int:
+        """
+        Adds every account configuration in `directory` that is not indexed yet.
+
+        The file name without suffix becomes the profile name.
+
+        Returns
+        -------
+        int
+            The number of profiles added.
+        """
+        added = 0
+        with self._lock:
+            self.refresh()
+            known = {profile.filename for profile in self._by_name.values()}
+            for filename in sorted(
+                glob.glob(os.path.join(self.directory, f"*{self.suffix}"))
+            ):
+                if filename in known:
+                    continue
+                config = Config(filename=filename)
+                try:
+                    email = config.get_login_details()["email"]
+                finally:
+                    config.backend.close()
+                if not email or email in self._by_email:
+                    continue
+                name = os.path.basename(filename)[: -len(self.suffix)]
+                profile = Profile(name, email, filename)
+                self._connection.execute(
+                    "INSERT OR IGNORE INTO profiles (name, email, filename) VALUES (?, ?, ?)",
+                    profile,
+                )
+                self._by_name[name] = profile
+                self._by_email[email] = name
+                added += 1
+        return added
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self._by_name)
+
+    def __contains__(self, name: object) -> bool:
+        self.refresh()
+        return name in self._by_name
+
+    def __iter__(self) -> Iterator[Profile]:
+        self.refresh()
+        return iter(list(self._by_name.values()))
+
+    def close(self):
+        """Closes the index and every loaded profile configuration."""
+        with self._lock:
+            for config in self._configs.values():
+                config.backend.close()
+            self._configs.clear()
+            self._connection.close()
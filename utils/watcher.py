@@ -0,0 +1,247 @@
+# Copyright 2024 EvickaStudio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+from typing import Callable, List, Optional
+
+from utils.config import Config, ConfigSnapshot
+
+logger = logging.getLogger(__name__)
+
+# From <sys/inotify.h>
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_EVENT_HEADER = struct.Struct("iIII")
+
+Subscriber = Callable[[ConfigSnapshot], None]
+
+
+class _Inotify:
+    """Minimal ctypes binding watching one directory with inotify."""
+
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for '{directory}'")
+
+    def read_names(self) -> List[str]:
+        """Returns the file names of all pending events."""
+        names: List[str] = []
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return names
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                names.append(os.fsdecode(data[offset : offset + length].rstrip(b"\0")))
+                offset += length
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ConfigWatcher:
+    r"""
+    Hot-reload watcher for `Config`.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A daemon thread that re-parses the configuration as soon as another process changes it and
+    pushes the new snapshot to subscribers. File-based storage is watched with inotify where
+    available; everywhere else, and as a safety net for missed events, the storage signature is
+    polled every `poll_interval` seconds.
+
+    While the watcher runs, the configuration no longer stats its file on reads.
+
+    ----
+
+    Attributes
+    ----------
+    config : Config
+        The configuration to keep up to date.
+    poll_interval : float
+        Number of seconds between two checks when no change notification arrives.
+
+    Methods
+    -------
+    subscribe(callback: Callable[[ConfigSnapshot], None]) -> Callable[[], None]:
+        Registers a callback for changes and returns a function that unregisters it.
+    start():
+        Starts the background thread.
+    stop():
+        Stops the background thread and waits for it to finish.
+
+    Example
+    -------
+    >>> from utils.watcher import ConfigWatcher
+    >>>
+    >>> watcher = ConfigWatcher(config)
+    >>> unsubscribe = watcher.subscribe(lambda snapshot: print(snapshot.token))
+    >>> watcher.start()
+    """
+
+    def __init__(self, config: Config, poll_interval: float = 1.0):
+        """
+        Constructs all the necessary attributes for the ConfigWatcher object.
+
+        Parameters
+        ----------
+            config : Config
+                The configuration to keep up to date.
+            poll_interval : float
+                Number of seconds between two checks when no change notification arrives.
+                Defaults to 1.0.
+        """
+        self.config = config
+        self.poll_interval = poll_interval
+        self._subscribers: List[Subscriber] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._wake_r, self._wake_w = -1, -1
+        self._stat_interval = config.stat_interval
+
+    def subscribe(self, callback: Subscriber) -> Callable[[], None]:
+        """
+        Registers a callback for changes and returns a function that unregisters it.
+
+        Parameters
+        ----------
+            callback : Callable[[ConfigSnapshot], None]
+                Called from the watcher thread with the new snapshot after every change.
+
+        Returns
+        -------
+        Callable[[], None]
+            A function that unregisters the callback.
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+
+        return unsubscribe
+
+    def _open_inotify(self) -> Optional[_Inotify]:
+        filename = getattr(self.config.backend, "filename", None)
+        if not sys.platform.startswith("linux") or not filename:
+            return None
+        try:
+            return _Inotify(os.path.dirname(os.path.abspath(filename)) or ".")
+        except (OSError, AttributeError) as e:
+            logger.debug(f"inotify unavailable, polling instead: {str(e)}")
+            return None
+
+    def _check(self):
+        try:
+            changed = self.config.refresh()
+        except Exception as e:
+            logger.error(f"Failed to reload configuration: {str(e)}")
+            return
+        if not changed:
+            return
+        logger.debug("Configuration changed, notifying subscribers.")
+        snapshot = self.config.snapshot
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logger.error(f"Configuration subscriber failed: {str(e)}")
+
+    def _poll(self):
+        while not self._stop_event.wait(self.poll_interval):
+            self._check()
+
+    def _watch(self, inotify: _Inotify):
+        # SQLite writes land in '<name>-wal', so match on the prefix
+        basename = os.path.basename(self.config.filename)
+        try:
+            while True:
+                ready, _, _ = select.select(
+                    [self._wake_r, inotify.fd], [], [], self.poll_interval
+                )
+                if self._wake_r in ready:
+                    return
+                if inotify.fd in ready:
+                    names = inotify.read_names()
+                    if not any(name.startswith(basename) for name in names):
+                        continue
+                self._check()
+        finally:
+            inotify.close()
+
+    def start(self):
+        """Starts the background thread."""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        inotify = self._open_inotify()
+        if inotify is not None:
+            self._wake_r, self._wake_w = os.pipe()
+            self._thread = threading.Thread(
+                target=self._watch, args=(inotify,), name="config-watcher", daemon=True
+            )
+        else:
+            self._thread = threading.Thread(
+                target=self._poll, name="config-watcher", daemon=True
+            )
+        self._stat_interval = self.config.stat_interval
+        self.config.stat_interval = float("inf")
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background thread and waits for it to finish."""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        if self._wake_w != -1:
+            os.write(self._wake_w, b"\0")
+        self._thread.join()
+        self._thread = None
+        if self._wake_w != -1:
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+            self._wake_r, self._wake_w = -1, -1
+        self.config.stat_interval = self._stat_interval
+
+    def __enter__(self) -> "ConfigWatcher":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()